@@ -0,0 +1,117 @@
+"""
+Writes trials on a background thread, so that saving a trial never stalls the frame loop
+"""
+
+import atexit
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class AsyncTrialWriter:
+    def __init__(self, recorder, maxQueue = 32):
+        """
+        Wraps a recorder (CsvTrialRecorder or TrialStore): write_trial, write_stream and write_timing only put
+        the data on a bounded queue, a background thread does the actual writing.
+
+        recorder: the recorder doing the writing
+        maxQueue: int. Max number of pending writes. When the disk is that far behind, submitting
+            waits for the writer (back pressure) instead of using unbounded memory.
+
+        All pending writes are done on close (called by on_exit of the experiment, and at interpreter
+        exit if the experiment crashed). The recorders sync every trial to disk. A failed write is
+        raised on the next submit, flush or close, so a session never ends quietly with trials missing.
+        """
+        self.recorder = recorder
+        self.queue = queue.Queue(maxsize = maxQueue)
+        self.error = None
+        self.closed = False
+        """
+        maxDepth: int. Largest number of pending writes seen
+        waitTimes: list. Time each write spent in the queue in s
+        writeTimes: list. Time each write took in s
+        """
+        self.maxDepth = 0
+        self.waitTimes = []
+        self.writeTimes = []
+
+        self.thread = threading.Thread(target = self._work, name = "trial-writer", daemon = True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write_trial(self, trial, conditions, trajectory):
+        self._submit("write_trial", trial, conditions, trajectory)
+
+    def write_stream(self, trial, name, stream):
+        self._submit("write_stream", trial, name, stream)
+
+    def write_timing(self, trial, summary):
+        self._submit("write_timing", trial, summary)
+
+    def run(self, function, *args):
+        """call function(*args) on the writer thread, after the writes submitted before"""
+        self._submit(function, *args)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("writing trial data failed") from self.error
+
+    def _submit(self, method, *args):
+        self._raise_error()
+        if self.closed:
+            raise RuntimeError("trial writer is closed")
+        self.queue.put((method, args, time.perf_counter()))
+        self.maxDepth = max(self.maxDepth, self.queue.qsize())
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            method, args, submitted = item
+            start = time.perf_counter()
+            try:
+                if callable(method):
+                    method(*args)
+                else:
+                    getattr(self.recorder, method)(*args)
+            except Exception as error:
+                # keep the first error, it is raised on the next submit, flush or close
+                if self.error is None:
+                    self.error = error
+            end = time.perf_counter()
+            self.waitTimes.append(start - submitted)
+            self.writeTimes.append(end - start)
+            self.queue.task_done()
+
+    def flush(self):
+        """wait until all pending writes are done"""
+        self.queue.join()
+        self._raise_error()
+
+    def report(self):
+        """dict with queue depth and write latency statistics"""
+        writeTimes = np.array(self.writeTimes)
+        waitTimes = np.array(self.waitTimes)
+        return {
+            "writes": len(writeTimes),
+            "max_queue_depth": self.maxDepth,
+            "wait_mean_ms": float(1000*waitTimes.mean()) if len(waitTimes) else np.nan,
+            "wait_max_ms": float(1000*waitTimes.max()) if len(waitTimes) else np.nan,
+            "write_mean_ms": float(1000*writeTimes.mean()) if len(writeTimes) else np.nan,
+            "write_max_ms": float(1000*writeTimes.max()) if len(writeTimes) else np.nan,
+        }
+
+    def close(self):
+        """write everything that is pending, then close the recorder, returns the report"""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            self.recorder.close()
+            atexit.unregister(self.close)
+        self._raise_error()
+        return self.report()
@@ -0,0 +1,25 @@
+"""
+Stimulus, input and clock backend of the experiment
+
+By default this is psychopy. With the environment variable HANDELN_BACKEND=headless the
+stand-ins of headless.py are used instead (no window, a simulated clock and a synthetic
+participant moving the mouse), e.g. to generate data or to benchmark the frame loop.
+"""
+
+import os
+
+BACKEND = os.environ.get("HANDELN_BACKEND", "psychopy")
+
+if BACKEND == "psychopy":
+    from psychopy import core, event
+    from psychopy.event import Mouse
+    from psychopy.visual import Window, TextStim, ElementArrayStim
+    from psychopy.visual.circle import Circle
+    from psychopy.clock import Clock
+    from .mouse_sampler import IohubMouseSource as MouseSource
+elif BACKEND == "headless":
+    from . import headless as core
+    from . import headless as event
+    from .headless import Mouse, Window, TextStim, ElementArrayStim, Circle, Clock, MouseSource
+else:
+    raise ValueError(f"unknown HANDELN_BACKEND {BACKEND!r}, use 'psychopy' or 'headless'")
@@ -0,0 +1,22 @@
+"""
+Design of the experiment: the factors and their levels, shared by the experiment (main.py) and the
+simulation (simulate.py), which build the conditions with condition_table(DESIGN_COLUMNS, DESIGN_LEVELS).
+"""
+
+start_pos_X = [0]
+start_pos_Y = [-240]
+start_radius = [10]
+target_X_List = [0] # initial dir should be set at random (not an actual thing that distinguishes trials)
+target_Y_List = [240] # initial dir should be set at random (not an actual thing that distinguishes trials)
+target_SDS = [(10,10)]
+cursor_SDS = [(50,200),(100,100),(200,50)]
+nDotsTarget = [1]
+nDotsCursor = [200]
+cursor_shift = [-240,0,240]
+shift_threshold = [-240]
+
+# columns of the condition table, levels that are tuples fill several columns (e.g. target_SX, target_SY)
+DESIGN_COLUMNS = ['start_X','start_Y','startradius','target_X','target_Y','target_SX','target_SY','nDotsTarget',
+                  'cursor_SX','cursor_SY','nDotsCursor','cursor_shift','shift_threshold']
+DESIGN_LEVELS = [start_pos_X,start_pos_Y,start_radius,target_X_List,target_Y_List,target_SDS,nDotsTarget,
+                 cursor_SDS,nDotsCursor,cursor_shift,shift_threshold]
@@ -3,26 +3,45 @@ Class to create limited life time dot cloud
 """
 
 import numpy as np
-import psychopy.visual
+from .backend import ElementArrayStim
 #import psychopy.core
 #import psychopy.event
 #from psychopy import prefs
 
+def spawn_factor(spawn_Sigma):
+    """
+    Factor L of the spawn covariance (L @ L.T == spawn_Sigma), such that dot offsets can be drawn
+    as standard normals @ L.T. Falls back to an eigen decomposition for singular covariances
+    (e.g. a sigma of 0 in one direction or rho = +/-1).
+    """
+    try:
+        return np.linalg.cholesky(spawn_Sigma)
+    except np.linalg.LinAlgError:
+        eigval, eigvec = np.linalg.eigh(spawn_Sigma)
+        return eigvec * np.sqrt(np.clip(eigval, 0, None))
+
+
 class lltDotCloud:
     def __init__(self, pos, n_dots, spawn_sigma,
-            win, colors= (255,255,255),lifeSpan = 5):
+            win, colors= (255,255,255),lifeSpan = 5, seed = None, bufferFrames = 0):
         """
         From input:
         cloud_pos: [x,y] 1d array. Mean position of the cloud
         n_dots: int. Number of dots
         spawn_sigma: [x,y,rho] 1d array. Initial spawn distance sigma in pix in x and y and correlation rho. Size of the dot patch in stds
         lifeSpan: int. Max. lifetime of an individual dot in frames.
+        win: psychopy Window, or None if the cloud is drawn by a DotCloudGroup (no stimulus of its own)
+        seed: int or sequence of ints (optional). Seed for the random generators, makes the cloud reproducible (e.g. for replay)
+        bufferFrames: int. Number of frames for which the dot (re)spawn offsets are drawn in advance (see reserve)
         """
         self.pos = pos
         self.n_dots = n_dots
         self.spawn_Sigma = np.diag(spawn_sigma[:2])**2 # create diag matrix with sigma_X and sigma_Y
         self.spawn_Sigma[1,0] = spawn_sigma[2]*spawn_sigma[0]*spawn_sigma[1] # rho * sigma_X * sigma_Y
         self.spawn_Sigma[0,1] = spawn_sigma[2]*spawn_sigma[0]*spawn_sigma[1]
+        # the covariance is fixed for the life of the cloud: factor it once
+        self.spawn_L = spawn_factor(self.spawn_Sigma)
+        self.seed_generators(seed)
         self.lifeSpan = lifeSpan
         self.colors = colors
         """
@@ -40,7 +59,7 @@ class lltDotCloud:
         thisMIPS: Wrap for ElementArrayStim from Psychopy
         """
         self.move = False # set state to not be initialized
-        self.thisCloud = psychopy.visual.ElementArrayStim(win=win,
+        self.thisCloud = None if win is None else ElementArrayStim(win=win,
                                                         fieldPos = self.pos,
                                                         units="pix",
                                                         nElements=self.n_dots,
@@ -50,13 +69,74 @@ class lltDotCloud:
                                                         colorSpace = 'rgb255',
                                                         colors= self.colors,
                                                         sizes=3)
+        if bufferFrames > 0:
+            self.reserve(bufferFrames)
+
+    def seed_generators(self, seed):
+        # separate generators for lifetimes and positions, such that buffering positions in advance
+        # gives the same dots as drawing them frame by frame
+        lifeSeed, spawnSeed = np.random.SeedSequence(seed).spawn(2)
+        self.life_rng = np.random.default_rng(lifeSeed)
+        self.spawn_rng = np.random.default_rng(spawnSeed)
+        self.spawn_buffer = np.zeros([0,2])
+        self.spawn_next = 0
+
+    def reset(self, pos, seed = None, bufferFrames = 0):
+        """
+        Reuse the cloud (e.g. for the next trial): new position and generators, the dots are
+        initiated again on the next update.
+        """
+        self.pos = pos
+        self.seed_generators(seed)
+        self.move = False
+        self.dot_L[:] = 0
+        self.died = np.argwhere(self.dot_L == self.lifeSpan)
+        if bufferFrames > 0:
+            self.reserve(bufferFrames)
+
+    def reserve(self, n_frames):
+        """
+        Draw the spawn offsets for the initial dots and n_frames frames of respawns in advance,
+        so that respawning during those frames only copies a slice of the buffer.
+        """
+        n_offsets = self.n_dots + int(np.ceil(n_frames*self.n_dots/self.lifeSpan))
+        remaining = self.spawn_buffer[self.spawn_next:]
+        new = self.spawn_rng.standard_normal([max(n_offsets-len(remaining),0),2]) @ self.spawn_L.T
+        self.spawn_buffer = np.concatenate((remaining,new))
+        self.spawn_next = 0
+
+    def spawn_offsets(self, n):
+        """
+        n new dot offsets from the cloud centre: taken from the buffer if available, else drawn now.
+        """
+        start = self.spawn_next
+        if start + n <= len(self.spawn_buffer):
+            self.spawn_next += n
+            return self.spawn_buffer[start:start+n]
+        # buffer used up: use what is left and draw the rest
+        remaining = self.spawn_buffer[start:]
+        self.spawn_buffer = np.zeros([0,2])
+        self.spawn_next = 0
+        new = self.spawn_rng.standard_normal([n-len(remaining),2]) @ self.spawn_L.T
+        return np.concatenate((remaining,new))
 
 
     def main_update(self):
         # First iteration initilize dots
+        # Then... Update
+        initialized = self.move
+        self.advance()
+        if initialized and self.thisCloud is not None:
+            self.thisCloud.fieldPos = self.pos
+            #self.thisCloud.draw()
+                
+            # Set dots pos
+            self.thisCloud.xys = self.xys
+
+    def advance(self):
+        # One frame of the dots' life without touching the stimulus (DotCloudGroup uses this directly)
         if self.move == False:
             self.initiate_dots()
-        # Then... Update
         else:
             # Dots
             self.update_dots()
@@ -65,21 +145,15 @@ class lltDotCloud:
             if len(self.died) != 0:
                 # Check dead dots and create new ones
                 self.check_dots()
-                            
-            self.thisCloud.fieldPos = self.pos
-            #self.thisCloud.draw()
-                
-            # Set dots pos
-            self.thisCloud.xys = self.xys
             
     def initiate_dots(self):
         # Set the life-timers for the dots (frames)
-        self.dot_L = np.random.randint(0,self.lifeSpan, size = [self.n_dots,1])
+        self.dot_L = self.life_rng.integers(0,self.lifeSpan, size = [self.n_dots,1])
         self.move = True
 
         # Initiate dots at a random position mu = 0, SD = spawn_sigma
         ## If debug do not correct for lifespan (to check how dots behave under long lifespans)
-        self.xys = np.random.multivariate_normal(mean = (0,0), cov = self.spawn_Sigma, size = [self.n_dots])
+        self.xys = self.spawn_offsets(self.n_dots).copy()
 
     def update_dots(self):
         # Dots grow older
@@ -91,10 +165,54 @@ class lltDotCloud:
 
     def check_dots(self):
         # Relocate a new dot
-        self.xys[self.died[:,0],:] = np.random.multivariate_normal(mean = (0,0), cov=self.spawn_Sigma, size = [self.died.shape[0]])
+        self.xys[self.died[:,0],:] = self.spawn_offsets(self.died.shape[0])
 
         # Rebirth the dots with age 0
         self.dot_L[self.died[:,0]] = 0
     
     def draw(self):
         self.thisCloud.draw()
+
+
+class DotCloudGroup:
+    def __init__(self, clouds, win):
+        """
+        Draws several lltDotCloud instances (e.g. target and cursor of a trial) as one
+        ElementArrayStim, so all dots are uploaded and drawn with a single call per frame.
+        Every cloud keeps its own colors, lifespan and random generators; the clouds should be
+        created with win=None. Clouds are drawn in the order given (later clouds on top).
+
+        clouds: list of lltDotCloud
+        win: psychopy Window
+        """
+        self.clouds = list(clouds)
+        self.offsets = np.cumsum([0]+[cloud.n_dots for cloud in self.clouds])
+        n_dots = self.offsets[-1]
+        """
+        xys: [n_dots,2] 2D array. Absolute positions of the dots of all clouds in pixels (shared buffer)
+        """
+        self.xys = np.zeros([n_dots,2])
+        colors = np.zeros([n_dots,3])
+        for cloud, start, end in zip(self.clouds, self.offsets[:-1], self.offsets[1:]):
+            colors[start:end] = cloud.colors
+        self.thisCloud = ElementArrayStim(win=win,
+                                                        fieldPos = (0,0),
+                                                        units="pix",
+                                                        nElements=n_dots,
+                                                        elementTex=None,
+                                                        elementMask="circle",
+                                                        xys=self.xys,
+                                                        colorSpace = 'rgb255',
+                                                        colors= colors,
+                                                        sizes=3)
+
+    def main_update(self):
+        # advance all clouds and write their dots in place into the shared buffer
+        for cloud, start, end in zip(self.clouds, self.offsets[:-1], self.offsets[1:]):
+            cloud.advance()
+            np.add(cloud.xys, cloud.pos, out=self.xys[start:end])
+        # one upload for all clouds
+        self.thisCloud.xys = self.xys
+
+    def draw(self):
+        self.thisCloud.draw()
@@ -2,19 +2,36 @@ from typing import Tuple, List
 
 import numpy as np
 import pandas as pd
-import psychopy
-from psychopy.event import Mouse
-from psychopy.visual import Window
-from psychopy.clock import Clock
-from psychopy.visual.circle import Circle
-from psychopy.visual import TextStim
+# psychopy, or the headless stand-ins (see backend.py)
+from .backend import core, event, Mouse, Window, Clock, Circle, TextStim, MouseSource
 #from psychopy import event
 #from psychopy import visual
 #from Experiment_helpers.dots_class import lltDotCloud
-from .dots_class import lltDotCloud
+from .dots_class import lltDotCloud, DotCloudGroup
+from .stimulus_pool import StimulusPool
+from .trial_store import CsvTrialRecorder, TrialStore, trajectory_dtype
+from .trial_history import TrialHistory
+from .frame_timing import FrameTimer
+from .async_writer import AsyncTrialWriter
+from .mouse_sampler import MouseSampler
+from .trial_plan import TrialPlan
+from .scoring import ExponentialScore
+from .live_monitor import TrialPublisher
 
 import os
-import csv
+import time
+import itertools
+
+def condition_table(columns, levels):
+    """
+    All combinations of the levels (one list per factor) as a DataFrame with the given columns.
+    Levels that are tuples (e.g. (SX,SY)) fill several columns.
+    """
+    conds = list(itertools.product(*levels))
+    # flatten the rows removing the tuples
+    for row in range(0,len(conds)):
+        conds[row] = list(itertools.chain(*(i if isinstance(i, tuple) else (i,) for i in conds[row])))
+    return pd.DataFrame(conds, columns = columns).reset_index()
 
 def repeat_and_shuffle(df, reps = 5, shuffle = True, grouping = "None"):
     df = pd.concat([df]*reps,ignore_index=True)
@@ -37,8 +54,13 @@ class Experiment:
     debug: bool
 
     running: bool
+    frameTimer: FrameTimer # None if the run loop is not instrumented
 
-    def __init__(self, windowed: bool, resolution: Tuple[int, int], screen: int, debug: bool = False):
+    def __init__(self, windowed: bool, resolution: Tuple[int, int], screen: int, debug: bool = False,
+                 instrument: bool = False):
+        """
+        instrument: record the duration of every phase of the run loop and the flip times (see frame_timing.py)
+        """
         self.debug = debug
 
         # self.window = Window(
@@ -65,10 +87,15 @@ class Experiment:
 
         self.running = True
 
-        psychopy.core.wait(0.1)
+        self.frameTimer = None
+        if instrument:
+            framerate = self.window.getActualFrameRate()
+            self.frameTimer = FrameTimer(1/framerate if framerate else self.window.monitorFramePeriod)
+
+        core.wait(0.1)
 
     def handle_keys(self):
-        keys = psychopy.event.getKeys()
+        keys = event.getKeys()
 
         for key in keys:
             if key == "q" or key == "escape":
@@ -79,20 +106,37 @@ class Experiment:
 
     def run(self):
         while self.running:
-            self.handle_keys()
+            if self.frameTimer is None:
+                self.handle_keys()
 
-            self.update()
-            self.draw()
+                self.update()
+                self.draw()
 
-            self.window.flip()
+                self.window.flip()
+            else:
+                self.timed_frame()
 
         self.exit()
 
+    def timed_frame(self):
+        # one frame of the run loop, recording how long each phase takes
+        t0 = time.perf_counter()
+        self.handle_keys()
+        t1 = time.perf_counter()
+        self.update()
+        t2 = time.perf_counter()
+        self.draw()
+        t3 = time.perf_counter()
+        flipTime = self.window.flip()
+        t4 = time.perf_counter()
+        self.frameTimer.record(t0, t1, t2, t3, t4, flipTime)
+        self.on_flip(flipTime)
+
     def exit(self):
         self.on_exit()
 
         self.window.close()
-        psychopy.core.quit()
+        core.quit()
 
     def update(self):
         pass
@@ -103,6 +147,10 @@ class Experiment:
     def key(self, key: str):
         pass
 
+    def on_flip(self, flipTime: float):
+        # called after every flip of an instrumented run loop
+        pass
+
     def on_exit(self):
         pass
 
@@ -161,29 +209,30 @@ class FeedbackText:
 class CloudExperiment(Experiment):
     participantID: str
     dataDir: str
+    dataFormat: str
 
     # dependent on cloud item if cloudItem = 'cursor' the following two are swapped
     target: None
     cursor: None
     presursor: Circle # cursor before trial really starts (non-cloud per definition)
+    cloudGroup: DotCloudGroup # draws the dot clouds among target and cursor (None if there are none)
     startpoint: Circle
     timer: Clock
     shift: int
     shift_threshold: int
     shift_applied: int
 
-    conditions: pd.DataFrame
+    plan: TrialPlan # compiled trial list (see trial_plan.py)
+    params: tuple # parameters of the current trial (a record of plan)
 
     trial: int
     trialPhase: int
     frameCount: int
     trialScore: int
     totalScore: int
-    trialStartTime: int
+    trialStartTime: float
 
-    trialHistory: List[
-        list[
-            int, int, int, int, int]]  # List[List[int, int, int, int]] "time", "cursor_x", "actual_cursor_x"  "snake/buttons_x"
+    trialHistory: TrialHistory # "time", "frame_nr", "cursor_x", "cursor_y", "shift_applied" (+ flip columns)
 
 
     #text_between_trials: visual.TextStim
@@ -193,9 +242,30 @@ class CloudExperiment(Experiment):
     # def __init__(self, windowed: bool, resolution: Tuple[int, int], screen: int, trialList: pd.DataFrame, participantID: str, dataDir: str,
     #              cursor_size: Tuple[int, int] = (5,5), target_size: Tuple[int, int] = (50,100), debug: bool = False ):
     def __init__(self, windowed: bool, resolution: Tuple[int, int], screen: int,
-                 trialList: pd.DataFrame, participantID: str, dataDir: str,
-                 debug: bool = False ):
-        super().__init__(windowed, resolution, screen, debug)
+                 trialList: TrialPlan, participantID: str, dataDir: str,
+                 debug: bool = False, dataFormat: str = "csv", seed: int = None,
+                 instrument: bool = False, asyncWrite: bool = True, mouseRate: float = 0,
+                 startTrial: int = 0, startScore: int = 0, scoring = None, monitor: bool = False):
+        """
+        trialList: TrialPlan (a DataFrame, e.g. from repeat_and_shuffle, is compiled into one)
+        dataFormat: "csv" writes one CSV file per trial, "store" appends all trials
+        to one binary trial store per participant (see trial_store.py)
+        seed: if given the dot clouds of every trial are reproducible (seeded by seed and trial number)
+        instrument: record frame timing, write a timing summary per trial and add the columns
+            flip_time and input_to_flip to the trajectory samples
+        asyncWrite: write the trials on a background thread (see async_writer.py)
+        mouseRate: if > 0 the mouse is read at the rate of the device (iohub, see mouse_sampler.py; headless
+            sampled at mouseRate Hz): the frame loop uses the latest sample and all samples of a trial are
+            stored as the 'mouse' stream
+        startTrial: trial to start with, to resume a session (see TrialPlan.load). The progress of the
+            session is saved to participant_<id>_session.npz in dataDir after every trial
+        startScore: total score of the trials before startTrial, when resuming a session
+        scoring: rule that scores the end point of a trial (see scoring.py), defaults to
+            ExponentialScore(), the rule the experiment always used
+        monitor: publish every finished trial to shared memory for a live monitor in another process
+            (python -m Experiment_helpers.live_monitor <participantID>, see live_monitor.py)
+        """
+        super().__init__(windowed, resolution, screen, debug, instrument)
 
         self.text_startExperiment = TextStim(self.window,
             text='----- Hit the target -----\n\n\n\n'
@@ -210,7 +280,7 @@ class CloudExperiment(Experiment):
         self.text_startExperiment.draw()
         self.window.setMouseVisible(False)
         self.window.flip()
-        psychopy.event.waitKeys(keyList = ['space'])
+        event.waitKeys(keyList = ['space'])
 
         self.text_between_trials = TextStim(self.window,
                                         text='----- Hit the target -----\n\n\n\n'
@@ -229,6 +299,27 @@ class CloudExperiment(Experiment):
 
         self.participantID = participantID
         self.dataDir = dataDir
+        self.dataFormat = dataFormat
+        self.seed = seed
+        self.scoring = scoring if scoring is not None else ExponentialScore()
+        if dataFormat == "csv":
+            self.recorder = CsvTrialRecorder(dataDir, participantID)
+        elif dataFormat == "store":
+            self.recorder = TrialStore(os.path.join(dataDir, f"participant_{participantID}_store"),
+                                       mode = "a", participantID = participantID)
+        else:
+            raise ValueError(f"unknown dataFormat {dataFormat!r}, use 'csv' or 'store'")
+        if asyncWrite:
+            self.recorder = AsyncTrialWriter(self.recorder)
+        self.trajectoryColumns = ["time", "frame_nr", "cursor_x", "cursor_y", "shift_applied"]
+        if self.frameTimer is not None:
+            # flip_time: time (trial clock) of the flip that showed the sample
+            # input_to_flip: time between reading the mouse and that flip
+            self.trajectoryColumns += ["flip_time", "input_to_flip"]
+        self.trialHistory = TrialHistory(trajectory_dtype(self.trajectoryColumns))
+        self.mouseSampler = None
+        if mouseRate > 0:
+            self.mouseSampler = MouseSampler(MouseSource(self.window, rate = mouseRate))
 
         self.precursor = Circle(
                 win=self.window,
@@ -238,18 +329,38 @@ class CloudExperiment(Experiment):
                 pos=(0,0)
             )
 
-        self.conditions = trialList
+        if isinstance(trialList, pd.DataFrame):
+            trialList = TrialPlan.from_frame(trialList)
+        self.plan = trialList
+        self.publisher = None
+        if monitor:
+            conditionNames = [name for name in self.plan.records.dtype.names
+                              if self.plan.records.dtype[name].kind in "biuf"]
+            self.publisher = TrialPublisher(participantID, conditionNames + ['trial_score'])
+        self.sessionPath = os.path.join(dataDir, f"participant_{participantID}_session.npz")
+        self.plan.save(self.sessionPath, startTrial, startScore)
+        # build all stimulus configurations of the experiment up front and render them once
+        self.stimuli = StimulusPool(self.window, bufferFrames = 600) # respawns for 10 s at 60 Hz are drawn at trial start
+        self.stimuli.prepare(self.plan)
+        self.stimuli.warm_up()
         # initialize handlers
-        self.trial = 0
+        self.trial = startTrial
         self.trialPhase = 0
         self.frameCount = 0
         self.trialScore = 0
-        self.totalScore = 0
+        self.trialHit = None
+        self.totalScore = startScore
 
         self.timer = Clock()
         self.start_trial()
 
 
+    def cloud_seed(self, cloudNr: int):
+        # seed for the dot cloud cloudNr (0: cursor, 1: target) of the current trial
+        if self.seed is None:
+            return None
+        return [self.seed, self.trial, cloudNr]
+
     def start_trial(self):
 
         # Draw the text stimulus
@@ -257,58 +368,37 @@ class CloudExperiment(Experiment):
         # self.window.flip()
 
         mousepos = self.mouse.getPos()
-
-        if self.conditions.loc[self.trial,'nDotsCursor'] == 1:
-            self.cursor = Circle(
-                win=self.window,
-                radius=(self.conditions.loc[self.trial,'cursor_SX'],self.conditions.loc[self.trial,'cursor_SY']),
-                fillColor="black",
-                colorSpace='rgb',
-                pos=mousepos
-            )
-        else:
-            self.cursor = lltDotCloud(
-                pos = mousepos,
-                n_dots = self.conditions.loc[self.trial,'nDotsCursor'],
-                spawn_sigma = (self.conditions.loc[self.trial,'cursor_SX'],self.conditions.loc[self.trial,'cursor_SY'],0),
-                win = self.window,
-                colors = (0,0,0),
-                lifeSpan = 5)
-
-        if self.conditions.loc[self.trial,'nDotsTarget'] == 1:
-            self.target = Circle(
-                win=self.window,
-                radius= (self.conditions.loc[self.trial,'target_SX'],self.conditions.loc[self.trial,'target_SY']),
-                fillColor="white",
-                colorSpace='rgb',
-                pos=(self.conditions.loc[self.trial,'target_X'],self.conditions.loc[self.trial,'target_Y'])
-            )
-        else:
-            self.target = lltDotCloud(
-                pos = (self.conditions.loc[self.trial,'target_X'],self.conditions.loc[self.trial,'target_Y']),
-                n_dots = self.conditions.loc[self.trial,'nDotsTarget'],
-                spawn_sigma = (self.conditions.loc[self.trial,'target_SX'],self.conditions.loc[self.trial,'target_SY'],0),
-                win = self.window,
-                lifeSpan = 5)
-
-        self.startpoint = Circle(
-            win=self.window,
-            radius=self.conditions.loc[self.trial,'startradius'],
-            fillColor="green",
-            colorSpace='rgb',
-            pos=(self.conditions.loc[self.trial,'start_X'],self.conditions.loc[self.trial,'start_Y'])
-        )
+        self.params = params = self.plan[self.trial]
+
+        # stimuli are built once per configuration (see stimulus_pool.py) and reused here
+        self.cursor = self.stimuli.cursor(
+            params.nDotsCursor,
+            params.cursor_SX,
+            params.cursor_SY,
+            pos = mousepos,
+            seed = self.cloud_seed(0))
+        self.target = self.stimuli.target(
+            params.nDotsTarget,
+            params.target_SX,
+            params.target_SY,
+            pos = (params.target_X,params.target_Y),
+            seed = self.cloud_seed(1))
+        # all dot clouds of the trial are drawn as one element array (target below cursor)
+        self.cloudGroup = self.stimuli.cloud_group(self.target, self.cursor)
+        self.startpoint = self.stimuli.startpoint(
+            params.startradius,
+            pos = (params.start_X,params.start_Y))
         self.window.setMouseVisible(False)
 
         # update score text
         self.scoreText.text = "Trial Score = " +str(self.trialScore) +"\nTotal Score: " + str(self.totalScore)
 
-        self.trialHistory = []
+        self.trialHistory.clear()
         self.trialPhase = 0
         self.frameCount = 0
         self.trialScore = 0
-        self.shift = self.conditions.loc[self.trial,'cursor_shift']
-        self.shift_threshold = self.conditions.loc[self.trial,'shift_threshold']
+        self.shift = params.cursor_shift
+        self.shift_threshold = params.shift_threshold
         self.shift_applied = 0
 
         self.timer.reset()
@@ -316,7 +406,19 @@ class CloudExperiment(Experiment):
 
     def update(self):
         # get mouse position
-        self.cursor.pos = self.mouse.getPos()
+        if self.mouseSampler is None:
+            self.cursor.pos = self.mouse.getPos()
+            self.inputTime = core.getTime()
+        else:
+            self.mouseSampler.update()
+            sampleTime, mousepos = self.mouseSampler.latest()
+            if mousepos is None:
+                # no device sample yet
+                self.cursor.pos = self.mouse.getPos()
+                self.inputTime = core.getTime()
+            else:
+                self.cursor.pos = mousepos
+                self.inputTime = sampleTime
         self.precursor.pos = self.cursor.pos
         checkclick = (self.mouse.getPressed()[0]==1)
         startErr = np.sqrt((self.cursor.pos[0]-self.startpoint.pos[0])**2 + (self.cursor.pos[1]-self.startpoint.pos[1])**2)
@@ -330,6 +432,10 @@ class CloudExperiment(Experiment):
                 self.trialPhase += 1
                 self.frameCount = 0
                 self.timer.reset()
+                self.trialStartTime = core.getTime()
+                if self.frameTimer is not None:
+                    # timing summary covers the pointing phase of the trial
+                    self.frameTimer.reset()
         if self.trialPhase == 1:
             # case 1:
             self.frameCount +=1
@@ -337,51 +443,60 @@ class CloudExperiment(Experiment):
                 self.cursor.pos[0] = self.cursor.pos[0]+self.shift
                 self.shift_applied = 1
             # in pointing phase of the trial
-            if isinstance(self.target, lltDotCloud ):
-                self.target.main_update()
-            if isinstance(self.cursor, lltDotCloud ):
-                self.cursor.main_update()
+            if self.cloudGroup is not None:
+                self.cloudGroup.main_update()
 
             # append the current history to the trialHistory
-            self.trialHistory.append(
-                [self.timer.getTime(), self.frameCount, self.cursor.pos[0], self.cursor.pos[1], self.shift_applied])
+            if self.frameTimer is None:
+                self.trialHistory.append(
+                    self.timer.getTime(), self.frameCount, self.cursor.pos[0], self.cursor.pos[1], self.shift_applied)
+            else:
+                # flip columns are filled in by on_flip (they stay NaN for the last sample of the trial)
+                self.trialHistory.append(
+                    self.timer.getTime(), self.frameCount, self.cursor.pos[0], self.cursor.pos[1], self.shift_applied,
+                    np.nan, np.nan)
             
             # check if click and significantly away from starting point
             # this is the condition to end a trial
             if checkclick and startErr > 2*self.startpoint.radius:
                 # write trial and setup next trial
-                # create a new CSV file for each trial and put it in the folder
-                file_name = f"participant_{self.participantID}_trial_{self.trial}_trajectory.csv"
-                file_path = os.path.join(self.dataDir, file_name)
-
                 # update trial score based on whether hit or not
-                self.compute_EndScore(self.conditions.loc[self.trial,'target_SX':'target_SY'],
-                                self.conditions.loc[self.trial,'cursor_SX':'cursor_SY'])
+                self.compute_EndScore(np.array((self.params.target_SX, self.params.target_SY)),
+                                np.array((self.params.cursor_SX, self.params.cursor_SY)))
                 #self.trialHistory[-1][-1] = self.trialScore
                 self.totalScore += self.trialScore
 
-                # write out trial_results
-                with open(file_path, "a", newline="") as f:
-                    writer = csv.writer(f)
-                    # TODO : add as first line the 0th line of the input csv file:
-                    #writer.writerow(self.conditions.columns)
-                    # TODO : add corresponding to trial row from input file
-                    temprow  = self.conditions.iloc[[self.trial],:]
-                    temprow['trial_score'] = self.trialScore
-                    writer.writerow(temprow.columns)
-                    writer.writerow(temprow.iloc[0,:])
-                    #writer.writerow(self.conditions.iloc[self.trial,:])
-                    # write for trajectory data
-                    writer.writerow(["time", "frame_nr", "cursor_x", "cursor_y", "shift_applied"])
-                    writer.writerows(self.trialHistory)
+                # write out trial_results: the conditions of this trial plus its score and the trajectory
+                trialConditions = self.params._asdict()
+                trialConditions['trial_score'] = self.trialScore
+                # copy: the history buffer is reused for the next trial while the trial may still be queued for writing
+                self.recorder.write_trial(self.trial, trialConditions, self.trialHistory.data.copy())
+                if self.publisher is not None:
+                    self.publisher.publish(self.trial, trialConditions, self.trialHistory.data, self.trialHit)
+                if self.mouseSampler is not None:
+                    # all mouse samples of the pointing phase, with time stamps relative to its start
+                    stream = self.mouseSampler.samples(self.trialStartTime)
+                    stream["time"] -= self.trialStartTime
+                    self.recorder.write_stream(self.trial, "mouse", stream)
+                if self.frameTimer is not None:
+                    self.recorder.write_timing(self.trial, self.frameTimer.summary())
                 
                 self.trial += 1
-                if self.trial >= len(self.conditions):
+                self.save_progress()
+                if self.trial >= len(self.plan):
                     self.exit()
 
                 #self.start_trial(self.trial)
                 self.start_trial()
 
+    def save_progress(self):
+        # session file to resume from after a crash: after the trial in the writer queue, so it never
+        # points past a trial that is not on disk
+        if isinstance(self.recorder, AsyncTrialWriter):
+            self.recorder.run(self.plan.save, self.sessionPath, self.trial, self.totalScore)
+        else:
+            self.plan.save(self.sessionPath, self.trial, self.totalScore)
+
     def draw(self):
         # match self.trialPhase:
         #     case 0:
@@ -390,8 +505,31 @@ class CloudExperiment(Experiment):
                 self.precursor.draw()
             # case 1:
         if self.trialPhase == 1:
-                self.target.draw()
-                self.cursor.draw()
+                if not isinstance(self.target, lltDotCloud):
+                    self.target.draw()
+                if self.cloudGroup is not None:
+                    self.cloudGroup.draw()
+                if not isinstance(self.cursor, lltDotCloud):
+                    self.cursor.draw()
+
+    def on_flip(self, flipTime: float):
+        # stamp the sample recorded this frame with the time it appeared on screen: flip_time relative to the
+        # start of the pointing phase (trialStartTime, the core.getTime of the trial clock reset), input_to_flip
+        # as the latency from reading the mouse
+        if self.trialPhase == 1 and len(self.trialHistory) and flipTime is not None:
+            self.trialHistory.set_last("input_to_flip", flipTime - self.inputTime)
+            self.trialHistory.set_last("flip_time", flipTime - self.trialStartTime)
+
+    def on_exit(self):
+        if self.mouseSampler is not None:
+            self.mouseSampler.stop()
+        if self.publisher is not None:
+            self.publisher.close()
+        # make sure all recorded (and still queued) trials end up on disk (raises if a write failed)
+        report = self.recorder.close()
+        if report is not None:
+            # queue depth and latency of the background writes, to check the writer kept up with the trials
+            print("Trial writer: " + ", ".join(f"{name} {value:.3g}" for name, value in report.items()))
 
     # def update_InTrialScore(self,targetSize,cursorSize):
     #     error = (self.cursor.pos[0]-self.target.pos[0])**2/2*(targetSize[0]+cursorSize[0])**2 + \
@@ -402,15 +540,15 @@ class CloudExperiment(Experiment):
 
     def compute_EndScore(self,targetSize,cursorSize):
         # compute distance taking sizes into account
-        # since participants need to aim for centre of the target we here only take size of cursor into account
-        # note this can be changed if the task of the experiment changes
-        error = np.sum( (self.cursor.pos-self.target.pos)**2/(2*targetSize**2) ) 
-        if error < 1:
-            score = 100
-        else:
-            slope = 1/5
-            score = int(np.round(100* np.exp(-(error-1)*slope) ))
+        # since participants need to aim for centre of the target the default rule only takes the size of the target into account
+        # note the rule can be changed (scoring) if the task of the experiment changes
+        offset = np.asarray(self.cursor.pos - self.target.pos, dtype=float)[None]
+        targetSize, cursorSize = np.asarray(targetSize)[None], np.asarray(cursorSize)[None]
+        score = int(self.scoring(offset, targetSize, cursorSize)[0])
         self.trialScore += score
+        # hit as defined by the rule, for the live monitor (unknown for rules without hit)
+        hit = getattr(self.scoring, "hit", None)
+        self.trialHit = bool(hit(offset, targetSize, cursorSize)[0]) if hit is not None else None
 
 
     # def text(self, message: str):
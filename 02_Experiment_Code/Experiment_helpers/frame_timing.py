@@ -0,0 +1,70 @@
+"""
+Timing instrumentation for the frame loop of Experiment.run
+"""
+
+import numpy as np
+
+PHASES = ("keys", "update", "draw", "flip")
+
+
+class FrameTimer:
+    def __init__(self, framePeriod, capacity = 4096, dropFactor = 1.5):
+        """
+        Records how long the phases of every frame take and when the flips happened.
+
+        framePeriod: float. Expected duration of one frame in s (1/refresh rate)
+        capacity: int. Number of frames to preallocate (grows when needed)
+        dropFactor: float. A flip interval longer than dropFactor * framePeriod counts as missed vsync
+        """
+        self.framePeriod = framePeriod
+        self.dropFactor = dropFactor
+        """
+        durations: [capacity, 4] array. Duration of handle_keys, update, draw and flip per frame in s
+        flipTimes: [capacity] array. Time stamps returned by window.flip
+        """
+        self.durations = np.zeros([capacity, len(PHASES)])
+        self.flipTimes = np.zeros(capacity)
+        self.n_frames = 0
+
+    def record(self, t0, t1, t2, t3, t4, flipTime):
+        """
+        t0..t4: time.perf_counter() before handle_keys, update, draw, flip and after flip
+        flipTime: the time stamp returned by window.flip (None if not available)
+        """
+        if self.n_frames == len(self.flipTimes):
+            self.durations = np.concatenate((self.durations, np.zeros_like(self.durations)))
+            self.flipTimes = np.concatenate((self.flipTimes, np.zeros_like(self.flipTimes)))
+        row = self.durations[self.n_frames]
+        row[0] = t1 - t0
+        row[1] = t2 - t1
+        row[2] = t3 - t2
+        row[3] = t4 - t3
+        self.flipTimes[self.n_frames] = np.nan if flipTime is None else flipTime
+        self.n_frames += 1
+
+    def missed_frames(self):
+        """number of refreshes missed before every recorded flip (0 for the first frame)"""
+        intervals = np.diff(self.flipTimes[:self.n_frames], prepend = np.nan)
+        missed = np.where(intervals > self.dropFactor*self.framePeriod,
+                          np.round(intervals/self.framePeriod) - 1, 0)
+        return missed.astype(int)
+
+    def summary(self):
+        """dict with the timing summary of the frames recorded since the last reset"""
+        n = self.n_frames
+        summary = {"n_frames": n, "frame_period_ms": 1000*self.framePeriod}
+        with np.errstate(invalid = "ignore"):
+            for i, phase in enumerate(PHASES):
+                durations = self.durations[:n, i]
+                summary[phase + "_mean_ms"] = float(1000*durations.mean()) if n else np.nan
+                summary[phase + "_max_ms"] = float(1000*durations.max()) if n else np.nan
+            intervals = np.diff(self.flipTimes[:n])
+            summary["flip_interval_mean_ms"] = float(1000*np.nanmean(intervals)) if len(intervals) else np.nan
+            summary["flip_interval_max_ms"] = float(1000*np.nanmax(intervals)) if len(intervals) else np.nan
+        missed = self.missed_frames()
+        summary["late_flips"] = int(np.count_nonzero(missed))
+        summary["dropped_frames"] = int(missed.sum())
+        return summary
+
+    def reset(self):
+        self.n_frames = 0
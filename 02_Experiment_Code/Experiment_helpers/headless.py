@@ -0,0 +1,313 @@
+"""
+Headless stand-ins for the psychopy objects used by the experiment, and a synthetic participant
+
+Selected with HANDELN_BACKEND=headless (see backend.py). Nothing is shown: stimuli only keep
+their attributes, and time is simulated: every flip advances the clock by one frame period,
+so frames run as fast as the CPU allows while the recorded time stamps look like a real session.
+The mouse is moved (and clicked) by a SyntheticParticipant, set with configure.
+"""
+
+import numpy as np
+
+
+class SimulatedTime:
+    def __init__(self):
+        self.now = 0.0
+
+    def advance(self, secs):
+        self.now += secs
+
+
+_time = SimulatedTime()
+_config = {"framerate": 60.0, "participant": None}
+
+
+def configure(framerate = 60.0, participant = None):
+    """
+    framerate: float. Frames per second of the simulated display
+    participant: SyntheticParticipant moving the mouse (None: the mouse stays at (0,0))
+    """
+    _config["framerate"] = framerate
+    _config["participant"] = participant
+
+
+# -----------------------------------------------
+# psychopy.core and psychopy.event
+# -----------------------------------------------
+
+def getTime():
+    return _time.now
+
+
+def wait(secs, hogCPUperiod = 0.2):
+    _time.advance(secs)
+
+
+def quit():
+    # like psychopy.core.quit
+    raise SystemExit(0)
+
+
+def getKeys(keyList = None, timeStamped = False):
+    return []
+
+
+def waitKeys(maxWait = float("inf"), keyList = None, timeStamped = False):
+    # the synthetic participant presses the first key that is waited for right away
+    return [keyList[0] if keyList else "space"]
+
+
+class Clock:
+    def __init__(self):
+        self.start = _time.now
+
+    def getTime(self):
+        return _time.now - self.start
+
+    def reset(self, newT = 0.0):
+        self.start = _time.now + newT
+
+
+# -----------------------------------------------
+# psychopy.visual and the mouse
+# -----------------------------------------------
+
+class Window:
+    def __init__(self, size = (800,600), screen = 0, units = "pix", fullscr = False, **kwargs):
+        self.size = np.array(size)
+        self.screen = screen
+        self.units = units
+        self.fullscr = fullscr
+        self.monitorFramePeriod = 1/_config["framerate"]
+        self.frameCount = 0
+
+    def flip(self, clearBuffer = True):
+        # returns the (simulated) time of the flip, like psychopy
+        _time.advance(self.monitorFramePeriod)
+        self.frameCount += 1
+        return _time.now
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return 1/self.monitorFramePeriod
+
+    def setMouseVisible(self, visibility):
+        pass
+
+    def clearBuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Mouse:
+    def __init__(self, win = None, visible = True, **kwargs):
+        self.win = win
+        self.visible = visible
+
+    def getPos(self):
+        participant = _config["participant"]
+        if participant is None:
+            return np.zeros(2)
+        return participant.position(_time.now)
+
+    def getPressed(self, getTime = False):
+        participant = _config["participant"]
+        if participant is not None and participant.clicks(_time.now, _time.now + 1/_config["framerate"]):
+            return [1, 0, 0]
+        return [0, 0, 0]
+
+    def setVisible(self, visible):
+        self.visible = visible
+
+
+class MouseSource:
+    def __init__(self, window = None, rate = 1000):
+        """
+        Device-level mouse source (see mouse_sampler.py): samples the synthetic participant at a fixed
+        rate of the simulated clock, between the frames.
+
+        rate: float. Samples per second
+        """
+        self.period = 1/rate
+        self.next = _time.now
+
+    def read(self):
+        """(times, positions (n x 2)) of the samples up to now since the last read"""
+        times = np.arange(self.next, _time.now + 1e-12, self.period)
+        if len(times):
+            self.next = times[-1] + self.period
+        participant = _config["participant"]
+        if participant is None:
+            return times, np.zeros((len(times), 2))
+        return times, np.array([participant.position(t) for t in times]).reshape(-1, 2)
+
+    def close(self):
+        pass
+
+
+class _Stimulus:
+    # keeps the attributes it is given, draw does nothing
+    def __init__(self, win = None, **kwargs):
+        self.win = win
+        self.__dict__.update(kwargs)
+
+    def draw(self, win = None):
+        pass
+
+
+class TextStim(_Stimulus):
+    pass
+
+
+class Circle(_Stimulus):
+    def __init__(self, win = None, radius = 0.5, pos = (0,0), **kwargs):
+        super().__init__(win, radius = radius, **kwargs)
+        self.pos = pos
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        # psychopy converts (and so copies) positions to float arrays
+        self._pos = np.array(value, dtype = float)
+
+
+class ElementArrayStim(_Stimulus):
+    def __init__(self, win = None, xys = None, **kwargs):
+        super().__init__(win, **kwargs)
+        self.xys = xys
+
+    @property
+    def xys(self):
+        return self._xys
+
+    @xys.setter
+    def xys(self, value):
+        # copy like the upload of a real element array
+        self._xys = None if value is None else np.array(value, dtype = float)
+
+
+# -----------------------------------------------
+# Synthetic participant
+# -----------------------------------------------
+
+def minimum_jerk(u):
+    """normalized minimum jerk position profile (0 to 1) at normalized time u"""
+    u = np.clip(u, 0, 1)
+    return u**3*(10 - 15*u + 6*u**2)
+
+
+class SyntheticParticipant:
+    def __init__(self, plan, startTrial = 0, seed = None, reachDuration = 0.6, durationSD = 0.08,
+                 reactionTime = 0.25, correctionLatency = 0.15, correctionDuration = 0.35,
+                 endpointSD = 5.0, homeDuration = 0.4, dwell = 0.15):
+        """
+        Moves the mouse through the trials of a plan like a participant would: move to the
+        start point and click on it, reach to the target with a minimum jerk movement and
+        click at the end. When the cursor is shifted (cursor_shift, once the hand passes
+        shift_threshold) a second minimum jerk submovement corrects for the shift after
+        correctionLatency, superimposed on the reach.
+
+        plan: TrialPlan of the experiment (see trial_plan.py)
+        startTrial: trial the experiment starts with
+        seed: seed of the noise (reach duration, reaction time and endpoint scatter)
+        reachDuration, durationSD: mean and sd of the reach duration in s
+        reactionTime: s from clicking on the start point until the reach starts
+        correctionLatency: s from the cursor shift until the correction starts
+        correctionDuration: s
+        endpointSD: sd of the endpoint scatter in pixels (per axis). For a dot cloud cursor the
+            uncertainty of its centre (cloud sd/sqrt(number of dots)) is added
+        homeDuration: s to move to the start point
+        dwell: s between the end of a movement and the click
+        """
+        self.plan = plan
+        self.trial = startTrial
+        self.rng = np.random.default_rng(seed)
+        self.reachDuration = reachDuration
+        self.durationSD = durationSD
+        self.reactionTime = reactionTime
+        self.correctionLatency = correctionLatency
+        self.correctionDuration = correctionDuration
+        self.endpointSD = endpointSD
+        self.homeDuration = homeDuration
+        self.dwell = dwell
+
+        self.schedule = None
+        self.plan_trial(_time.now, np.zeros(2))
+
+    def plan_trial(self, t0, pos):
+        """schedule the movements of the current trial, starting at time t0 from position pos"""
+        if self.trial >= len(self.plan):
+            # no more trials: stay where the last trial ended
+            self.schedule = {"t0": t0, "home": pos, "homeStart": t0, "startClick": np.inf,
+                             "reachStart": np.inf, "end": np.inf, "endClick": np.inf}
+            return
+        params = self.plan[self.trial]
+        start = np.array([params.start_X, params.start_Y], dtype = float)
+        target = np.array([params.target_X, params.target_Y], dtype = float)
+
+        # land well inside the start point
+        home = start + np.clip(self.rng.normal(0, params.startradius/6, 2), -params.startradius/3, params.startradius/3)
+        startClick = t0 + self.homeDuration + self.dwell
+        reachStart = startClick + self.reactionTime*self.rng.lognormal(0, 0.2)
+        duration = max(0.2, self.rng.normal(self.reachDuration, self.durationSD))
+        cursorSD = np.array([params.cursor_SX, params.cursor_SY], dtype = float)
+        centreSD = cursorSD/np.sqrt(params.nDotsCursor) if params.nDotsCursor > 1 else 0
+        endpoint = target + self.rng.normal(0, np.sqrt(self.endpointSD**2 + centreSD**2), 2)
+        end = reachStart + duration
+
+        correctionStart = None
+        if params.cursor_shift != 0:
+            # first time the hand is above the shift threshold in the pointing phase (the cursor
+            # shift is applied from then on): right at the start click if the start point is above it
+            if home[1] > params.shift_threshold:
+                correctionStart = startClick + self.correctionLatency
+            else:
+                u = np.linspace(0, 1, 1001)
+                y = home[1] + (endpoint[1] - home[1])*minimum_jerk(u)
+                above = np.flatnonzero(y > params.shift_threshold)
+                if len(above):
+                    correctionStart = reachStart + u[above[0]]*duration + self.correctionLatency
+            if correctionStart is not None:
+                end = max(end, correctionStart + self.correctionDuration)
+
+        self.schedule = {
+            "t0": t0, "from": pos, "home": home, "homeStart": t0, "startClick": startClick,
+            "reachStart": reachStart, "duration": duration, "endpoint": endpoint,
+            "correctionStart": correctionStart, "correction": np.array([-params.cursor_shift, 0.0]),
+            "end": end, "endClick": end + self.dwell,
+        }
+
+    def _advance(self, t):
+        # move on to the next trials when the end click of the current one has passed
+        while t > self.schedule["endClick"] + 1e-9:
+            endClick = self.schedule["endClick"]
+            pos = self._position(endClick)
+            self.trial += 1
+            self.plan_trial(endClick, pos)
+
+    def _position(self, t):
+        s = self.schedule
+        if t < s["reachStart"]:
+            if "from" not in s:
+                return s["home"].copy()
+            u = (t - s["homeStart"])/self.homeDuration
+            return s["from"] + (s["home"] - s["from"])*minimum_jerk(u)
+        pos = s["home"] + (s["endpoint"] - s["home"])*minimum_jerk((t - s["reachStart"])/s["duration"])
+        if s["correctionStart"] is not None and t > s["correctionStart"]:
+            pos = pos + s["correction"]*minimum_jerk((t - s["correctionStart"])/self.correctionDuration)
+        return pos
+
+    def position(self, t):
+        """hand (mouse) position at time t"""
+        self._advance(t)
+        return self._position(t)
+
+    def clicks(self, t0, t1):
+        """True if the participant clicks between t0 and t1 (one frame)"""
+        self._advance(t0)
+        s = self.schedule
+        return t0 <= s["startClick"] < t1 or t0 <= s["endClick"] < t1
@@ -0,0 +1,354 @@
+"""
+Live monitoring of a running session from a separate process.
+
+The experiment publishes every finished trial into a ring buffer in shared memory (TrialPublisher,
+CloudExperiment(monitor=True)): the numeric conditions including the score, whether the trial was a
+hit with the scoring rule of the experiment, the movement time, the end point and the trajectory downsampled to N_POINTS points in time. Publishing copies one record,
+nothing waits for the monitor, and a monitor that is not running costs nothing else.
+
+The monitor attaches to the buffer of a participant (TrialFeed, waiting for the session to start if
+necessary) and keeps running statistics (LiveMonitor): movement time outliers (threshold SDs from
+the mean of the trials so far, the criterion of remove_outliers), conditions that were never hit,
+runs of misses, and the mean movement time, score, hit rate and path per condition. Start it in a
+second terminal, from the 02_Experiment_Code directory:
+
+    python -m Experiment_helpers.live_monitor <alias>
+
+Shared memory layout (segment handeln_<alias>_<hash>, see segment_name):
+    control    int64 [count, closed, capacity, layout length]: count of published trials, written
+               after the record, so readers never need a lock (one writer, the experiment)
+    layout     JSON with the participant, the condition names and the path points (record_dtype),
+               written once before the first trial
+    records    capacity records (record_dtype), trial i in slot i % capacity
+"""
+
+import hashlib
+import json
+import re
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+MONITOR_FORMAT = "handeln-live-monitor"
+HEADER_BYTES = 4096
+N_CONTROL = 4
+N_POINTS = 32
+
+
+def segment_name(participantID: str) -> str:
+    # portable shared memory name: no path characters, and short (31 characters on macOS). The hash of
+    # the full ID keeps IDs apart that differ only in punctuation or after the first 12 characters
+    digest = hashlib.sha1(str(participantID).encode()).hexdigest()[:8]
+    return "handeln_" + re.sub(r"[^A-Za-z0-9_]", "_", str(participantID))[:12] + "_" + digest
+
+
+def record_dtype(conditionNames: List[str], nPoints: int = N_POINTS) -> np.dtype:
+    """one trial: number, conditions, hit (1, 0 or NaN if unknown), movement time, end point and path (nPoints x (x, y))"""
+    return np.dtype([("trial", "<i8")] + [(name, "<f8") for name in conditionNames] +
+                    [("hit", "<f8"), ("movement_time", "<f8"), ("n_samples", "<i8"), ("end_x", "<f8"), ("end_y", "<f8"),
+                     ("path", "<f8", (nPoints, 2))])
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name, track = False) # python >= 3.13
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        # before 3.13 attaching registers the segment, and the resource tracker would remove it when
+        # the monitor exits
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+class TrialPublisher:
+    def __init__(self, participantID: str, conditionNames: List[str], capacity: int = 1024, nPoints: int = N_POINTS):
+        """
+        Ring buffer in shared memory the experiment publishes its finished trials to (see module docstring).
+
+        participantID: the segment is named after the participant (segment_name), for the monitor to find it
+        conditionNames: numeric conditions to publish, including trial_score
+        capacity: int. Trials kept in the buffer, a monitor that is further behind skips the oldest
+        nPoints: int. Points of the downsampled path
+
+        A segment left behind by a crashed session of the same participant is replaced.
+        """
+        self.name = segment_name(participantID)
+        self.conditionNames = list(conditionNames)
+        self.nPoints = nPoints
+        self.dtype = record_dtype(self.conditionNames, nPoints)
+        size = HEADER_BYTES + capacity*self.dtype.itemsize
+        try:
+            self.memory = shared_memory.SharedMemory(self.name, create = True, size = size)
+        except FileExistsError:
+            # attached and unlinked by the same process, so the resource tracker stays consistent
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(self.name, create = True, size = size)
+        self.control = np.ndarray(N_CONTROL, dtype = np.int64, buffer = self.memory.buf)
+        self.records = np.ndarray(capacity, dtype = self.dtype, buffer = self.memory.buf, offset = HEADER_BYTES)
+        self.grid = np.linspace(0, 1, nPoints)
+        self.record = np.zeros(1, dtype = self.dtype)[0]
+
+        layout = json.dumps({"format": MONITOR_FORMAT, "participant": participantID,
+                             "conditions": self.conditionNames, "nPoints": nPoints}).encode()
+        if 8*N_CONTROL + len(layout) > HEADER_BYTES:
+            raise ValueError("too many conditions for the monitor header")
+        self.memory.buf[8*N_CONTROL:8*N_CONTROL + len(layout)] = layout
+        self.control[:] = (0, 0, capacity, len(layout))
+
+    def publish(self, trial: int, conditions: Dict, trajectory: np.ndarray, hit: bool = None):
+        """
+        Add a finished trial: conditions dict (as written with the trial), its trajectory (time,
+        cursor_x, cursor_y columns) and whether it was a hit with the scoring rule of the experiment
+        (None if the rule does not say). Trials without samples are not published.
+        """
+        if len(trajectory) == 0:
+            return
+        record = self.record
+        record["trial"] = trial
+        for name in self.conditionNames:
+            record[name] = conditions[name]
+        record["hit"] = np.nan if hit is None else float(hit)
+        times = trajectory["time"]
+        record["movement_time"] = times[-1]
+        record["n_samples"] = len(trajectory)
+        record["end_x"] = trajectory["cursor_x"][-1]
+        record["end_y"] = trajectory["cursor_y"][-1]
+        grid = times[0] + self.grid*(times[-1] - times[0])
+        record["path"][:, 0] = np.interp(grid, times, trajectory["cursor_x"])
+        record["path"][:, 1] = np.interp(grid, times, trajectory["cursor_y"])
+
+        count = int(self.control[0])
+        self.records[count % len(self.records)] = record
+        # the count is increased after the record is complete
+        self.control[0] = count + 1
+
+    def close(self):
+        """mark the session as finished (attached monitors read the rest and stop) and remove the segment"""
+        if self.memory is None:
+            return
+        self.control[1] = 1
+        del self.control, self.records
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+
+class TrialFeed:
+    def __init__(self, participantID: str, timeout: float = None, poll: float = 0.2):
+        """
+        Reader of the trials a session publishes (see TrialPublisher), usually in another process.
+
+        participantID: participant of the session
+        timeout: seconds to wait for the session to start, None waits forever
+        poll: seconds between checks while waiting
+        """
+        name = segment_name(participantID)
+        start = time.monotonic()
+        while True:
+            try:
+                self.memory = _attach(name)
+                self.control = np.ndarray(N_CONTROL, dtype = np.int64, buffer = self.memory.buf)
+                if self.control[3] > 0:
+                    break
+                del self.control
+                self.memory.close()
+            except FileNotFoundError:
+                pass
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"no session of participant {participantID} is publishing trials")
+            time.sleep(poll)
+
+        layoutLength = int(self.control[3])
+        layout = json.loads(bytes(self.memory.buf[8*N_CONTROL:8*N_CONTROL + layoutLength]))
+        if layout.get("format") != MONITOR_FORMAT:
+            raise ValueError(f"shared memory {name} is not a trial monitor buffer")
+        self.participantID = layout["participant"]
+        self.conditionNames = layout["conditions"]
+        self.dtype = record_dtype(self.conditionNames, layout["nPoints"])
+        self.records = np.ndarray(int(self.control[2]), dtype = self.dtype, buffer = self.memory.buf,
+                                  offset = HEADER_BYTES)
+        self.position = 0 # published trials read so far (including dropped ones)
+        self.dropped = 0
+
+    @property
+    def closed(self) -> bool:
+        """the session finished (there may still be unread trials)"""
+        return bool(self.control[1])
+
+    def read(self) -> np.ndarray:
+        """copy of the trials published since the last read (the oldest are dropped if the reader fell behind)"""
+        capacity = len(self.records)
+        count = int(self.control[0])
+        first = max(self.position, count - capacity)
+        slots = np.arange(first, count) % capacity
+        new = self.records[slots]
+        # the writer may have reused slots while they were copied
+        overwritten = max(0, int(self.control[0]) - capacity - first)
+        self.dropped += first - self.position + overwritten
+        self.position = count
+        return new[overwritten:]
+
+    def close(self):
+        del self.control, self.records
+        self.memory.close()
+
+
+class LiveMonitor:
+    def __init__(self, by: List[str] = ("cursor_SX", "cursor_SY", "cursor_shift"), threshold: float = 3.0,
+                 minTrials: int = 5, missRun: int = 10):
+        """
+        Running statistics of the published trials of a session, updated with every batch of new trials.
+
+        by: condition columns of the per condition statistics
+        threshold: outlier criterion, in SDs of the movement time of all trials so far
+        minTrials: trials before outliers are flagged, and trials of a condition before it counts as never hit
+        missRun: number of consecutive misses that raises an alert
+
+        Hits are the ones published by the experiment (with its scoring rule); trials of a rule without
+        hits count for the movement times and scores only.
+        """
+        self.by = list(by)
+        self.threshold = threshold
+        self.minTrials = minTrials
+        self.missRun = missRun
+        self.trials = []
+        self.movementTimes = []
+        # running movement time moments of the session (Welford)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.misses = 0
+        # per condition: n, judged (hit known), hits, sum and sum of squares of the movement time, sum of the score, sum of the paths
+        self.conditions = {}
+        self.neverHit = set()
+
+    @property
+    def sd(self) -> float:
+        return np.sqrt(self.m2/(self.n - 1)) if self.n > 1 else np.nan
+
+    def outliers(self) -> np.ndarray:
+        """trials whose movement time is an outlier with the statistics of all trials so far"""
+        movementTimes = np.array(self.movementTimes)
+        if self.n < self.minTrials:
+            return np.zeros(0, dtype = np.int64)
+        return np.array(self.trials)[np.abs(movementTimes - self.mean) > self.threshold*self.sd]
+
+    def update(self, records: np.ndarray) -> List[str]:
+        """add the new trials (TrialFeed.read), returns alerts for them"""
+        alerts = []
+        if len(records) == 0:
+            return alerts
+        for record in records:
+            trial, movementTime = int(record["trial"]), float(record["movement_time"])
+            if self.n >= self.minTrials and abs(movementTime - self.mean) > self.threshold*self.sd:
+                alerts.append(f"trial {trial}: movement time {movementTime:.3f} s is more than {self.threshold:g} SD "
+                              f"from the mean ({self.mean:.3f} s, SD {self.sd:.3f} s)")
+            self.trials.append(trial)
+            self.movementTimes.append(movementTime)
+            self.n += 1
+            delta = movementTime - self.mean
+            self.mean += delta/self.n
+            self.m2 += delta*(movementTime - self.mean)
+
+            hit = float(record["hit"])
+            known = not np.isnan(hit)
+            if known:
+                self.misses = 0 if hit else self.misses + 1
+            if known and not hit and self.misses == self.missRun:
+                alerts.append(f"trial {trial}: no hit in the last {self.missRun} trials")
+
+            key = tuple(record[name].item() for name in self.by)
+            stats = self.conditions.get(key)
+            if stats is None:
+                stats = self.conditions[key] = {"n": 0, "judged": 0, "hits": 0, "mt": 0.0, "mt2": 0.0,
+                                                "score": 0.0, "path": np.zeros(record["path"].shape)}
+            stats["n"] += 1
+            stats["judged"] += int(known)
+            stats["hits"] += int(known and hit)
+            stats["mt"] += movementTime
+            stats["mt2"] += movementTime**2
+            stats["score"] += float(record["trial_score"])
+            stats["path"] += record["path"]
+            if stats["hits"] == 0 and stats["judged"] >= self.minTrials and key not in self.neverHit:
+                self.neverHit.add(key)
+                alerts.append(f"trial {trial}: condition {self._label(key)} never hit in {stats['judged']} trials")
+            elif stats["hits"] and key in self.neverHit:
+                self.neverHit.discard(key)
+        return alerts
+
+    def _label(self, key: Tuple) -> str:
+        return ", ".join(f"{name}={value:g}" for name, value in zip(self.by, key))
+
+    def summary(self):
+        """
+        Statistics per condition: trials, hits, hit rate, mean and SD of the movement time, mean score
+
+        Returns:
+            pd.DataFrame indexed by the condition columns
+        """
+        import pandas as pd
+
+        rows = []
+        for key, stats in sorted(self.conditions.items()):
+            n = stats["n"]
+            mean = stats["mt"]/n
+            variance = (stats["mt2"] - n*mean**2)/(n - 1) if n > 1 else np.nan
+            hitRate = stats["hits"]/stats["judged"] if stats["judged"] else np.nan
+            rows.append((*key, n, stats["hits"], hitRate, mean, np.sqrt(max(variance, 0)), stats["score"]/n))
+        columns = self.by + ["n_trials", "hits", "hit_rate", "mt_mean", "mt_sd", "score_mean"]
+        return pd.DataFrame(rows, columns = columns).set_index(self.by)
+
+    def mean_paths(self) -> Dict[Tuple, np.ndarray]:
+        """mean downsampled path (N_POINTS x (x, y)) per condition"""
+        return {key: stats["path"]/stats["n"] for key, stats in self.conditions.items()}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Monitor a running session: outliers, misses and statistics per condition")
+    parser.add_argument("participant", help = "alias of the participant of the session")
+    parser.add_argument("--by", nargs = "+", default = ["cursor_SX", "cursor_SY", "cursor_shift"],
+                        help = "condition columns of the statistics")
+    parser.add_argument("--threshold", type = float, default = 3.0, help = "outlier threshold in SD of the movement time")
+    parser.add_argument("--miss-run", type = int, default = 10, help = "consecutive misses that raise an alert")
+    parser.add_argument("--interval", type = float, default = 0.5, help = "seconds between checks for new trials")
+    parser.add_argument("--paths", default = None, help = "write the mean paths per condition to this CSV file at the end")
+    args = parser.parse_args()
+
+    print(f"waiting for a session of {args.participant} ...", flush = True)
+    feed = TrialFeed(args.participant)
+    monitor = LiveMonitor(args.by, threshold = args.threshold, missRun = args.miss_run)
+    print(f"monitoring {feed.participantID}", flush = True)
+    try:
+        while True:
+            closed = feed.closed
+            records = feed.read()
+            if len(records):
+                for alert in monitor.update(records):
+                    print("ALERT " + alert)
+                print(f"\n{monitor.n} trials, movement time {monitor.mean:.3f} s (SD {monitor.sd:.3f} s), "
+                      f"{len(monitor.outliers())} outliers, {feed.dropped} dropped")
+                print(monitor.summary().round(3).to_string(), flush = True)
+            if closed:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        feed.close()
+    print(f"session finished, outliers: {monitor.outliers().tolist()}")
+    if args.paths is not None and monitor.conditions:
+        import pandas as pd
+        frames = []
+        for key, path in monitor.mean_paths().items():
+            frame = pd.DataFrame({"point": np.arange(len(path)), "cursor_x": path[:, 0], "cursor_y": path[:, 1]})
+            for column, (name, value) in enumerate(zip(args.by, key)):
+                frame.insert(column, name, value)
+            frames.append(frame)
+        pd.concat(frames, ignore_index = True).to_csv(args.paths, index = False)
+        print(f"mean paths written to {args.paths}")
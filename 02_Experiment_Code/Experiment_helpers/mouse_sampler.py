@@ -0,0 +1,99 @@
+"""
+Mouse samples at the rate of the device, independent of the display refresh
+
+psychopy's window Mouse only changes when the window events are pumped (once per frame), so
+polling it faster only repeats the frame rate samples (and pyglet's window is not thread safe).
+The samples therefore come from a source that reads the device itself and time stamps every
+sample: with psychopy the iohub mouse (IohubMouseSource, iohub runs in its own process and
+reports every event of the device with its time), headless a source that samples the synthetic
+participant at a fixed rate (headless.MouseSource). The frame loop collects the new samples of
+the source once per frame (MouseSampler.update), nothing runs on another thread.
+"""
+
+import numpy as np
+
+STREAM_DTYPE = np.dtype([("time", "<f8"), ("mouse_x", "<f8"), ("mouse_y", "<f8")])
+
+
+class IohubMouseSource:
+    def __init__(self, window, rate = None):
+        """
+        Mouse events of the iohub server (launched here for the window, so positions are in the
+        units of the window and times on the psychopy clock, like core.getTime).
+
+        window: the psychopy window of the experiment
+        rate: unused, the samples come at the rate the device reports them
+        """
+        from psychopy.iohub import launchHubServer
+        self.io = launchHubServer(window = window)
+        self.mouse = self.io.devices.mouse
+
+    def read(self):
+        """(times, positions (n x 2)) of the events since the last read"""
+        events = self.mouse.getEvents()
+        times = np.array([event.time for event in events], dtype = float)
+        xy = np.array([(event.x_position, event.y_position) for event in events], dtype = float).reshape(-1, 2)
+        return times, xy
+
+    def close(self):
+        self.io.quit()
+
+
+class MouseSampler:
+    def __init__(self, source, capacity = 2**16):
+        """
+        Ring buffer of the samples of a device-level mouse source.
+
+        source: has read() returning the (times, positions) of the samples since the last read and
+            close(), e.g. IohubMouseSource or headless.MouseSource (see backend.MouseSource)
+        capacity: int. Size of the ring buffer, at 1000 Hz the default holds about 65 s
+
+        update is called once per frame, from the frame loop.
+        """
+        self.source = source
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.xy = np.zeros([capacity, 2])
+        self.count = 0 # total number of samples written
+
+    def update(self):
+        """collect the new samples of the source"""
+        times, xy = self.source.read()
+        n = len(times)
+        if n == 0:
+            return
+        if n > self.capacity:
+            times, xy = times[-self.capacity:], xy[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        slots = np.arange(self.count, self.count + n) % self.capacity
+        self.times[slots] = times
+        self.xy[slots] = xy
+        self.count += n
+
+    def latest(self):
+        """(time, position) of the most recent sample, (None, None) before the first sample"""
+        count = self.count
+        if count == 0:
+            return None, None
+        slot = (count - 1) % self.capacity
+        return self.times[slot], self.xy[slot].copy()
+
+    def samples(self, start, end = None):
+        """structured array (time, mouse_x, mouse_y) with the buffered samples from time start to end"""
+        count = self.count
+        n = min(count, self.capacity)
+        slots = np.arange(count - n, count) % self.capacity
+        times = self.times[slots]
+        keep = times >= start
+        if end is not None:
+            keep &= times <= end
+        slots = slots[keep]
+        stream = np.zeros(len(slots), dtype = STREAM_DTYPE)
+        stream["time"] = self.times[slots]
+        stream["mouse_x"] = self.xy[slots, 0]
+        stream["mouse_y"] = self.xy[slots, 1]
+        return stream
+
+    def stop(self):
+        self.source.close()
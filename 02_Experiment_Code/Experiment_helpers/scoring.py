@@ -0,0 +1,214 @@
+"""
+Scoring of the pointing endpoints.
+
+A scoring rule turns the endpoints of any number of trials into scores with one array operation:
+
+    rule(offset, targetSize, cursorSize) -> int array of scores
+
+with arrays (trials x 2) of the cursor position relative to the target centre, the target size
+(target_SX, target_SY) and the cursor size (cursor_SX, cursor_SY). A rule can also say which
+trials are hits (rule.hit with the same arguments, a bool array), which the experiment publishes
+to the live monitor. The experiment scores every trial with its rule (CloudExperiment(scoring=...),
+ExponentialScore by default), and the same rules re-score recorded trials, e.g. to see what the scores would have been with another slope or
+with the cursor size taken into account:
+
+    from Experiment_helpers import scoring
+
+    endpoints = scoring.load_endpoints(["data/max", "data/anna"])
+    scores = scoring.rescore(endpoints, {"recorded": scoring.ExponentialScore(),
+                                         "steep": scoring.ExponentialScore(slope=1/2),
+                                         "cursor": scoring.ExponentialScore(cursorWeight=1)})
+    scoring.compare(scores, by=["target_SX", "target_SY"])
+
+or from the command line:
+
+    python -m Experiment_helpers.scoring data/max data/anna --slopes 0.2 0.5 --cursor-weights 0 1
+"""
+
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from .trial_store import TRIAL_FILE_PATTERN, TrialStore, find_trial_files, read_trial_csv
+
+
+class ExponentialScore:
+    def __init__(self, slope: float = 1/5, maxScore: int = 100, cursorWeight: float = 0.0):
+        """
+        The rule of the experiment: the full score while the endpoint is within the target, and an
+        exponential decay of the score with the error outside.
+
+            error = sum(offset**2 / (2 * size**2)) over x and y, size**2 = targetSize**2 + cursorWeight * cursorSize**2
+            score = maxScore if error < 1, else round(maxScore * exp(-(error - 1) * slope))
+
+        slope: decay of the score outside the target
+        maxScore: score of a hit
+        cursorWeight: 0 scores relative to the target size only (participants aim with the centre of the
+            cursor), 1 adds the cursor size to the target size (in quadrature)
+        """
+        self.slope = slope
+        self.maxScore = maxScore
+        self.cursorWeight = cursorWeight
+
+    def error(self, offset: np.ndarray, targetSize: np.ndarray, cursorSize: np.ndarray) -> np.ndarray:
+        """normalized error of every trial (1 on the edge of the target)"""
+        size2 = np.asarray(targetSize, dtype=float)**2
+        if self.cursorWeight:
+            size2 = size2 + self.cursorWeight * np.asarray(cursorSize, dtype=float)**2
+        return np.sum(np.asarray(offset, dtype=float)**2 / (2*size2), axis=-1)
+
+    def hit(self, offset: np.ndarray, targetSize: np.ndarray, cursorSize: np.ndarray) -> np.ndarray:
+        """trials whose endpoint is within the target (error < 1)"""
+        return self.error(offset, targetSize, cursorSize) < 1
+
+    def __call__(self, offset: np.ndarray, targetSize: np.ndarray, cursorSize: np.ndarray) -> np.ndarray:
+        error = self.error(offset, targetSize, cursorSize)
+        decay = np.round(self.maxScore * np.exp(-(error - 1)*self.slope))
+        return np.where(error < 1, self.maxScore, decay).astype(np.int64)
+
+    def __repr__(self):
+        return f"ExponentialScore(slope={self.slope:g}, maxScore={self.maxScore}, cursorWeight={self.cursorWeight:g})"
+
+
+class GaussianScore(ExponentialScore):
+    def __init__(self, maxScore: int = 100, cursorWeight: float = 0.0):
+        """
+        Gaussian rule without a plateau: round(maxScore * exp(-error)), with the error of ExponentialScore,
+        so every pixel closer to the centre of the target counts. A hit is an endpoint within the
+        target, as with ExponentialScore.
+        """
+        super().__init__(slope=1, maxScore=maxScore, cursorWeight=cursorWeight)
+
+    def __call__(self, offset: np.ndarray, targetSize: np.ndarray, cursorSize: np.ndarray) -> np.ndarray:
+        error = self.error(offset, targetSize, cursorSize)
+        return np.round(self.maxScore * np.exp(-error)).astype(np.int64)
+
+    def __repr__(self):
+        return f"GaussianScore(maxScore={self.maxScore}, cursorWeight={self.cursorWeight:g})"
+
+
+def score_trials(rule, conditions, end_x: np.ndarray, end_y: np.ndarray) -> np.ndarray:
+    """
+    Scores of trials from their conditions (target_X, target_Y, target_SX, target_SY, cursor_SX,
+    cursor_SY; a frame, a record array or a dict of arrays) and the cursor position at the end.
+    """
+    column = lambda name: np.asarray(conditions[name], dtype=float)
+    offset = np.stack([np.asarray(end_x, dtype=float) - column("target_X"),
+                       np.asarray(end_y, dtype=float) - column("target_Y")], axis=-1)
+    targetSize = np.stack([column("target_SX"), column("target_SY")], axis=-1)
+    cursorSize = np.stack([column("cursor_SX"), column("cursor_SY")], axis=-1)
+    return rule(offset, targetSize, cursorSize)
+
+
+def _store_endpoints(store: TrialStore):
+    # the last sample of every trial, straight from the memory-mapped trajectory
+    frame = store.conditions_frame()
+    lasts = store.offsets[1:] - 1
+    trajectory = store.trajectory
+    frame["end_x"] = np.asarray(trajectory["cursor_x"][lasts], dtype=float)
+    frame["end_y"] = np.asarray(trajectory["cursor_y"][lasts], dtype=float)
+    return frame
+
+
+def _csv_endpoints(files):
+    import pandas as pd
+
+    rows = []
+    for trial, file_path in files:
+        conditions, trajectory = read_trial_csv(file_path)
+        if len(trajectory):
+            rows.append({"trial": trial, **conditions, "end_x": float(trajectory["cursor_x"][-1]),
+                         "end_y": float(trajectory["cursor_y"][-1])})
+    return pd.DataFrame(rows)
+
+
+def load_endpoints(participant_dirs: List[str]):
+    """
+    Conditions (including the recorded trial_score) and end position of the cursor (end_x, end_y)
+    of every trial of the participants, one row per trial.
+
+    A participant folder with a trial store (participant_<id>_store) is read from the store, otherwise
+    from the per trial CSV files.
+
+    Returns:
+        pd.DataFrame with the columns participant and trial, the conditions, end_x and end_y
+    """
+    import pandas as pd
+
+    frames = []
+    for participant_dir in participant_dirs:
+        stores = [name for name in sorted(os.listdir(participant_dir))
+                  if name.startswith("participant_") and name.endswith("_store")
+                  and os.path.isdir(os.path.join(participant_dir, name))]
+        if stores:
+            with TrialStore(os.path.join(participant_dir, stores[0])) as store:
+                participantID = store.participantID
+                frame = _store_endpoints(store)
+        else:
+            files = find_trial_files(participant_dir)
+            if not files:
+                continue
+            participantID = TRIAL_FILE_PATTERN.match(os.path.basename(files[0][1])).group("participant")
+            frame = _csv_endpoints(files)
+        frame.insert(0, "participant", participantID)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def rescore(endpoints, rules: Dict[str, object]):
+    """
+    Score all trials with every rule: a copy of endpoints (see load_endpoints) with a column
+    score_<name> per rule.
+    """
+    scores = endpoints.copy()
+    for name, rule in rules.items():
+        scores["score_" + name] = score_trials(rule, endpoints, endpoints["end_x"], endpoints["end_y"])
+    return scores
+
+
+def compare(scores, by: List[str] = None):
+    """
+    Mean score per rule (columns score_<name>) and, if the recorded scores are present, their mean
+    and the fraction of trials where a rule gives the recorded score (<name>_same). With by one row
+    per condition, otherwise one row for all trials.
+    """
+    rules = [name for name in scores.columns if name.startswith("score_")]
+    columns = {"n_trials": np.ones(len(scores))}
+    columns.update({name: scores[name] for name in rules})
+    if "trial_score" in scores.columns:
+        recorded = scores["trial_score"].to_numpy()
+        columns["trial_score"] = recorded
+        columns.update({name[len("score_"):] + "_same": scores[name].to_numpy() == recorded for name in rules})
+    table = scores[list(by or [])].assign(**columns)
+    if not by:
+        return table.mean().to_frame().T.assign(n_trials=len(scores))
+    summary = table.groupby(list(by), sort=True).mean()
+    summary["n_trials"] = table.groupby(list(by), sort=True).size()
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Score recorded trials with alternative scoring rules")
+    parser.add_argument("participant_dirs", nargs="+", help="data/<participant> directories")
+    parser.add_argument("--slopes", nargs="+", type=float, default=[1/5], help="slopes of ExponentialScore")
+    parser.add_argument("--cursor-weights", nargs="+", type=float, default=[0.0],
+                        help="weights of the cursor size in the size of the target")
+    parser.add_argument("--gaussian", action="store_true", help="also score with GaussianScore")
+    parser.add_argument("--by", nargs="*", default=["target_SX", "target_SY", "cursor_SX", "cursor_SY"],
+                        help="conditions to compare the rules per")
+    parser.add_argument("--output", default=None, help="write the scores of all trials to this CSV file")
+    args = parser.parse_args()
+
+    rules = {f"slope{slope:g}_cursor{weight:g}": ExponentialScore(slope, cursorWeight=weight)
+             for slope in args.slopes for weight in args.cursor_weights}
+    if args.gaussian:
+        rules.update({f"gaussian_cursor{weight:g}": GaussianScore(cursorWeight=weight) for weight in args.cursor_weights})
+    scores = rescore(load_endpoints(args.participant_dirs), rules)
+    print(f"{len(scores)} trials")
+    print(compare(scores, args.by or None).round(3).to_string())
+    if args.output is not None:
+        scores.to_csv(args.output, index=False)
+        print(f"scores written to {args.output}")
@@ -0,0 +1,121 @@
+"""
+Pool of stimuli that are built once and reused across trials
+"""
+
+from .backend import Circle
+from .dots_class import lltDotCloud, DotCloudGroup
+
+
+class StimulusPool:
+    def __init__(self, win, bufferFrames = 600):
+        """
+        Builds every distinct cursor, target and start point (and the DotCloudGroup for every
+        combination of clouds) once, and hands out the same objects again for trials with the same
+        configuration, only moving them to the trial's position and reseeding the clouds.
+
+        win: psychopy Window
+        bufferFrames: int. Frames of dot respawns drawn in advance at trial start (see lltDotCloud.reserve)
+        """
+        self.win = win
+        self.bufferFrames = bufferFrames
+        self.stimuli = {}
+        self.groups = {}
+
+    def prepare(self, conditions):
+        """
+        Build the stimuli for all configurations in the trial list.
+
+        conditions: trial records (e.g. a TrialPlan) with (at least) the attributes nDotsCursor,
+            cursor_SX, cursor_SY, nDotsTarget, target_SX, target_SY and startradius
+        """
+        configs = {(c.nDotsCursor, c.cursor_SX, c.cursor_SY, c.nDotsTarget, c.target_SX, c.target_SY, c.startradius)
+                   for c in conditions}
+        for nDotsCursor, cursor_SX, cursor_SY, nDotsTarget, target_SX, target_SY, startradius in configs:
+            cursor = self.cursor(nDotsCursor, cursor_SX, cursor_SY, (0,0))
+            target = self.target(nDotsTarget, target_SX, target_SY, (0,0))
+            self.cloud_group(target, cursor)
+            self.startpoint(startradius, (0,0))
+
+    def warm_up(self):
+        """
+        Draw every configuration once into the back buffer (and clear it again without flipping),
+        so shaders and vertex buffers are resident before the first trial.
+        """
+        for stim in self.stimuli.values():
+            if not isinstance(stim, lltDotCloud):
+                stim.draw()
+        for group in self.groups.values():
+            group.main_update()
+            group.draw()
+        self.win.clearBuffer()
+
+    def cursor(self, nDots, SX, SY, pos, seed = None):
+        key = ('cursor', int(nDots), float(SX), float(SY))
+        if key not in self.stimuli:
+            if nDots == 1:
+                self.stimuli[key] = Circle(
+                    win=self.win,
+                    radius=(SX,SY),
+                    fillColor="black",
+                    colorSpace='rgb',
+                    pos=pos
+                )
+            else:
+                self.stimuli[key] = lltDotCloud(
+                    pos = pos,
+                    n_dots = int(nDots),
+                    spawn_sigma = (SX,SY,0),
+                    win = None, # drawn by a DotCloudGroup
+                    colors = (0,0,0),
+                    lifeSpan = 5)
+        return self._place(self.stimuli[key], pos, seed)
+
+    def target(self, nDots, SX, SY, pos, seed = None):
+        key = ('target', int(nDots), float(SX), float(SY))
+        if key not in self.stimuli:
+            if nDots == 1:
+                self.stimuli[key] = Circle(
+                    win=self.win,
+                    radius= (SX,SY),
+                    fillColor="white",
+                    colorSpace='rgb',
+                    pos=pos
+                )
+            else:
+                self.stimuli[key] = lltDotCloud(
+                    pos = pos,
+                    n_dots = int(nDots),
+                    spawn_sigma = (SX,SY,0),
+                    win = None, # drawn by a DotCloudGroup
+                    lifeSpan = 5)
+        return self._place(self.stimuli[key], pos, seed)
+
+    def startpoint(self, radius, pos):
+        key = ('start', float(radius))
+        if key not in self.stimuli:
+            self.stimuli[key] = Circle(
+                win=self.win,
+                radius=radius,
+                fillColor="green",
+                colorSpace='rgb',
+                pos=pos
+            )
+        return self._place(self.stimuli[key], pos, None)
+
+    def cloud_group(self, target, cursor):
+        """DotCloudGroup drawing the clouds among target and cursor (target below cursor), None if there are none"""
+        clouds = [stim for stim in (target, cursor) if isinstance(stim, lltDotCloud)]
+        if not clouds:
+            return None
+        key = tuple(id(cloud) for cloud in clouds)
+        if key not in self.groups:
+            self.groups[key] = DotCloudGroup(clouds, self.win)
+        return self.groups[key]
+
+    def _place(self, stim, pos, seed):
+        # reconfigure a pooled stimulus for a new trial
+        if isinstance(stim, lltDotCloud):
+            stim.reset(pos, seed, self.bufferFrames)
+        else:
+            stim.pos = pos
+        return stim
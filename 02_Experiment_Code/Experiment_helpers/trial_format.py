@@ -0,0 +1,27 @@
+"""
+Format of the per trial CSV files, shared by the experiment (trial_store.py) and the analysis
+(handeln_analysis.files and handeln_analysis.loader). Only the standard library is used.
+"""
+
+import re
+
+# types of the known trajectory columns, any other column is float
+TRAJECTORY_COLUMNS = {
+    "time": "<f8",
+    "frame_nr": "<i4",
+    "cursor_x": "<f8",
+    "cursor_y": "<f8",
+    "shift_applied": "<i1",
+}
+
+TRIAL_FILE_PATTERN = re.compile(r"participant_(?P<participant>.+)_trial_(?P<trial>\d+)_trajectory\.csv$")
+
+
+def parse_value(text: str):
+    """a value of the conditions row: int, float or the text itself"""
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
@@ -0,0 +1,47 @@
+"""
+Preallocated buffer for the samples recorded during a trial
+"""
+
+import numpy as np
+
+
+class TrialHistory:
+    def __init__(self, dtype, capacity = 1024):
+        """
+        Typed columns (a structured array) that are filled sample by sample without allocating:
+        the buffer is preallocated and doubles in size when it is full.
+
+        dtype: numpy structured dtype of a sample (see trial_store.trajectory_dtype)
+        capacity: int. Number of samples to preallocate (about 17 s at 60 Hz for the default)
+        """
+        self.buffer = np.zeros(capacity, dtype = dtype)
+        self.n = 0
+
+    def append(self, *values):
+        # one value per column, in the order of the dtype
+        if self.n == len(self.buffer):
+            self.buffer = np.concatenate((self.buffer, np.zeros_like(self.buffer)))
+        self.buffer[self.n] = values
+        self.n += 1
+
+    def set_last(self, column, value):
+        self.buffer[column][self.n - 1] = value
+
+    def last(self, column):
+        return self.buffer[column][self.n - 1]
+
+    @property
+    def data(self):
+        """view (no copy) of the recorded samples"""
+        return self.buffer[:self.n]
+
+    def column(self, column):
+        """view (no copy) of one column of the recorded samples"""
+        return self.buffer[column][:self.n]
+
+    def clear(self):
+        # keeps the allocated buffer for the next trial
+        self.n = 0
+
+    def __len__(self):
+        return self.n
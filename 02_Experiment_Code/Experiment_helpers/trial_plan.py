@@ -0,0 +1,61 @@
+"""
+Trial list compiled for the frame loop: typed records with attribute access instead of DataFrame lookups
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+class TrialPlan:
+    def __init__(self, records):
+        """
+        records: numpy structured array with one record per trial (see from_frame)
+
+        plan[i] gives the parameters of trial i as a namedtuple (attribute access, no pandas),
+        e.g. plan[i].cursor_SX. The plan can be saved as a session file, such that a session
+        can be resumed at the next trial after a crash (see save and load).
+        """
+        self.records = records
+        self.TrialParams = namedtuple("TrialParams", records.dtype.names)
+        # convert once to python scalars, so the frame loop does not touch numpy scalars either
+        self.trials = [self.TrialParams(*values) for values in records.tolist()]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """compile the trial list (e.g. the output of repeat_and_shuffle) into a plan"""
+        columns = []
+        for name in df.columns:
+            values = df[name].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            columns.append(values)
+        return cls(np.rec.fromarrays(columns, names = [str(name) for name in df.columns]).view(np.ndarray))
+
+    def __len__(self):
+        return len(self.trials)
+
+    def __getitem__(self, trial):
+        return self.trials[trial]
+
+    def to_frame(self):
+        return pd.DataFrame(self.records)
+
+    def save(self, path, nextTrial = 0, totalScore = 0):
+        """
+        Save the plan, the trial to continue with and the total score so far in a session file (.npz).
+        The file is replaced atomically, so a crash while saving keeps the previous version.
+        """
+        tmpPath = path + ".tmp.npz"
+        np.savez(tmpPath, records = self.records, nextTrial = nextTrial, totalScore = totalScore)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path):
+        """returns the plan, the trial to continue with and the total score so far from a session file"""
+        with np.load(path) as session:
+            # session files of older versions have no total score
+            totalScore = int(session["totalScore"]) if "totalScore" in session.files else 0
+            return cls(session["records"]), int(session["nextTrial"]), totalScore
@@ -0,0 +1,432 @@
+"""
+Recorders that write out the data of finished trials.
+
+CsvTrialRecorder writes the original layout: one CSV file per trial with the
+conditions (header + row) followed by the trajectory (header + rows).
+
+TrialStore appends all trials of one participant to a single binary store:
+
+    participant_<id>_store/
+        meta.json         record layouts (numpy dtypes) of the tables below
+        trajectory.bin    trajectory samples of all trials, packed records
+        conditions.bin    one packed record per trial with the conditions + trial_score
+        trials.bin        one (trial, offset, n_samples) record per trial
+        timing.csv        frame timing summary per trial (only for instrumented sessions)
+        <stream>.bin      extra per trial sample streams, e.g. the high-rate mouse samples,
+        <stream>_trials.bin   with their own (trial, offset, n_samples) index
+
+The tables are raw numpy records, so they can be memory-mapped without parsing.
+A trial is only visible to readers once its record in trials.bin is written,
+which happens last. A crash can still leave the start of the next trial (or of
+a stream) in the other tables; opening the store with mode "a" truncates every
+table to the extent of the committed trials in trials.bin (and <stream>_trials.bin),
+so trials appended after a resume line up with their conditions again.
+
+Existing CSV data directories can be converted with:
+
+    python -m Experiment_helpers.trial_store data/<participant>
+"""
+
+import csv
+import json
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .trial_format import TRAJECTORY_COLUMNS, TRIAL_FILE_PATTERN, parse_value
+
+TRAJECTORY_DTYPE = np.dtype(list(TRAJECTORY_COLUMNS.items()))
+TRIAL_INDEX_DTYPE = np.dtype([("trial", "<i8"), ("offset", "<i8"), ("n_samples", "<i8")])
+
+STORE_FORMAT = "handeln-trial-store"
+STORE_VERSION = 1
+
+
+def trajectory_dtype(columns: List[str]) -> np.dtype:
+    """dtype for trajectory records with the given columns (unknown columns become float)"""
+    return np.dtype([(col, TRAJECTORY_COLUMNS.get(col, "<f8")) for col in columns])
+
+
+def trajectory_array(rows, columns: List[str] = None) -> np.ndarray:
+    """
+    Convert a list of sample rows (e.g. the trialHistory of the experiment) into a
+    structured trajectory array.
+    """
+    if columns is None:
+        columns = list(TRAJECTORY_COLUMNS)
+    return np.array([tuple(row) for row in rows], dtype=trajectory_dtype(columns))
+
+
+def conditions_dtype(conditions: Dict) -> np.dtype:
+    """dtype for a conditions record, inferred from the values of the first trial"""
+    fields = []
+    for name, value in conditions.items():
+        kind = np.asarray(value).dtype.kind
+        if kind == "b":
+            fields.append((name, "?"))
+        elif kind in "iu":
+            fields.append((name, "<i8"))
+        elif kind == "f":
+            fields.append((name, "<f8"))
+        else:
+            fields.append((name, "<U64"))
+    return np.dtype(fields)
+
+
+def read_trial_csv(file_path: str) -> Tuple[Dict, np.ndarray]:
+    """
+    Read a trial file written by CsvTrialRecorder in one pass.
+
+    Returns:
+        conditions: dict with the conditions of the trial (including trial_score)
+        trajectory: structured array with the trajectory samples
+    """
+    with open(file_path, newline="") as f:
+        reader = csv.reader(f)
+        con_header = next(reader)
+        con_values = next(reader)
+        columns = next(reader)
+        rows = [row for row in reader if row]
+
+    conditions = {name: parse_value(value) for name, value in zip(con_header, con_values)}
+    dtype = trajectory_dtype(columns)
+    trajectory = np.empty(len(rows), dtype=dtype)
+    if rows:
+        values = np.array(rows, dtype=np.float64)
+        for i, col in enumerate(columns):
+            trajectory[col] = values[:, i]
+    return conditions, trajectory
+
+
+def find_trial_files(participant_dir: str) -> List[Tuple[int, str]]:
+    """(trial number, file path) of all trial files in a participant directory, sorted by trial"""
+    files = []
+    for file_name in os.listdir(participant_dir):
+        match = TRIAL_FILE_PATTERN.match(file_name)
+        if match:
+            files.append((int(match.group("trial")), os.path.join(participant_dir, file_name)))
+    return sorted(files)
+
+
+def append_csv_row(file_path: str, row: Dict):
+    """Append a row to a CSV table, writing the header first if the file is new"""
+    new_file = not os.path.exists(file_path)
+    with open(file_path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(row.keys())
+        writer.writerow(row.values())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class CsvTrialRecorder:
+    """
+    Writes every trial to its own CSV file (the original data format).
+    """
+
+    def __init__(self, dataDir: str, participantID: str):
+        self.dataDir = dataDir
+        self.participantID = participantID
+
+    def trial_path(self, trial: int) -> str:
+        file_name = f"participant_{self.participantID}_trial_{trial}_trajectory.csv"
+        return os.path.join(self.dataDir, file_name)
+
+    def write_trial(self, trial: int, conditions: Dict, trajectory: np.ndarray):
+        # written to a temporary file that replaces the trial file: a trial that is written again after
+        # a resume never ends up behind a partial earlier version
+        file_path = self.trial_path(trial)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(conditions.keys())
+            writer.writerow(conditions.values())
+            writer.writerow(trajectory.dtype.names)
+            writer.writerows(trajectory.tolist())
+            # make sure the trial survives a crash of the experiment
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+
+    def write_stream(self, trial: int, name: str, stream: np.ndarray):
+        """Write an extra sample stream of a trial (structured array) to participant_<id>_trial_<nr>_<name>.csv"""
+        file_name = f"participant_{self.participantID}_trial_{trial}_{name}.csv"
+        with open(os.path.join(self.dataDir, file_name), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(stream.dtype.names)
+            writer.writerows(stream.tolist())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_timing(self, trial: int, summary: Dict):
+        """Append the frame timing summary of a trial to participant_<id>_timing.csv"""
+        file_path = os.path.join(self.dataDir, f"participant_{self.participantID}_timing.csv")
+        append_csv_row(file_path, {"trial": trial, **summary})
+
+    def close(self):
+        pass
+
+
+class TrialStore:
+    """
+    Per participant binary trial store (see module docstring for the layout).
+
+    mode "r" opens an existing store for reading, mode "a" creates the store if
+    necessary and appends trials to it with write_trial.
+    """
+
+    def __init__(self, path: str, mode: str = "r", participantID: str = None):
+        if mode not in ("r", "a"):
+            raise ValueError(f"mode should be 'r' or 'a', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.participantID = participantID
+        self.trajectory_dtype = None
+        self.conditions_dtype = None
+        self.stream_dtypes = {}
+        self._files = {}
+
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("format") != STORE_FORMAT:
+                raise ValueError(f"{path} is not a trial store")
+            self.participantID = meta.get("participant", participantID)
+            self.trajectory_dtype = np.dtype([tuple(field) for field in meta["trajectory"]])
+            self.conditions_dtype = np.dtype([tuple(field) for field in meta["conditions"]])
+            self.stream_dtypes = {name: np.dtype([tuple(field) for field in descr])
+                                  for name, descr in meta.get("streams", {}).items()}
+        elif mode == "r":
+            raise FileNotFoundError(f"no trial store found at {path}")
+        else:
+            os.makedirs(path, exist_ok=True)
+        if mode == "a":
+            self._truncate_uncommitted()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    # ------------------------------------------------------------------
+    # writing
+    # ------------------------------------------------------------------
+
+    def _write_meta(self):
+        meta = {
+            "format": STORE_FORMAT,
+            "version": STORE_VERSION,
+            "participant": self.participantID,
+            "trajectory": self.trajectory_dtype.descr,
+            "conditions": self.conditions_dtype.descr,
+            "streams": {name: dtype.descr for name, dtype in self.stream_dtypes.items()},
+        }
+        tmp_path = self._file("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp_path, self._file("meta.json"))
+
+    def _truncate_uncommitted(self):
+        # cut every table back to what the committed index records cover (see module docstring)
+        def truncate(name: str, size: int):
+            file_path = self._file(name)
+            if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+                os.truncate(file_path, size)
+
+        def committed(index_name: str) -> np.ndarray:
+            file_path = self._file(index_name)
+            n_records = os.path.getsize(file_path) // TRIAL_INDEX_DTYPE.itemsize if os.path.exists(file_path) else 0
+            truncate(index_name, n_records * TRIAL_INDEX_DTYPE.itemsize)
+            return np.fromfile(file_path, dtype=TRIAL_INDEX_DTYPE) if n_records else np.zeros(0, TRIAL_INDEX_DTYPE)
+
+        def extent(index: np.ndarray) -> int:
+            return int(index["offset"][-1] + index["n_samples"][-1]) if len(index) else 0
+
+        trials = committed("trials.bin")
+        if self.trajectory_dtype is not None:
+            truncate("trajectory.bin", extent(trials) * self.trajectory_dtype.itemsize)
+            truncate("conditions.bin", len(trials) * self.conditions_dtype.itemsize)
+        for name, dtype in self.stream_dtypes.items():
+            truncate(f"{name}.bin", extent(committed(f"{name}_trials.bin")) * dtype.itemsize)
+
+    def write_trial(self, trial: int, conditions: Dict, trajectory: np.ndarray):
+        """Append one trial. The trajectory should be a structured array (see trajectory_array)."""
+        if self.mode != "a":
+            raise ValueError("trial store was opened read-only")
+        if self.trajectory_dtype is None:
+            self.trajectory_dtype = trajectory.dtype
+            self.conditions_dtype = conditions_dtype(conditions)
+            self._write_meta()
+        if trajectory.dtype.names != self.trajectory_dtype.names:
+            raise ValueError(f"trajectory columns {trajectory.dtype.names} do not match the store "
+                             f"columns {self.trajectory_dtype.names}")
+
+        con_record = np.zeros(1, dtype=self.conditions_dtype)
+        for name in self.conditions_dtype.names:
+            con_record[name] = conditions[name]
+        offset = self._append("trajectory.bin", trajectory.astype(self.trajectory_dtype, copy=False))
+        self._append("conditions.bin", con_record)
+        # the index record is written last: it commits the trial
+        self._append("trials.bin", np.array([(trial, offset, len(trajectory))], dtype=TRIAL_INDEX_DTYPE))
+
+    def _append(self, name: str, data: np.ndarray) -> int:
+        """append records to one of the tables and sync them to disk, returns the index of the first record"""
+        if name not in self._files:
+            self._files[name] = open(self._file(name), "ab")
+        f = self._files[name]
+        offset = f.tell() // data.dtype.itemsize
+        f.write(data.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        return offset
+
+    def write_stream(self, trial: int, name: str, stream: np.ndarray):
+        """Append an extra sample stream of a trial (structured array), e.g. the high-rate mouse samples"""
+        if self.mode != "a":
+            raise ValueError("trial store was opened read-only")
+        if name not in self.stream_dtypes:
+            if self.trajectory_dtype is None:
+                raise ValueError("write the trial before its streams")
+            self.stream_dtypes[name] = stream.dtype
+            self._write_meta()
+        offset = self._append(f"{name}.bin", stream.astype(self.stream_dtypes[name], copy=False))
+        self._append(f"{name}_trials.bin", np.array([(trial, offset, len(stream))], dtype=TRIAL_INDEX_DTYPE))
+
+    def write_timing(self, trial: int, summary: Dict):
+        """Append the frame timing summary of a trial to timing.csv in the store"""
+        append_csv_row(self._file("timing.csv"), {"trial": trial, **summary})
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    # ------------------------------------------------------------------
+    # reading
+    # ------------------------------------------------------------------
+
+    def _map(self, name: str, dtype: np.dtype, count: int = None) -> np.ndarray:
+        file_path = self._file(name)
+        n_records = os.path.getsize(file_path) // dtype.itemsize if os.path.exists(file_path) else 0
+        if count is not None:
+            n_records = min(n_records, count)
+        if n_records == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode="r", shape=(n_records,))
+
+    @property
+    def trials(self) -> np.ndarray:
+        """(trial, offset, n_samples) records of all committed trials"""
+        return self._map("trials.bin", TRIAL_INDEX_DTYPE)
+
+    @property
+    def conditions(self) -> np.ndarray:
+        """conditions records, one per trial (memory-mapped)"""
+        if self.conditions_dtype is None:
+            return np.zeros(0)
+        return self._map("conditions.bin", self.conditions_dtype, len(self))
+
+    @property
+    def trajectory(self) -> np.ndarray:
+        """trajectory records of all trials, concatenated (memory-mapped)"""
+        if self.trajectory_dtype is None:
+            return np.zeros(0, dtype=TRAJECTORY_DTYPE)
+        trials = self.trials
+        n_samples = int(trials["offset"][-1] + trials["n_samples"][-1]) if len(trials) else 0
+        return self._map("trajectory.bin", self.trajectory_dtype, n_samples)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """start of every trial in the trajectory table, with the total number of samples appended"""
+        trials = self.trials
+        return np.append(trials["offset"], trials["offset"][-1] + trials["n_samples"][-1]) \
+            if len(trials) else np.zeros(1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        file_path = self._file("trials.bin")
+        return os.path.getsize(file_path) // TRIAL_INDEX_DTYPE.itemsize if os.path.exists(file_path) else 0
+
+    def trial(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """conditions record and trajectory view of the i-th trial in the store"""
+        index = self.trials[i]
+        start = int(index["offset"])
+        return self.conditions[i], self.trajectory[start:start + int(index["n_samples"])]
+
+    def stream(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(trial, offset, n_samples) index and samples (memory-mapped) of an extra stream"""
+        index = self._map(f"{name}_trials.bin", TRIAL_INDEX_DTYPE)
+        n_samples = int(index["offset"][-1] + index["n_samples"][-1]) if len(index) else 0
+        return index, self._map(f"{name}.bin", self.stream_dtypes[name], n_samples)
+
+    def stream_frame(self, name: str):
+        """samples of an extra stream as a pandas DataFrame with a 'trial' column"""
+        import pandas as pd
+        index, samples = self.stream(name)
+        frame = pd.DataFrame(np.asarray(samples))
+        frame.insert(0, "trial", np.repeat(np.asarray(index["trial"]), index["n_samples"]))
+        return frame
+
+    def conditions_frame(self):
+        """conditions as a pandas DataFrame with a 'trial' column"""
+        import pandas as pd
+        frame = pd.DataFrame(np.asarray(self.conditions))
+        frame.insert(0, "trial", np.asarray(self.trials["trial"]))
+        return frame
+
+    def trajectory_frame(self):
+        """trajectory samples of all trials as a pandas DataFrame with a 'trial' column"""
+        import pandas as pd
+        trials = self.trials
+        frame = pd.DataFrame(np.asarray(self.trajectory))
+        frame.insert(0, "trial", np.repeat(np.asarray(trials["trial"]), trials["n_samples"]))
+        return frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert_csv_directory(participant_dir: str, store_path: str = None) -> TrialStore:
+    """
+    Convert the per trial CSV files of a participant directory into a trial store.
+
+    Trials that are already in the store are skipped, so the conversion can be
+    re-run when new trials have been recorded.
+
+    Args:
+        participant_dir: directory with the participant_*_trial_*_trajectory.csv files
+        store_path: location of the store, defaults to participant_<id>_store inside participant_dir
+
+    Returns:
+        TrialStore: the store opened for reading
+    """
+    files = find_trial_files(participant_dir)
+    if not files:
+        raise FileNotFoundError(f"no trial files found in {participant_dir}")
+    participantID = TRIAL_FILE_PATTERN.match(os.path.basename(files[0][1])).group("participant")
+    if store_path is None:
+        store_path = os.path.join(participant_dir, f"participant_{participantID}_store")
+
+    with TrialStore(store_path, mode="a", participantID=participantID) as store:
+        done = set(store.trials["trial"].tolist())
+        for trial, file_path in files:
+            if trial in done:
+                continue
+            conditions, trajectory = read_trial_csv(file_path)
+            store.write_trial(trial, conditions, trajectory)
+
+    return TrialStore(store_path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert per trial CSV files into a binary trial store")
+    parser.add_argument("participant_dirs", nargs="+", help="data/<participant> directories to convert")
+    args = parser.parse_args()
+    for participant_dir in args.participant_dirs:
+        store = convert_csv_directory(participant_dir)
+        print(f"{participant_dir}: {len(store)} trials in {store.path}")
@@ -14,9 +14,10 @@ from typing import Tuple
 
 import pandas as pd
 import os
-import itertools
 from psychopy import prefs
-from Experiment_helpers.experiment import Experiment, CloudExperiment, repeat_and_shuffle
+from Experiment_helpers.experiment import Experiment, CloudExperiment, condition_table, repeat_and_shuffle
+from Experiment_helpers.design import DESIGN_COLUMNS, DESIGN_LEVELS
+from Experiment_helpers.trial_plan import TrialPlan
 
 # to avoid bug on windows (https://www.psychopy.org/troubleshooting.html#errors-with-getting-setting-the-gamma-ramp)
 prefs.general["gammaErrorPolicy"] = "warn"
@@ -36,6 +37,8 @@ dlg.addField('Screen', label ='Screen to use (int) (*)',initial = 0, required =
 dlg.addText('Screen should be 0 if you only have one monitor (e.g. you laptop screen).\n'+\
             'If attaching an extra screen you might want to make this 0 or 1 to decide which monitor to show the stimulus on.\n'+\
             'Note that we did not yet fully test this option so this may lead to unexpected behaviour depending on your specific system.')
+dlg.addField('Resume', label ='Resume the previous session of this participant', initial = False)
+dlg.addText('Continues with the trial after the last saved one, with the same trial order.')
 ok_data = dlg.show()
 if dlg.OK:
   if ok_data['Participant ID'] == '':
@@ -43,6 +46,7 @@ if dlg.OK:
     quit()
   participantID = ok_data['Participant ID']
   screenID = ok_data['Screen']
+  resume = ok_data['Resume']
 else:
   quit()
 
@@ -56,37 +60,44 @@ os.makedirs(participant_folder, exist_ok=True)
 # Create Conditions list
 #-------------------------------------
 Experiment_Type = 'targetCloud'
-start_pos_X = [0]
-start_pos_Y = [-240]
-start_radius = [10]
-target_X_List = [0] # initial dir should be set at random (not an actual thing that distinguishes trials)
-target_Y_List = [240] # initial dir should be set at random (not an actual thing that distinguishes trials)
-target_SDS = [(10,10)]
-cursor_SDS = [(50,200),(100,100),(200,50)]
-nDotsTarget = [1]
-nDotsCursor = [200]
-cursor_shift = [-240,0,240]
-shift_threshold = [-240]
+# the factors and their levels are in Experiment_helpers/design.py (shared with simulate.py)
 ## Lifespan:
 myLifeSpan = 5 # frames
 lSpan = [myLifeSpan] # this should be 5 frames at 60Hz or the equivalent of that at higher frame rates
-
-dfColumns = ['start_X','start_Y','startradius','target_X','target_Y','target_SX','target_SY','nDotsTarget',
-             'cursor_SX','cursor_SY','nDotsCursor','cursor_shift','shift_threshold']
-
-expConds = list(itertools.product(*[start_pos_X,start_pos_Y,start_radius,target_X_List,target_Y_List,
-                                                 target_SDS,nDotsTarget,cursor_SDS,nDotsCursor,cursor_shift,shift_threshold]))
-# flatten the rows removing the tuples
-for row in range(0,len(expConds)):
-    expConds[row] = list(itertools.chain(*(i if isinstance(i, tuple) else (i,) for i in expConds[row])))
-# convert to pandas dataframe
-expCondsDF = pd.DataFrame(expConds, columns = dfColumns).reset_index()
+## Frame timing:
+instrument = False # True: record frame timing, timing summary per trial and flip times per sample
+## Mouse sampling:
+mouseRate = 0 # 0: read the mouse once per frame, > 0: read all samples of the device (iohub) and store them
+## Live monitor:
+monitor = False # True: publish every trial for a live monitor (python -m Experiment_helpers.live_monitor <alias> in a second terminal)
+## Data format:
+dataFormat = 'csv' # 'csv': one file per trial, 'store': one binary trial store per participant
+
+# all combinations of the levels as pandas dataframe
+expCondsDF = condition_table(DESIGN_COLUMNS, DESIGN_LEVELS)
 # add repetitions and shuffle the order of the trials
 expCondsDF = repeat_and_shuffle(expCondsDF, 5, shuffle = True)
 
+#-------------------------------------
+# Compile the trial list (or load it to resume a session)
+#-------------------------------------
+sessionPath = participant_folder + "/participant_" + participantID + "_session.npz"
+if resume and os.path.exists(sessionPath):
+    trialPlan, startTrial, startScore = TrialPlan.load(sessionPath)
+    if startTrial >= len(trialPlan):
+        print('The session of this participant is already complete.')
+        quit()
+    print('Resuming at trial ' + str(startTrial) + ' of ' + str(len(trialPlan)))
+else:
+    if resume:
+        print('No session to resume was found, starting a new session.')
+    trialPlan, startTrial, startScore = TrialPlan.from_frame(expCondsDF), 0, 0
+
 
 def main(windowed: bool, resolution: Tuple[int, int], screen: int, debug: bool,
-         participant: str, participant_folder: str):
+         participant: str, participant_folder: str, dataFormat: str = 'csv', instrument: bool = False,
+         mouseRate: float = 0, trialPlan: TrialPlan = None, startTrial: int = 0, startScore: int = 0,
+         monitor: bool = False):
     """
     Starts the experiment
     """
@@ -94,10 +105,16 @@ def main(windowed: bool, resolution: Tuple[int, int], screen: int, debug: bool,
         windowed=windowed,
         resolution=resolution,
         screen=screen,
-        trialList = expCondsDF,
+        trialList = trialPlan,
         participantID = participant,
         dataDir = participant_folder,
         debug = debug,
+        dataFormat = dataFormat,
+        instrument = instrument,
+        mouseRate = mouseRate,
+        startTrial = startTrial,
+        startScore = startScore,
+        monitor = monitor,
     )
     experiment.run()
 
@@ -107,5 +124,12 @@ main(
     screen = screenID,
     debug = False,
     participant = participantID,
-    participant_folder = participant_folder)
+    participant_folder = participant_folder,
+    dataFormat = dataFormat,
+    instrument = instrument,
+    mouseRate = mouseRate,
+    trialPlan = trialPlan,
+    startTrial = startTrial,
+    startScore = startScore,
+    monitor = monitor)
 
@@ -0,0 +1,94 @@
+"""
+Run the experiment headless with a synthetic participant (see Experiment_helpers/headless.py).
+
+No window or psychopy is needed and frames run as fast as the CPU allows. The data is written
+exactly like in a real session, e.g. to test the analysis or the storage with large datasets.
+Example, from the 02_Experiment_Code directory:
+
+python simulate.py sim01 --reps 20 --seed 1
+
+For more options type
+
+python simulate.py --help
+"""
+
+import argparse
+import os
+import time
+
+# must be set before the experiment is imported
+os.environ["HANDELN_BACKEND"] = "headless"
+
+from Experiment_helpers import headless
+from Experiment_helpers.design import DESIGN_COLUMNS, DESIGN_LEVELS
+from Experiment_helpers.experiment import CloudExperiment, condition_table, repeat_and_shuffle
+from Experiment_helpers.trial_plan import TrialPlan
+
+
+def simulate(participant: str, dataDir: str, reps: int = 5, seed: int = None, framerate: float = 60,
+             dataFormat: str = "csv", instrument: bool = False, session: str = None, endpointSD: float = 5.0,
+             monitor: bool = False):
+    """
+    Run one simulated session, returns the experiment after its last trial
+    """
+    if session is not None:
+        plan, startTrial, startScore = TrialPlan.load(session)
+    else:
+        trialList = repeat_and_shuffle(condition_table(DESIGN_COLUMNS, DESIGN_LEVELS), reps, shuffle = True)
+        plan, startTrial, startScore = TrialPlan.from_frame(trialList), 0, 0
+    os.makedirs(dataDir, exist_ok = True)
+
+    headless.configure(framerate = framerate,
+                       participant = headless.SyntheticParticipant(plan, startTrial, seed = seed, endpointSD = endpointSD))
+    experiment = CloudExperiment(
+        windowed = True,
+        resolution = [1440,900],
+        screen = 0,
+        trialList = plan,
+        participantID = participant,
+        dataDir = dataDir,
+        dataFormat = dataFormat,
+        seed = seed,
+        instrument = instrument,
+        startTrial = startTrial,
+        startScore = startScore,
+        monitor = monitor,
+    )
+    try:
+        experiment.run()
+    except SystemExit:
+        # the experiment quits after the last trial
+        pass
+    return experiment
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run the experiment headless with a synthetic participant")
+    parser.add_argument("participant", help = "participant alias, the data is written to data/<alias>")
+    parser.add_argument("--data-dir", default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help = "folder with the participant folders")
+    parser.add_argument("--reps", type = int, default = 5, help = "repetitions of every condition")
+    parser.add_argument("--seed", type = int, default = None, help = "seed of the trial order, the dot clouds and the participant")
+    parser.add_argument("--framerate", type = float, default = 60, help = "frame rate of the simulated display")
+    parser.add_argument("--data-format", choices = ["csv", "store"], default = "csv")
+    parser.add_argument("--instrument", action = "store_true", help = "record frame timing (wall clock durations)")
+    parser.add_argument("--session", default = None, help = "session file (.npz) to replay or resume")
+    parser.add_argument("--monitor", action = "store_true",
+                        help = "publish the trials for python -m Experiment_helpers.live_monitor <alias>")
+    parser.add_argument("--endpoint-sd", type = float, default = 5.0, help = "endpoint scatter of the participant in pixels")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        # also makes the shuffled trial order reproducible
+        import numpy as np
+        np.random.seed(args.seed)
+
+    start = time.perf_counter()
+    experiment = simulate(args.participant, os.path.join(args.data_dir, args.participant), reps = args.reps,
+                          seed = args.seed, framerate = args.framerate, dataFormat = args.data_format,
+                          instrument = args.instrument, session = args.session, endpointSD = args.endpoint_sd,
+                          monitor = args.monitor)
+    duration = time.perf_counter() - start
+    frames = experiment.window.frameCount
+    print(f"{experiment.trial} trials, {frames} frames in {duration:.2f} s ({frames/duration:.0f} frames/s), "
+          f"total score {experiment.totalScore}")
@@ -0,0 +1,82 @@
+"""
+Synthetic datasets for the benchmarks
+
+Trajectories look like the data of the experiment (same columns, 60 Hz samples, minimum jerk
+reaches with a correction for the cursor shift), but are generated directly with numpy so
+that large datasets take seconds instead of a simulated session per participant.
+"""
+
+from typing import Dict, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+class Scale(NamedTuple):
+    participants: int
+    trials: int   # per participant
+    samples: int  # mean number of samples per trial (the actual number varies by +-25%)
+
+
+SCALES: Dict[str, Scale] = {
+    "small": Scale(participants=1, trials=45, samples=60),
+    "medium": Scale(participants=10, trials=180, samples=90),
+    "large": Scale(participants=30, trials=450, samples=120),
+}
+
+# the design of the experiment (see 02_Experiment_Code/main.py)
+CURSOR_SDS = [(50, 200), (100, 100), (200, 50)]
+CURSOR_SHIFTS = [-240, 0, 240]
+
+
+def _minimum_jerk(u):
+    u = np.clip(u, 0, 1)
+    return u**3*(10 - 15*u + 6*u**2)
+
+
+def trajectories(scale: Scale, seed: int = 0, framerate: float = 60) -> pd.DataFrame:
+    """
+    One frame with the samples of all trials of all participants, with the columns of the
+    trial files plus participant and trial (like handeln_analysis.loader.load_participants)
+    """
+    rng = np.random.default_rng(seed)
+    n_trials = scale.participants*scale.trials
+    lengths = rng.integers(int(0.75*scale.samples), int(1.25*scale.samples) + 1, n_trials)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    n = offsets[-1]
+    trial_of_sample = np.repeat(np.arange(n_trials), lengths)
+    frame = np.arange(n) - offsets[trial_of_sample]
+
+    # conditions per trial
+    sds = np.array(CURSOR_SDS)[rng.integers(0, len(CURSOR_SDS), n_trials)]
+    shifts = np.array(CURSOR_SHIFTS)[rng.integers(0, len(CURSOR_SHIFTS), n_trials)]
+    endpoint = rng.normal(0, 5, [n_trials, 2]) + [0, 240]
+
+    # reach over the whole trial, correction starting after about a quarter of it
+    u = frame/(lengths[trial_of_sample] - 1)
+    y = -240 + (endpoint[trial_of_sample, 1] + 240)*_minimum_jerk(u)
+    x = endpoint[trial_of_sample, 0]*_minimum_jerk(u) + shifts[trial_of_sample]*(1 - _minimum_jerk((u - 0.25)/0.6))
+    # frame times with a little jitter, starting at 0 in every trial
+    time = frame/framerate + rng.normal(0, 1e-4, n)
+    time -= time[offsets[:-1]][trial_of_sample]
+
+    data = pd.DataFrame({
+        "participant": pd.Categorical(np.repeat([f"p{i:02d}" for i in range(scale.participants)],
+                                                np.add.reduceat(lengths, np.arange(0, n_trials, scale.trials)))),
+        "trial": (np.arange(n_trials) % scale.trials)[trial_of_sample],
+        "time": time,
+        "frame_nr": frame + 1,
+        "cursor_x": x + rng.normal(0, 0.5, n),
+        "cursor_y": y + rng.normal(0, 0.5, n),
+        "shift_applied": (shifts[trial_of_sample] != 0).astype(int),
+    })
+    conditions = {
+        "start_X": 0, "start_Y": -240, "startradius": 10, "target_X": 0, "target_Y": 240,
+        "target_SX": 10, "target_SY": 10, "nDotsTarget": 1,
+        "cursor_SX": sds[:, 0], "cursor_SY": sds[:, 1], "nDotsCursor": 200,
+        "cursor_shift": shifts, "shift_threshold": -240,
+        "trial_score": rng.integers(50, 101, n_trials),
+    }
+    for name, values in conditions.items():
+        data[name] = np.broadcast_to(values, n_trials)[trial_of_sample]
+    return data
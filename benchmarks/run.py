@@ -0,0 +1,162 @@
+"""
+Run the benchmarks and compare results across commits.
+
+Run from the repository root, e.g.
+
+python benchmarks/run.py                        # small and medium scales, all cloud sizes
+python benchmarks/run.py --scales small medium large
+python benchmarks/run.py --compare benchmarks/results/<baseline>.json
+
+Results are written to benchmarks/results/<date>_<commit>.json. With --compare every benchmark
+that is more than --threshold (relative) slower than in the baseline is reported as a regression
+and the exit code is 1. Two stored results can be compared without running with
+
+python benchmarks/run.py --compare <baseline>.json --against <new>.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import suite
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def git_commit():
+    """(commit hash, whether the working tree has changes), (None, None) outside a git repository"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=suite.ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=suite.ROOT,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def measure(benchmark, repeats=5, min_time=0.2):
+    """
+    Time a benchmark: the function is called often enough to run at least min_time per repeat,
+    the time per call is taken over repeats repeats. The memory peak is measured in a separate
+    call under tracemalloc (which slows the call down, so it is not timed).
+    """
+    timer = timeit.Timer(benchmark.function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000:
+            break
+        number = max(number + 1, int(number*1.5*min_time/max(elapsed, 1e-9)))
+    times = np.array([elapsed] + timer.repeat(repeats - 1, number))/number
+
+    tracemalloc.start()
+    benchmark.function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_s": float(np.median(times)),
+        "min_s": float(times.min()),
+        "per_item_us": float(1e6*np.median(times)/benchmark.items),
+        "items": benchmark.items,
+        "unit": benchmark.unit,
+        "peak_mb": peak/2**20,
+        "calls": number,
+        "repeats": repeats,
+    }
+
+
+def run(scales, cloud_sizes, repeats, select=None):
+    results = {}
+    # the groups are generators: a dataset is only built when its benchmarks are run
+    groups = [suite.analysis_benchmarks(scale) for scale in scales] + \
+             [suite.cloud_benchmarks(n_dots) for n_dots in cloud_sizes]
+    for group in groups:
+        for benchmark in group:
+            if select is not None and select not in benchmark.name:
+                continue
+            results[benchmark.name] = result = measure(benchmark, repeats)
+            print(f"{benchmark.name:<45} {1000*result['median_s']:>10.3f} ms "
+                  f"{result['per_item_us']:>10.1f} us/{result['unit']} {result['peak_mb']:>8.1f} MB")
+    return results
+
+
+def compare(baseline, new, threshold):
+    """print the change per benchmark, returns the names of the regressions"""
+    regressions = []
+    print(f"\n{'benchmark':<45} {'baseline':>12} {'new':>12} {'change':>8}")
+    for name in sorted(set(baseline["results"]) & set(new["results"])):
+        old_time = baseline["results"][name]["median_s"]
+        new_time = new["results"][name]["median_s"]
+        change = new_time/old_time - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<45} {1000*old_time:>10.3f}ms {1000*new_time:>10.3f}ms {100*change:>+7.1f}%{flag}")
+    print(f"\n{len(regressions)} regression(s) above {100*threshold:.0f}% "
+          f"(baseline {baseline.get('commit')}, new {new.get('commit')})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the analysis helpers and the dot cloud update")
+    parser.add_argument("--scales", nargs="+", default=["small", "medium"], choices=list(suite.datasets.SCALES))
+    parser.add_argument("--cloud-sizes", nargs="*", type=int, default=suite.CLOUD_SIZES)
+    parser.add_argument("--select", default=None, help="only run the benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="result file, defaults to benchmarks/results/<date>_<commit>.json")
+    parser.add_argument("--compare", default=None, help="baseline result file to compare with")
+    parser.add_argument("--against", default=None, help="compare the baseline with this result file instead of running")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slow down reported as a regression")
+    args = parser.parse_args()
+
+    if args.against is not None:
+        if args.compare is None:
+            parser.error("--against needs --compare")
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        with open(args.against) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(baseline, new, args.threshold) else 0)
+
+    commit, dirty = git_commit()
+    new = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "results": run(args.scales, args.cloud_sizes, args.repeats, args.select),
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        date = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{date}_{commit or 'nogit'}{'-dirty' if dirty else ''}.json")
+    with open(output, "w") as f:
+        json.dump(new, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(baseline, new, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
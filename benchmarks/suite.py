@@ -0,0 +1,121 @@
+"""
+Benchmark definitions
+
+Every benchmark is a function without arguments that does the measured work once, together
+with the number of items (trials or frames) it processes, such that results can be compared
+per item across scales.
+"""
+
+import contextlib
+import io
+import os
+import sys
+from typing import Callable, Iterator, NamedTuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "02_Experiment_Code"))
+# the dot clouds are updated without a window (see Experiment_helpers/headless.py)
+os.environ["HANDELN_BACKEND"] = "headless"
+
+from handeln_analysis import alignment, helpers
+from Experiment_helpers.dots_class import lltDotCloud, DotCloudGroup
+from Experiment_helpers.headless import Window
+
+import datasets
+
+
+class Benchmark(NamedTuple):
+    name: str          # group/case/function, e.g. analysis/medium/batch_velocity
+    function: Callable # does the measured work once
+    items: int         # number of trials or frames processed by one call
+    unit: str          # "trial" or "frame"
+
+
+# scales of the dot cloud benchmarks (dots per cloud) and frames per run (10 s at 60 Hz)
+CLOUD_SIZES = [10, 100, 200, 1000, 10000]
+CLOUD_FRAMES = 600
+
+
+def _quiet(function, *args, **kwargs):
+    # remove_outliers prints a report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def analysis_benchmarks(scale_name: str, max_loop_trials: int = 200) -> Iterator[Benchmark]:
+    """
+    The analysis helpers on a synthetic dataset of the given scale (see datasets.SCALES).
+
+    The per trial helpers (velocity, normalize_time) are run on (at most) max_loop_trials trials,
+    like the loops of the notebooks, the batch helpers on the whole dataset.
+    """
+    data = datasets.trajectories(datasets.SCALES[scale_name])
+    trial_keys = ["participant", "trial"]
+    offsets = helpers.trial_offsets(data, trial_keys)
+    n_trials = len(offsets) - 1
+    loop = [data.iloc[start:end].copy() for start, end in zip(offsets[:max_loop_trials], offsets[1:max_loop_trials+1])]
+    prefix = f"analysis/{scale_name}/"
+
+    yield Benchmark(prefix + "velocity",
+                    lambda: [helpers.velocity(trial, ["cursor_x", "cursor_y"], "time") for trial in loop],
+                    len(loop), "trial")
+    yield Benchmark(prefix + "batch_velocity",
+                    lambda: helpers.batch_velocity(data, offsets),
+                    n_trials, "trial")
+    yield Benchmark(prefix + "normalize_time",
+                    lambda: [helpers.normalize_time(trial[["time", "cursor_x", "cursor_y"]].copy()) for trial in loop],
+                    len(loop), "trial")
+    yield Benchmark(prefix + "normalize_trials",
+                    lambda: helpers.normalize_trials(data, trial_var=trial_keys, offsets=offsets),
+                    n_trials, "trial")
+    for mode in ("path", "progress"):
+        yield Benchmark(prefix + "normalize_trials_" + mode,
+                        lambda mode=mode: helpers.normalize_trials(data, trial_var=trial_keys, offsets=offsets, mode=mode),
+                        n_trials, "trial")
+    normalized = helpers.normalize_trials(data, trial_var=trial_keys, offsets=offsets)
+    yield Benchmark(prefix + "condition_means",
+                    lambda: helpers.condition_means(normalized),
+                    n_trials, "trial")
+    # a fixed number of iterations: DBA does not always converge before n_iter
+    yield Benchmark(prefix + "dba_condition_means",
+                    lambda: alignment.dba_condition_means(normalized, ["participant", "cursor_shift"], n_iter=3,
+                                                          workers=1),
+                    n_trials, "trial")
+    yield Benchmark(prefix + "remove_outliers",
+                    lambda: _quiet(helpers.remove_outliers, data, trial_keys),
+                    n_trials, "trial")
+    yield Benchmark(prefix + "outlier_mask",
+                    lambda: helpers.outlier_mask(data, trial_keys, by=["participant", "cursor_shift"], criterion="mad"),
+                    n_trials, "trial")
+
+
+def cloud_benchmarks(n_dots: int, frames: int = CLOUD_FRAMES) -> Iterator[Benchmark]:
+    """
+    The per frame update of the dot clouds: one trial (reset plus frames updates) of a single
+    cloud, drawing the respawns frame by frame or from a buffer drawn at reset, and of a
+    DotCloudGroup with a target and a cursor cloud of n_dots each.
+    """
+    prefix = f"clouds/{n_dots}/"
+    win = Window()
+
+    def trial(cloud, bufferFrames):
+        cloud.reset((0, 0), seed=1, bufferFrames=bufferFrames)
+        for _ in range(frames):
+            cloud.main_update()
+
+    cloud = lltDotCloud((0, 0), n_dots, (100, 100, 0), win)
+    yield Benchmark(prefix + "main_update", lambda: trial(cloud, 0), frames, "frame")
+    yield Benchmark(prefix + "main_update_buffered", lambda: trial(cloud, frames), frames, "frame")
+
+    target = lltDotCloud((0, 240), n_dots, (10, 10, 0), None)
+    cursor = lltDotCloud((0, -240), n_dots, (100, 100, 0), None, colors=(0, 0, 0))
+    group = DotCloudGroup([target, cursor], win)
+
+    def group_trial():
+        target.reset((0, 240), seed=1, bufferFrames=frames)
+        cursor.reset((0, -240), seed=2, bufferFrames=frames)
+        for _ in range(frames):
+            group.main_update()
+
+    yield Benchmark(prefix + "group_update", group_trial, frames, "frame")
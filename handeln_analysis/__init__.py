@@ -0,0 +1,33 @@
+# Analysis of the Handeln experiment
+
+"""
+Analysis of the data of the Handeln experiment.
+
+Modules (imported on first use, so importing the package itself is cheap):
+    helpers    velocity, normalization, condition means and outliers
+    files      finding the trial files of the participants (standard library only)
+    loader     loading the trial files into one frame
+    cache      on-disk cache for per trial results
+    catalog    SQLite catalog of the trials
+    streaming  condition statistics in bounded memory
+    features   kinematic features per trial
+    alignment  dynamic time warping and DTW barycenter means per condition
+    pipeline   the standard analysis of every participant with checkpoints
+
+The command line interface runs the pipeline, see python -m handeln_analysis --help.
+
+Example:
+    import handeln_analysis
+    data = handeln_analysis.loader.load_participants(os.path.join("02_Experiment_Code", "data"))
+"""
+
+import importlib
+
+__all__ = ["alignment", "cache", "catalog", "features", "files", "helpers", "loader", "pipeline", "streaming"]
+
+
+def __getattr__(name):
+    # lazy submodules: numpy and pandas are only imported by the modules that need them
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
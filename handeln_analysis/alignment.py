@@ -0,0 +1,291 @@
+# Dynamic time warping of the trajectories of the Handeln experiment
+
+"""
+Alignment of time normalized trajectories with dynamic time warping (DTW), and mean trajectories
+per condition that average aligned points (DTW barycenter averaging, DBA) instead of points at the
+same normalized time.
+
+condition_means averages the trials at equal normalized time, which smears features that occur at
+different times in different trials (e.g. early and late corrections for the cursor shift). DBA
+(Petitjean et al., 2011) repeatedly aligns every trial to the current mean with DTW and replaces
+every point of the mean by the average of the trial points aligned to it.
+
+The warping is restricted to a Sakoe-Chiba band: point i of a trial can only be aligned to points
+i - window to i + window of the mean, so an alignment costs O(n_points * window) instead of
+O(n_points^2). The accumulated costs are computed along the anti-diagonals of the cost matrix:
+the cells of one anti-diagonal only depend on the two previous ones, so every step is one array
+operation over all trials and all cells of the band (no loop over trials). The condition groups
+are spread over a process pool.
+
+Example:
+    from handeln_analysis import alignment, helpers
+
+    normalized = helpers.normalize_trials(data, ['cursor_x', 'cursor_y', 'vabs'], 101, ['participant', 'trial'])
+    warped = alignment.dba_condition_means(normalized, ['cursor_shift'], window=10,
+                                           align_on=['cursor_x', 'cursor_y'])
+    warped.to_frame()
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from . import helpers
+
+# number of trials aligned at once: bounds the memory of the step choices (anti-diagonals x trials x band)
+BATCH_TRIALS = 2048
+
+# below this number of trials dba_condition_means runs in the current process: starting a worker costs
+# about as much as aligning a hundred trials
+MIN_POOL_TRIALS = 256
+
+
+def _band_range(d: int, window: int, n_points: int) -> Tuple[int, int]:
+    # range of i on anti-diagonal d = i + j within the band |i - j| <= window and the grid
+    low = max(0, d - (n_points - 1), (d - window + 1) // 2)
+    high = min(n_points - 1, d, (d + window) // 2)
+    return low, high
+
+
+def dtw(series: np.ndarray, template: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    DTW of every trial against a template, within a Sakoe-Chiba band.
+
+    The local cost of aligning point i of a trial with point j of the template is their squared
+    Euclidean distance over the channels (series and template without missing values).
+
+    Args:
+        series: array (trials x points x channels)
+        template: array (points x channels), the same for all trials, or (trials x points x channels)
+        window: half width of the band in points
+
+    Returns:
+        distances: the accumulated cost along the best path of every trial
+        moves: array (2 * points - 1, 2 * window + 1, trials) with the best step into every cell of the
+            band (0: diagonal, 1: from (i - 1, j), 2: from (i, j - 1)); cell (i, j) is at [i + j, i - j + window]
+    """
+    n_trials, n_points, _ = series.shape
+    width = 2*window + 1
+    # trials last: the cells of an anti-diagonal are slices of contiguous rows
+    series = np.ascontiguousarray(series.transpose(1, 2, 0))
+    template = np.ascontiguousarray(template.transpose(1, 2, 0)) if template.ndim == 3 else template[:, :, None]
+    moves = np.zeros((2*n_points - 1, width, n_trials), dtype=np.int8)
+    # the accumulated costs of the last two anti-diagonals, with a border of inf on either side of the band
+    previous = np.full((width + 2, n_trials), np.inf)
+    before = np.full((width + 2, n_trials), np.inf)
+    for d in range(2*n_points - 1):
+        low, high = _band_range(d, window, n_points)
+        # i = low..high, j = d - i, band index k = 2i - d + window (every second one)
+        i = slice(low, high + 1)
+        j = slice(d - low, d - high - 1 if d - high > 0 else None, -1)
+        k = slice(2*low - d + window + 1, 2*high - d + window + 2, 2)
+        local = np.sum((series[i] - template[j])**2, axis=1)
+        current = np.full((width + 2, n_trials), np.inf)
+        if d == 0:
+            current[k] = local
+        else:
+            k_up = slice(k.start - 1, k.stop - 1, 2)
+            k_left = slice(k.start + 1, k.stop + 1, 2)
+            diagonal, up, left = before[k], previous[k_up], previous[k_left]
+            side = np.minimum(up, left)
+            # diagonal first: on ties the path takes the diagonal step
+            take_diagonal = diagonal <= side
+            current[k] = local + np.where(take_diagonal, diagonal, side)
+            moves[d, k.start - 1:k.stop - 1:2] = np.where(take_diagonal, 0, np.where(up <= left, 1, 2))
+        before, previous = previous, current
+    return previous[window + 1], moves
+
+
+def dtw_distances(series: np.ndarray, template: np.ndarray, window: int) -> np.ndarray:
+    """DTW distance (accumulated squared distance along the best path) of every trial to the template"""
+    return dtw(series, template, min(window, series.shape[1] - 1))[0]
+
+
+def warping_paths(moves: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The optimal warping path of every trial, traced back from the end.
+
+    Args:
+        moves: output of dtw
+        window: half width of the band used for moves
+
+    Returns:
+        trial, i, j: one entry per step of all paths, point i of the trial is aligned with point j
+        of the template
+    """
+    n_diagonals, _, n_trials = moves.shape
+    trials = np.arange(n_trials)
+    d = np.full(n_trials, n_diagonals - 1)
+    k = np.full(n_trials, window)
+    steps = []
+    while True:
+        steps.append((trials, (d + k - window) // 2, (d - k + window) // 2))
+        active = d > 0
+        if not active.any():
+            break
+        trials, d, k = trials[active], d[active], k[active]
+        move = moves[d, k, trials]
+        d = d - np.where(move == 0, 2, 1)
+        k = k + np.select([move == 1, move == 2], [-1, 1], 0)
+    return tuple(np.concatenate(parts) for parts in zip(*steps))
+
+
+def _aligned_sums(series: np.ndarray, codes: np.ndarray, means: np.ndarray, window: int, align_on: List[int],
+                  deviations: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # align every trial to the mean of its group and sum the trial points aligned to every point of the
+    # means (or their squared deviations from it), per group: count, sum (groups x points x channels)
+    # and the DTW distance of every trial
+    n_groups, n_points, n_channels = means.shape
+    count = np.zeros(n_groups*n_points*n_channels)
+    total = np.zeros(n_groups*n_points*n_channels)
+    distances = np.empty(len(series))
+    for start in range(0, len(series), BATCH_TRIALS):
+        batch = series[start:start + BATCH_TRIALS]
+        batch_codes = codes[start:start + BATCH_TRIALS]
+        distances[start:start + len(batch)], moves = dtw(batch[..., align_on], means[batch_codes][..., align_on],
+                                                         window)
+        trial, i, j = warping_paths(moves, window)
+        points = batch[trial, i]
+        finite = np.isfinite(points)
+        if deviations:
+            points = points - means[batch_codes[trial], j]
+        cell = ((batch_codes[trial]*n_points + j)[:, None]*n_channels + np.arange(n_channels)).ravel()
+        count += np.bincount(cell, finite.ravel(), len(count))
+        total += np.bincount(cell, np.where(finite, points**2 if deviations else points, 0).ravel(), len(total))
+    return count.reshape(means.shape), total.reshape(means.shape), distances
+
+
+class WarpedMeans(NamedTuple):
+    """DBA means of groups of trials (see dba).
+
+    mean, sd: arrays (groups x points x channels), the mean and the standard deviation of the trial
+        points aligned to every point of the mean
+    distances: DTW distance of every trial to the mean of its group
+    iterations: number of iterations of every group until convergence (or n_iter)
+    """
+    mean: np.ndarray
+    sd: np.ndarray
+    distances: np.ndarray
+    iterations: np.ndarray
+
+
+def dba(series: np.ndarray, codes: np.ndarray = None, window: int = 10, n_iter: int = 10,
+        align_on: List[int] = None, tol: float = 1e-6, ddof: int = 1) -> WarpedMeans:
+    """
+    DTW barycenter average of one or more groups of trials, starting from their mean at equal
+    normalized time. All trials (of all groups) are aligned at once.
+
+    Args:
+        series: array (trials x points x channels), trials with missing values in the align_on channels
+            should be left out
+        codes (optional): group number (0 to number of groups - 1) of every trial, defaults to one group
+        window: half width of the Sakoe-Chiba band in points
+        n_iter: maximum number of iterations
+        align_on (optional): indices of the channels that define the alignment (e.g. only the
+            positions), defaults to all. All channels are averaged along the same paths.
+        tol: a group stops when no point of its mean changes more than this
+        ddof: delta degrees of freedom for the standard deviation
+
+    Returns:
+        WarpedMeans
+    """
+    n_trials, n_points, n_channels = series.shape
+    codes = np.zeros(n_trials, dtype=np.int64) if codes is None else np.asarray(codes)
+    window = min(window, n_points - 1)
+    align_on = list(range(n_channels)) if align_on is None else list(align_on)
+    n_trials, _, mean = helpers.grouped_moments(series, codes)[1:4]
+    n_groups = len(n_trials)
+
+    iterations = np.zeros(n_groups, dtype=np.int64)
+    active = np.ones(n_groups, dtype=bool)
+    for iteration in range(1, n_iter + 1):
+        selected = active[codes]
+        count, total, _ = _aligned_sums(series[selected], codes[selected], mean, window, align_on)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_mean = np.where(active[:, None, None], total / count, mean)
+            change = np.nanmax(np.where(np.isnan(new_mean), 0, np.abs(new_mean - mean)), axis=(1, 2))
+        mean = new_mean
+        iterations[active] = iteration
+        active &= change > tol
+        if not active.any():
+            break
+
+    # spread of the aligned points around the final means
+    count, m2, distances = _aligned_sums(series, codes, mean, window, align_on, deviations=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.sqrt(m2 / (count - ddof))
+    return WarpedMeans(mean, sd, distances, iterations)
+
+
+def _dba_chunk(series: np.ndarray, codes: np.ndarray, params: dict) -> WarpedMeans:
+    return dba(series, codes, **params)
+
+
+def dba_condition_means(normalized: helpers.NormalizedTrajectories,
+                        by: List[str] = ['cursor_SX', 'cursor_SY', 'cursor_shift'], window: int = 10,
+                        n_iter: int = 10, align_on: List[str] = None, workers: int = None,
+                        ddof: int = 1) -> Tuple[helpers.ConditionMeans, np.ndarray]:
+    """
+    DBA mean trajectories per condition, like condition_means but averaging aligned points.
+
+    Trials with missing values in the align_on channels are left out. The conditions are spread over
+    a process pool (whole conditions per worker), within a worker all trials are aligned at once.
+
+    Args:
+        normalized (NormalizedTrajectories): output of normalize_trials
+        by: condition columns defining the groups
+        window: half width of the Sakoe-Chiba band in points of the normalized time grid
+        n_iter: maximum number of DBA iterations per condition
+        align_on (optional): channels that define the alignment, e.g. ['cursor_x', 'cursor_y'],
+            defaults to all channels
+        workers: number of worker processes, defaults to the number of CPUs (1 runs in this process)
+        ddof: delta degrees of freedom for the standard deviation
+
+    Returns:
+        ConditionMeans with the DBA means (mean), the spread of the aligned points (sd, sem) and the
+        number of trials (n), and the DTW distance of every trial to the mean of its condition (NaN for
+        the trials that were left out)
+    """
+    by = list(by)
+    align_on = list(normalized.channels) if align_on is None else list(align_on)
+    align_idx = [normalized.channels.index(channel) for channel in align_on]
+    usable = np.nonzero(~np.isnan(normalized.values[..., align_idx]).any(axis=(1, 2)))[0]
+    keys = normalized.keys.iloc[usable].reset_index(drop=True)
+    codes = keys.groupby(by, sort=True, observed=True, dropna=False).ngroup().to_numpy()
+    first, n_trials = helpers.grouped_moments(np.zeros(len(codes)), codes)[:2]
+    n_groups = len(n_trials)
+
+    # whole conditions per worker, about the same number of trials each
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(min(workers, n_groups), 1)
+    if len(codes) < MIN_POOL_TRIALS:
+        workers = 1
+    bounds = np.searchsorted(np.cumsum(n_trials), np.linspace(0, len(codes), workers + 1)[1:-1])
+    chunks = [np.arange(start, stop) for start, stop in zip(np.r_[0, bounds + 1], np.r_[bounds + 1, n_groups])]
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    members = [np.nonzero(np.isin(codes, chunk))[0] for chunk in chunks]
+    inputs = [(normalized.values[usable[index]], np.searchsorted(chunk, codes[index]))
+              for chunk, index in zip(chunks, members)]
+    params = {"window": window, "n_iter": n_iter, "align_on": align_idx, "ddof": ddof}
+    if len(inputs) <= 1:
+        results = [_dba_chunk(series, chunk_codes, params) for series, chunk_codes in inputs]
+    else:
+        with ProcessPoolExecutor(max_workers=len(inputs)) as pool:
+            results = list(pool.map(_dba_chunk, *zip(*inputs), [params]*len(inputs)))
+
+    shape = (n_groups,) + normalized.values.shape[1:]
+    mean, sd = np.full(shape, np.nan), np.full(shape, np.nan)
+    distances = np.full(len(normalized.values), np.nan)
+    for chunk, index, result in zip(chunks, members, results):
+        mean[chunk], sd[chunk] = result.mean, result.sd
+        distances[usable[index]] = result.distances
+    n = np.broadcast_to(n_trials[:, None, None], shape).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sem = sd / np.sqrt(n)
+
+    groups = keys[by].iloc[first].reset_index(drop=True)
+    groups['n_trials'] = n_trials
+    return helpers.ConditionMeans(groups, mean, sd, sem, n, normalized.normtime, normalized.channels), distances
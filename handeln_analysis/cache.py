@@ -0,0 +1,322 @@
+# On-disk cache for results derived from single trial files of the Handeln experiment
+
+"""
+Content addressed cache for per trial results (kinematics, normalized trajectories,
+movement time and score).
+
+A result is stored under a key made of the SHA-256 of the trial file's content, the name,
+version and parameters of the artifact that produced it. Changed files (or parameters,
+or a new version of an artifact) get a new key, so rerunning an analysis on a growing
+study only computes the new and changed trials. An entry whose columns are not the ones the
+artifact produces for the trial (e.g. written by an older version of the code) is computed
+again. Results across trials (e.g. the outlier flags) are cheap to recompute from the cached
+per trial results (see trial_summaries).
+
+Entries are written to a temporary file and renamed into place, so several processes
+(e.g. the workers of cached_artifacts, or two notebooks) can share a cache directory.
+
+Example:
+    from handeln_analysis import cache, loader
+
+    trial_cache = cache.TrialCache(os.path.join("02_Experiment_Code", "data", ".cache"), max_bytes=2**30)
+    files = loader.find_trial_files(os.path.join("02_Experiment_Code", "data"))
+    kinematics = cache.cached_frame(files, "kinematics", trial_cache, acceleration=True)
+    summaries = cache.trial_summaries(files, trial_cache)
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+import zipfile
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import helpers, loader
+
+# layout of the cache entries, part of every key
+CACHE_VERSION = 1
+
+# temporary files older than this (in s) are left over from a crashed writer
+STALE_TEMP_AGE = 3600
+
+
+def file_hash(content: bytes) -> str:
+    """SHA-256 (hex) of the content of a trial file"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class TrialCache:
+    def __init__(self, cache_dir: str, max_bytes: int = None, max_age: float = None):
+        """
+        Cache directory with one .npz file per entry (columns of equal length, no pickles).
+
+        Args:
+            cache_dir: directory of the cache, created if necessary
+            max_bytes (optional): evict the least recently used entries when the cache is larger
+            max_age (optional): evict entries that were not used for this many seconds
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, content_hash: str, artifact: str, version: int, params: Dict) -> str:
+        description = json.dumps([CACHE_VERSION, content_hash, artifact, version, params], sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        # two levels keep the directories small
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def get(self, key: str) -> Dict[str, np.ndarray]:
+        """the cached columns, None if the entry does not exist (or cannot be read)"""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                columns = {name: entry[name] for name in entry.files}
+            # the modification time marks the last use (for the eviction)
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            # missing, evicted by another process in the mean time, or unreadable: compute again
+            return None
+        return columns
+
+    def put(self, key: str, columns: Dict[str, np.ndarray]):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **columns)
+            # atomic: readers see the old entry, no entry, or the complete new one
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """(path, size in bytes, time of last use) of all entries"""
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if file_name.endswith(".tmp"):
+                    if time.time() - stat.st_mtime > STALE_TEMP_AGE:
+                        _remove(path)
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes: int = None, max_age: float = None) -> int:
+        """
+        Remove the entries not used for max_age seconds, then the least recently used entries
+        until the cache is at most max_bytes large. Defaults to the limits of the cache.
+
+        Returns:
+            number of removed entries
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        now = time.time()
+        removed = 0
+        total = sum(size for _, size, _ in entries)
+        for path, size, last_use in entries:
+            too_old = max_age is not None and now - last_use > max_age
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                # sorted by last use: the newer entries are not too old either, and the rest fits
+                break
+            _remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+
+def _remove(path: str):
+    # another process may have removed it already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# -----------------------------------------------
+# Artifacts: results derived from one trial
+# -----------------------------------------------
+
+def _kinematics(conditions: Dict, trajectory: pd.DataFrame, timestamps: bool = False,
+                acceleration: bool = False) -> Dict[str, np.ndarray]:
+    # one row per sample, like add_kinematics
+    values = helpers.batch_velocity(trajectory, [0, len(trajectory)], timestamps=timestamps,
+                                    acceleration=acceleration)
+    return {col: values[:, i] for i, col in enumerate(_kinematics_columns(conditions, timestamps, acceleration))}
+
+
+def _normalized(conditions: Dict, trajectory: pd.DataFrame, channels: List[str] = ['cursor_x', 'cursor_y'],
+                n_points: int = 101, time_var: str = 'time', mode: str = 'time') -> Dict[str, np.ndarray]:
+    # one row per point of the normalized time grid, like NormalizedTrajectories.to_frame
+    if mode != 'time':
+        # the spatial modes need the conditions of the hand position, start point and target
+        trajectory = trajectory.assign(**{name: conditions[name] for name in
+                                          ('cursor_shift', 'start_X', 'start_Y', 'target_X', 'target_Y')
+                                          if name in conditions})
+    normalized = helpers.normalize_trials(trajectory, list(channels), n_points, time_var=time_var,
+                                          key_columns=[], offsets=[0, len(trajectory)], mode=mode)
+    columns = {'normtime': normalized.normtime}
+    for i, channel in enumerate(normalized.channels):
+        columns[channel] = normalized.values[0, :, i]
+    return columns
+
+
+def _kinematics_columns(conditions: Dict, timestamps: bool = False, acceleration: bool = False) -> List[str]:
+    return ['vx', 'vy', 'vabs'] + (['ax', 'ay', 'aabs'] if acceleration else [])
+
+
+def _normalized_columns(conditions: Dict, channels: List[str] = ['cursor_x', 'cursor_y'], n_points: int = 101,
+                        time_var: str = 'time', mode: str = 'time') -> List[str]:
+    return ['normtime'] + list(channels)
+
+
+def _summary_conditions(conditions: Dict) -> List[str]:
+    return [name for name, value in conditions.items()
+            if isinstance(value, (int, float)) and name not in ('participant', 'trial')]
+
+
+def _summary_columns(conditions: Dict, time_var: str = 'time') -> List[str]:
+    return _summary_conditions(conditions) + ['n_samples', 'movement_time']
+
+
+def _summary(conditions: Dict, trajectory: pd.DataFrame, time_var: str = 'time') -> Dict[str, np.ndarray]:
+    # one row per trial: the (numeric) conditions including trial_score, number of samples and movement time
+    time = trajectory[time_var].to_numpy()
+    columns = {name: np.array([conditions[name]]) for name in _summary_conditions(conditions)}
+    columns['n_samples'] = np.array([len(trajectory)])
+    columns['movement_time'] = np.array([time.max() if len(time) else np.nan])
+    return columns
+
+
+class Artifact(NamedTuple):
+    compute: Callable  # (conditions, trajectory, **params) -> dict of equally long columns
+    version: int       # increase when the results of compute change
+    columns: Callable  # (conditions, **params) -> names of the columns of compute, to validate cached entries
+
+
+ARTIFACTS: Dict[str, Artifact] = {
+    "kinematics": Artifact(_kinematics, 1, _kinematics_columns),
+    "normalized": Artifact(_normalized, 1, _normalized_columns),
+    "summary": Artifact(_summary, 1, _summary_columns),
+}
+
+
+def _conditions(content: bytes) -> Dict:
+    # the conditions of a trial file (its first two lines) without parsing the trajectory
+    con_header, con_values = (content.decode().split("\n", 2) + ["", ""])[:2]
+    return {name: loader.parse_value(value) for name, value in
+            zip(con_header.strip().split(","), con_values.strip().split(","))}
+
+
+def _valid(columns: Dict[str, np.ndarray], expected: List[str]) -> bool:
+    # the cached columns are the ones the artifact produces, all of the same length
+    return set(columns) == set(expected) and len({len(values) for values in columns.values()}) <= 1
+
+
+def _process_chunk(file_paths: List[str], cache_dir: str, artifact: str, params: Dict) -> List[Tuple[Dict, bool]]:
+    # runs in the worker processes: every worker reads and writes the cache itself
+    trial_cache = TrialCache(cache_dir)
+    compute, version, expected_columns = ARTIFACTS[artifact]
+    results = []
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            content = f.read()
+        key = trial_cache.key(file_hash(content), artifact, version, params)
+        columns = trial_cache.get(key)
+        # a mismatched entry counts as a miss and is replaced
+        hit = columns is not None and _valid(columns, expected_columns(_conditions(content), **params))
+        if not hit:
+            conditions, names, values = loader.parse_trial_text(content.decode())
+            columns = compute(conditions, loader.trajectory_frame(names, values), **params)
+            trial_cache.put(key, columns)
+        results.append((columns, hit))
+    return results
+
+
+def cached_artifacts(files: List[Tuple[str, int, str]], artifact: str, trial_cache: TrialCache,
+                     workers: int = None, verbose: bool = False, **params) -> List[Dict[str, np.ndarray]]:
+    """
+    An artifact for every trial file, computed only for the files (or parameters) not in the cache.
+
+    Args:
+        files: list of (participant, trial number, file path), see loader.find_trial_files
+        artifact: name of the artifact, one of ARTIFACTS ("kinematics", "normalized" or "summary")
+        trial_cache: the cache
+        workers: number of worker processes, defaults to the number of CPUs. Small sets of files are
+            handled in the current process.
+        verbose: print how many trials came from the cache
+        **params: parameters of the artifact (e.g. acceleration=True for "kinematics",
+            channels and n_points for "normalized")
+
+    Returns:
+        list with the columns of the artifact per file
+    """
+    if artifact not in ARTIFACTS:
+        raise ValueError(f"unknown artifact {artifact!r}, use one of {sorted(ARTIFACTS)}")
+    # complete the parameters with the defaults, such that they are part of the key either way
+    bound = inspect.signature(ARTIFACTS[artifact].compute).bind(None, None, **params)
+    bound.apply_defaults()
+    params = dict(list(bound.arguments.items())[2:])
+    processed = loader.map_chunks(_process_chunk, [file_path for _, _, file_path in files], workers,
+                                  trial_cache.cache_dir, artifact, params)
+    results = [columns for columns, _ in processed]
+    if verbose:
+        misses = sum(not hit for _, hit in processed)
+        print(f"{artifact}: {len(files) - misses} of {len(files)} trials from the cache")
+
+    if trial_cache.max_bytes is not None or trial_cache.max_age is not None:
+        trial_cache.evict()
+    return results
+
+
+def cached_frame(files: List[Tuple[str, int, str]], artifact: str, trial_cache: TrialCache,
+                 workers: int = None, verbose: bool = False, **params) -> pd.DataFrame:
+    """
+    cached_artifacts as one frame with 'participant' and 'trial' columns (in the order of files),
+    e.g. the kinematics per sample, aligned with the output of loader.load_trials.
+    """
+    results = cached_artifacts(files, artifact, trial_cache, workers, verbose, **params)
+    lengths = np.array([len(next(iter(columns.values()))) if columns else 0 for columns in results], dtype=np.int64)
+    keys = {"participant": pd.Categorical([participant for participant, _, _ in files]).take(
+                np.repeat(np.arange(len(files)), lengths)),
+            "trial": np.repeat(np.array([trial for _, trial, _ in files], dtype=np.int64), lengths)}
+    # aligned by name: trials without a column (e.g. a condition that only some trial files have) get NaN
+    names = list(dict.fromkeys(name for columns in results for name in columns))
+    data = {name: np.concatenate([columns[name] if name in columns else np.full(length, np.nan)
+                                  for columns, length in zip(results, lengths)]) if results else np.zeros(0)
+            for name in names}
+    return pd.DataFrame({**keys, **data})
+
+
+def trial_summaries(files: List[Tuple[str, int, str]], trial_cache: TrialCache, workers: int = None,
+                    time_var: str = 'time', verbose: bool = False) -> pd.DataFrame:
+    """
+    Conditions (including trial_score), number of samples and movement time of every trial
+    (one row per trial).
+
+    The outlier flags follow without reading the trajectories again, e.g.
+        summaries = trial_summaries(files, trial_cache)
+        flags = helpers.outlier_mask(summaries, ['participant', 'trial'], by=['participant', 'cursor_shift'],
+                                     time_var='movement_time')
+    """
+    return cached_frame(files, "summary", trial_cache, workers, verbose, time_var=time_var)
@@ -0,0 +1,169 @@
+# SQLite catalog of the trials of the Handeln experiment
+
+"""
+Catalog with one row per trial: participant, trial, the conditions (including trial_score),
+number of samples, movement time, and the path, size and modification time of the trial file.
+
+The catalog is updated incrementally: only new or changed files are read, rows of files
+that were removed are deleted. Questions about trials then do not need the trajectories,
+and the loader only reads the trials a query selects:
+
+Example:
+    from handeln_analysis import catalog
+
+    data_root = os.path.join("02_Experiment_Code", "data")
+    trials = catalog.TrialCatalog(os.path.join(data_root, "catalog.sqlite"))
+    trials.update(data_root)
+    selected = trials.query("participant = ? AND cursor_shift = 240 AND movement_time > 1", ["max"])
+    data = trials.load("cursor_shift = 240 AND movement_time > 1")
+"""
+
+import os
+import re
+import sqlite3
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from . import loader
+
+# layout of the catalog
+CATALOG_VERSION = 1
+
+# columns of every row, the condition columns are added as they are found in the files
+FILE_COLUMNS = ["participant", "trial", "path", "size", "mtime_ns", "n_samples", "movement_time"]
+
+_COLUMN_NAME = re.compile(r"^\w+$")
+
+
+def _summarize_chunk(file_paths: List[str], time_var: str) -> List[Tuple[Dict, int, float]]:
+    # runs in the worker processes: only the summary of a trial is sent back, not its samples
+    summaries = []
+    for file_path in file_paths:
+        conditions, columns, values = loader.parse_trial_file(file_path)
+        time = values[:, columns.index(time_var)] if time_var in columns else np.zeros(0)
+        summaries.append((conditions, len(values), float(time.max()) if len(time) else None))
+    return summaries
+
+
+class TrialCatalog:
+    def __init__(self, path: str):
+        """
+        Open (or create) the catalog.
+
+        Args:
+            path: the SQLite file, e.g. data/catalog.sqlite. File paths are stored relative to its
+                folder, so the catalog stays valid when the data folder (with the catalog) is moved.
+        """
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS trials (participant TEXT NOT NULL, trial INTEGER NOT NULL, "
+                "path TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, n_samples INTEGER, movement_time REAL, "
+                "PRIMARY KEY (participant, trial))")
+            version = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if version is None:
+                self.connection.execute("INSERT INTO meta VALUES ('version', ?)", (str(CATALOG_VERSION),))
+            elif int(version[0]) != CATALOG_VERSION:
+                raise ValueError(f"catalog {path} has version {version[0]}, expected {CATALOG_VERSION}")
+
+    def columns(self) -> List[str]:
+        return [row[1] for row in self.connection.execute("PRAGMA table_info(trials)")]
+
+    def _add_columns(self, names):
+        existing = set(self.columns())
+        for name in names:
+            if name not in existing:
+                if not _COLUMN_NAME.match(name):
+                    raise ValueError(f"cannot store the condition {name!r} in the catalog")
+                # no declared type: the values keep the type they are inserted with
+                self.connection.execute(f'ALTER TABLE trials ADD COLUMN "{name}"')
+                existing.add(name)
+
+    def update(self, data_root: str, participants: Union[str, List[str]] = None, workers: int = None,
+               time_var: str = 'time') -> Tuple[int, int]:
+        """
+        Bring the catalog up to date with the trial files of one or more participants.
+
+        Args:
+            data_root: the data folder of the experiment, containing one folder per participant
+            participants: participant alias or list of aliases. Defaults to all participants in data_root.
+            workers: number of worker processes to read the new files (see loader.map_chunks)
+            time_var: column with the time stamps (for the movement time)
+
+        Returns:
+            (number of added or updated trials, number of removed trials)
+        """
+        files = loader.find_trial_files(data_root, participants)
+        # rows of files that are gone are removed for the scanned participants (all, if participants is None)
+        scanned = None if participants is None else set([participants] if isinstance(participants, str) else participants)
+        known = {(participant, trial): (size, mtime_ns) for participant, trial, size, mtime_ns in
+                 self.connection.execute("SELECT participant, trial, size, mtime_ns FROM trials")}
+
+        changed = []
+        for participant, trial, file_path in files:
+            stat = os.stat(file_path)
+            if known.get((participant, trial)) != (stat.st_size, stat.st_mtime_ns):
+                changed.append((participant, trial, file_path, stat.st_size, stat.st_mtime_ns))
+        summaries = loader.map_chunks(_summarize_chunk, [file_path for _, _, file_path, _, _ in changed],
+                                      workers, time_var)
+
+        current = {(participant, trial) for participant, trial, _ in files}
+        removed = [key for key in known if (scanned is None or key[0] in scanned) and key not in current]
+        with self.connection:
+            self._add_columns(dict.fromkeys(name for conditions, _, _ in summaries for name in conditions
+                                            if name not in FILE_COLUMNS))
+            for (participant, trial, file_path, size, mtime_ns), (conditions, n_samples, movement_time) \
+                    in zip(changed, summaries):
+                row = {**{name: value for name, value in conditions.items() if name not in FILE_COLUMNS},
+                       "participant": participant, "trial": trial,
+                       "path": os.path.relpath(os.path.abspath(file_path), self.root),
+                       "size": size, "mtime_ns": mtime_ns, "n_samples": n_samples, "movement_time": movement_time}
+                names = ", ".join(f'"{name}"' for name in row)
+                placeholders = ", ".join("?"*len(row))
+                self.connection.execute(f"INSERT OR REPLACE INTO trials ({names}) VALUES ({placeholders})",
+                                        list(row.values()))
+            self.connection.executemany("DELETE FROM trials WHERE participant = ? AND trial = ?", removed)
+        return len(changed), len(removed)
+
+    def query(self, where: str = None, params: Sequence = (), columns: List[str] = None) -> pd.DataFrame:
+        """
+        The rows of the trials that match a condition.
+
+        Args:
+            where (optional): SQL condition on the columns, e.g. "cursor_shift = 240 AND movement_time > 1".
+                Use ? placeholders with params for values (e.g. participant = ?). Defaults to all trials.
+            params: values of the placeholders
+            columns (optional): columns to return, defaults to all
+
+        Returns:
+            pd.DataFrame: one row per trial, sorted by participant and trial
+        """
+        selection = "*" if columns is None else ", ".join(f'"{name}"' for name in columns)
+        sql = f"SELECT {selection} FROM trials" + (f" WHERE {where}" if where else "") + " ORDER BY participant, trial"
+        return pd.read_sql_query(sql, self.connection, params=list(params))
+
+    def files(self, where: str = None, params: Sequence = ()) -> List[Tuple[str, int, str]]:
+        """the selected trials as (participant, trial number, file path), like loader.find_trial_files"""
+        rows = self.query(where, params, ["participant", "trial", "path"])
+        return [(participant, int(trial), os.path.join(self.root, path))
+                for participant, trial, path in rows.itertuples(index=False)]
+
+    def load(self, where: str = None, params: Sequence = (), workers: int = None,
+             merge_conditions: bool = True) -> Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
+        """Load only the trials that match where (see query and loader.load_trials)"""
+        return loader.load_trials(self.files(where, params), workers, merge_conditions)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,124 @@
+"""
+Command line interface of the analysis, run from the repository root:
+
+python -m handeln_analysis run 02_Experiment_Code/data                  # all participants, all CPUs
+python -m handeln_analysis run 02_Experiment_Code/data -p max -j 1 --channels cursor_x cursor_y vx
+python -m handeln_analysis status 02_Experiment_Code/data               # which participants are up to date
+python -m handeln_analysis plot analysis_output                         # mean paths per condition
+
+run analyses every participant (see pipeline) and writes the results to --output (default
+analysis_output). An interrupted run continues where it stopped when it is started again with the
+same arguments. Only run imports numpy and pandas, and only plot imports matplotlib.
+"""
+
+import argparse
+import os
+import sys
+
+from . import files, pipeline
+
+DEFAULT_OUTPUT = "analysis_output"
+
+
+def run(args) -> int:
+    params = {name: getattr(args, name) for name in pipeline.DEFAULT_PARAMS}
+    try:
+        failed = pipeline.run(args.data_root, args.output, args.participants, args.workers, args.force, **params)
+    except KeyboardInterrupt:
+        print("interrupted, run the same command again to continue", file=sys.stderr)
+        return 130
+    print(f"results written to {args.output}")
+    if failed:
+        print(f"failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def status(args) -> int:
+    participants = args.participants or files.list_participants(args.data_root)
+    print(f"{'participant':<20} {'trials':>7} {'outliers':>9}  status")
+    for participant in participants:
+        trial_files = files.find_trial_files(args.data_root, participant)
+        checkpoint = pipeline.read_checkpoint(args.output, participant)
+        if checkpoint is None:
+            state, outliers = "not analysed", ""
+        elif checkpoint.get("fingerprint") != files.fingerprint(trial_files):
+            state, outliers = "trial files changed", checkpoint["n_outliers"]
+        elif checkpoint.get("version") != pipeline.PIPELINE_VERSION:
+            state, outliers = "older version", checkpoint["n_outliers"]
+        else:
+            params = checkpoint["params"]
+            changed = [f"{name}={params.get(name)}" for name, value in pipeline.DEFAULT_PARAMS.items()
+                       if params.get(name) != value]
+            state = "done" + (f" ({', '.join(changed)})" if changed else "")
+            outliers = checkpoint["n_outliers"]
+        print(f"{participant:<20} {len(trial_files):>7} {outliers:>9}  {state}")
+    return 0
+
+
+def plot(args) -> int:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    means = pd.read_csv(os.path.join(args.output, "condition_means.csv"))
+    x, y = args.channels
+    participants = list(dict.fromkeys(means["participant"]))
+    conditions = [col for col in pipeline.DEFAULT_PARAMS["by"] if col in means.columns]
+    fig, axes = plt.subplots(1, len(participants), figsize=(4*len(participants), 4), squeeze=False,
+                             sharex=True, sharey=True)
+    for ax, participant in zip(axes[0], participants):
+        for condition, group in means[means["participant"] == participant].groupby(conditions, sort=True):
+            label = ", ".join(f"{col}={value:g}" for col, value in zip(conditions, condition))
+            ax.plot(group[x + "_mean"], group[y + "_mean"], label=label)
+        ax.set_title(participant)
+        ax.set_xlabel(x)
+    axes[0, 0].set_ylabel(y)
+    axes[0, -1].legend(fontsize="x-small")
+    file_path = args.figure or os.path.join(args.output, "condition_means.png")
+    fig.savefig(file_path, dpi=150, bbox_inches="tight")
+    print(f"figure written to {file_path}")
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    defaults = pipeline.DEFAULT_PARAMS
+    parser = argparse.ArgumentParser(prog="python -m handeln_analysis", description="Analysis of the Handeln experiment")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="analyse the participants (load, velocity, outliers, "
+                                                 "normalization, condition means)")
+    status_parser = commands.add_parser("status", help="show which participants are analysed and up to date")
+    for command in (run_parser, status_parser):
+        command.add_argument("data_root", help="data folder of the experiment, with one folder per participant")
+        command.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="results folder")
+        command.add_argument("-p", "--participants", nargs="+", default=None, help="defaults to all participants")
+    run_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, defaults to the CPUs")
+    run_parser.add_argument("--force", action="store_true", help="analyse again even if the results are up to date")
+    run_parser.add_argument("--channels", nargs="+", default=defaults["channels"],
+                            help="channels to normalize and average (cursor_x, cursor_y, vx, vy, vabs, ax, ay, aabs)")
+    run_parser.add_argument("--by", nargs="+", default=defaults["by"], help="condition columns of the means")
+    run_parser.add_argument("--n-points", type=int, default=defaults["n_points"], help="points of the normalized time")
+    run_parser.add_argument("--mode", choices=["time", "path", "progress"], default=defaults["mode"],
+                            help="normalize by time, path length or progress towards the target")
+    run_parser.add_argument("--outlier-by", nargs="*", default=defaults["outlier_by"],
+                            help="groups of the outlier criterion within a participant, e.g. cursor_shift")
+    run_parser.add_argument("--criterion", choices=["sd", "mad"], default=defaults["criterion"])
+    run_parser.add_argument("--threshold", type=float, default=defaults["threshold"])
+    run_parser.add_argument("--time-var", default=defaults["time_var"])
+    run_parser.add_argument("--timestamps", action="store_true", help="use the time stamps for the velocity")
+    run_parser.set_defaults(function=run)
+    status_parser.set_defaults(function=status)
+
+    plot_parser = commands.add_parser("plot", help="plot the mean paths per condition of every participant")
+    plot_parser.add_argument("output", nargs="?", default=DEFAULT_OUTPUT, help="results folder of run")
+    plot_parser.add_argument("--channels", nargs=2, default=["cursor_x", "cursor_y"], metavar=("X", "Y"))
+    plot_parser.add_argument("--figure", default=None, help="defaults to <output>/condition_means.png")
+    plot_parser.set_defaults(function=plot)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    sys.exit(args.function(args))
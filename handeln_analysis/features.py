@@ -0,0 +1,134 @@
+# Kinematic features per trial for the Handeln experiment
+
+"""
+A table of standard kinematic features with one row per trial, computed for all trials at once
+(grouped reductions over the concatenated samples, no loop over trials).
+
+The velocity features are computed from the hand position: the recorded cursor position minus
+the cursor shift while it is applied (cursor_x - cursor_shift * shift_applied), otherwise the
+jump of the cursor when the shift is applied would look like a very fast movement. The
+endpoint error is the error of the cursor, as seen and scored in the experiment.
+
+Example:
+    from handeln_analysis import features, loader
+
+    data = loader.load_participants(os.path.join("02_Experiment_Code", "data"))
+    table = features.trial_features(data, ['participant', 'trial'])
+"""
+
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+from . import helpers
+
+FEATURE_COLUMNS = ['n_samples', 'movement_time', 'path_length', 'peak_speed', 'time_to_peak', 'onset_time',
+                   'offset_time', 'endpoint_error_x', 'endpoint_error_y', 'endpoint_error', 'shift_time',
+                   'correction_onset', 'correction_latency', 'peak_correction_speed']
+
+
+def _first_index(mask: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    # index of the first sample of every trial where mask is True, -1 if there is none
+    n = len(mask)
+    first = np.minimum.reduceat(np.where(mask, np.arange(n), n), offsets[:-1])
+    return np.where(first < offsets[1:], first, -1)
+
+
+def _last_index(mask: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    # index of the last sample of every trial where mask is True, -1 if there is none
+    last = np.maximum.reduceat(np.where(mask, np.arange(len(mask)), -1), offsets[:-1])
+    return np.where(last >= offsets[:-1], last, -1)
+
+
+def _take(values: np.ndarray, index: np.ndarray) -> np.ndarray:
+    # values at index, NaN where index is -1
+    return np.where(index >= 0, values[np.maximum(index, 0)], np.nan)
+
+
+def trial_features(data: pd.DataFrame, trial_var: Union[str, List[str]] = 'trial', time_var: str = 'time',
+                   onset_fraction: float = 0.05, correction_fraction: float = 0.1, timestamps: bool = False,
+                   offsets: np.ndarray = None) -> pd.DataFrame:
+    """Kinematic features of every trial.
+
+    Features (times in s relative to the first sample of the trial, distances in pixels):
+        n_samples: number of samples
+        movement_time: time of the last sample (the click ending the trial)
+        path_length: length of the path of the hand
+        peak_speed, time_to_peak: the maximum speed of the hand and when it occurred
+        onset_time, offset_time: first and last sample with a speed of at least onset_fraction * peak_speed
+        endpoint_error_x, endpoint_error_y, endpoint_error: position of the cursor at the end relative to
+            the target (target_X, target_Y) and its distance to the target
+        shift_time: first sample with shift_applied (NaN if the cursor was not shifted)
+        correction_onset: first sample after shift_time at which the hand moves against the shift
+            (horizontal velocity opposite to cursor_shift) faster than correction_fraction * peak_speed
+        correction_latency: correction_onset - shift_time
+        peak_correction_speed: the maximum speed against the shift after shift_time
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials with the condition columns, the samples of each
+            trial stored contiguously (e.g. the output of loader.load_trials)
+        trial_var: column (or list of columns, e.g. ['participant', 'trial']) identifying a trial
+        time_var: column with the time stamps
+        onset_fraction: speed threshold for the movement onset and offset, relative to the peak speed
+        correction_fraction: speed threshold for the correction onset, relative to the peak speed
+        timestamps: use the actual time stamps for the velocity (see batch_velocity)
+        offsets (optional): start index of every trial plus the total number of samples (see trial_offsets)
+
+    Returns:
+        pd.DataFrame: one row per trial with the trial columns, the condition columns and FEATURE_COLUMNS
+    """
+    trial_keys = [trial_var] if isinstance(trial_var, str) else list(trial_var)
+    if offsets is None:
+        offsets = helpers.trial_offsets(data, trial_keys)
+    offsets = np.asarray(offsets)
+    starts, lasts = offsets[:-1], offsets[1:] - 1
+    lengths = np.diff(offsets)
+    trial_idx = np.repeat(np.arange(len(lengths)), lengths)
+    n = len(data)
+
+    time = data[time_var].to_numpy(dtype=float)
+    time = time - time[starts][trial_idx]
+    cursor = data[['cursor_x', 'cursor_y']].to_numpy(dtype=float)
+    shift = data['cursor_shift'].to_numpy(dtype=float) if 'cursor_shift' in data else np.zeros(n)
+    applied = data['shift_applied'].to_numpy() > 0 if 'shift_applied' in data else np.zeros(n, dtype=bool)
+    hand = helpers.hand_position(data)
+
+    # velocity of the hand (5-point differentiator within every trial)
+    hand_frame = pd.DataFrame({'x': hand[:, 0], 'y': hand[:, 1], 'time': time})
+    vx, _, speed = helpers.batch_velocity(hand_frame, offsets, ['x', 'y'], 'time', timestamps=timestamps).T
+
+    features = data[trial_keys + [col for col in helpers.CONDITION_COLUMNS if col in data.columns
+                                  and col not in trial_keys]].iloc[starts].reset_index(drop=True)
+    features['n_samples'] = lengths
+    features['movement_time'] = time[lasts]
+
+    step = np.sqrt(np.sum(np.diff(hand, axis=0)**2, axis=1))
+    within = trial_idx[1:] == trial_idx[:-1]
+    features['path_length'] = np.bincount(trial_idx[1:][within], step[within], minlength=len(lengths))
+
+    peak = np.maximum.reduceat(speed, starts)
+    features['peak_speed'] = peak
+    features['time_to_peak'] = _take(time, _first_index(speed == peak[trial_idx], offsets))
+    moving = (speed >= onset_fraction * peak[trial_idx]) & (peak[trial_idx] > 0)
+    features['onset_time'] = _take(time, _first_index(moving, offsets))
+    features['offset_time'] = _take(time, _last_index(moving, offsets))
+
+    if {'target_X', 'target_Y'} <= set(data.columns):
+        target = data[['target_X', 'target_Y']].to_numpy(dtype=float)[lasts]
+        error = cursor[lasts] - target
+        features['endpoint_error_x'] = error[:, 0]
+        features['endpoint_error_y'] = error[:, 1]
+        features['endpoint_error'] = np.sqrt(np.sum(error**2, axis=1))
+
+    # correction: time locked to the first sample with the shift applied
+    shift_index = _first_index(applied & (shift != 0), offsets)
+    features['shift_time'] = _take(time, shift_index)
+    after_shift = np.arange(n) >= np.where(shift_index >= 0, shift_index, np.iinfo(np.int64).max)[trial_idx]
+    correction_speed = np.where(after_shift, -np.sign(shift) * vx, -np.inf)
+    features['correction_onset'] = _take(time, _first_index(
+        correction_speed > correction_fraction * peak[trial_idx], offsets))
+    features['correction_latency'] = features['correction_onset'] - features['shift_time']
+    peak_correction = np.maximum.reduceat(correction_speed, starts)
+    features['peak_correction_speed'] = np.where(np.isfinite(peak_correction), np.maximum(peak_correction, 0), np.nan)
+    return features
@@ -0,0 +1,67 @@
+# Finding the trial files of the Handeln experiment
+
+"""
+Trial files of the participants in a data folder, and a fingerprint of them to tell whether
+they changed. Only the standard library is used, such that commands that only look at the files
+(e.g. python -m handeln_analysis status) start without importing numpy and pandas.
+"""
+
+import hashlib
+import importlib.util
+import os
+from typing import List, Tuple, Union
+
+# the file format is defined once, by the experiment that writes the files. The module is loaded from
+# its file, sys.path is left alone (and another Experiment_helpers on it cannot take its place)
+EXPERIMENT_CODE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "02_Experiment_Code")
+_spec = importlib.util.spec_from_file_location(
+    "handeln_analysis._trial_format", os.path.join(EXPERIMENT_CODE, "Experiment_helpers", "trial_format.py"))
+_trial_format = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_trial_format)
+TRAJECTORY_COLUMNS = _trial_format.TRAJECTORY_COLUMNS
+TRIAL_FILE_PATTERN = _trial_format.TRIAL_FILE_PATTERN
+parse_value = _trial_format.parse_value
+
+
+def find_trial_files(data_root: str, participants: Union[str, List[str]] = None) -> List[Tuple[str, int, str]]:
+    """
+    Find the trial files of one or more participants.
+
+    Args:
+        data_root: the data folder of the experiment, containing one folder per participant
+        participants: participant alias or list of aliases. Defaults to all folders in data_root.
+
+    Returns:
+        list of (participant, trial number, file path) sorted by participant and trial
+    """
+    if participants is None:
+        participants = sorted(name for name in os.listdir(data_root)
+                              if os.path.isdir(os.path.join(data_root, name)))
+    elif isinstance(participants, str):
+        participants = [participants]
+
+    files = []
+    for participant in participants:
+        participant_dir = os.path.join(data_root, participant)
+        for file_name in os.listdir(participant_dir):
+            match = TRIAL_FILE_PATTERN.match(file_name)
+            if match:
+                files.append((participant, int(match.group("trial")), os.path.join(participant_dir, file_name)))
+    return sorted(files)
+
+
+def list_participants(data_root: str) -> List[str]:
+    """the participants in data_root (the folders with at least one trial file)"""
+    return sorted(set(participant for participant, _, _ in find_trial_files(data_root)))
+
+
+def fingerprint(files: List[Tuple[str, int, str]]) -> str:
+    """
+    Hash of the trial numbers, sizes and modification times of the trial files: it changes when a file
+    is added, removed or written again, without reading the files.
+    """
+    digest = hashlib.sha256()
+    for participant, trial, file_path in files:
+        stat = os.stat(file_path)
+        digest.update(f"{participant}/{trial}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
@@ -0,0 +1,516 @@
+# HElper functions for the analysis of the Handeln experiment
+
+from typing import List, NamedTuple, Union
+import numpy as np
+import pandas as pd
+
+# columns holding the trial conditions in the data files of the experiment
+CONDITION_COLUMNS = ['start_X', 'start_Y', 'startradius', 'target_X', 'target_Y', 'target_SX', 'target_SY',
+                     'nDotsTarget', 'cursor_SX', 'cursor_SY', 'nDotsCursor', 'cursor_shift', 'shift_threshold',
+                     'trial_score']
+
+
+def velocity(trialData:pd.DataFrame, itemList:List[str], itemTime:str) -> np.array:
+    """The output has the following format for the columns:
+        [time, velocity in X, velocity in Y, absolute speed]
+
+    Args:
+        trialData (pd.DataFrame): the data for a particular condition
+        itemList: list of column names that contains the data to compute speed of
+        itemTime: column name for the column containing the timestamps
+
+    Returns:
+        np.array: numpy array with velocity data in it.
+    """    
+    # get the relevant data convert data to numpy
+    npXY = np.array(trialData[itemList])
+    
+    # get the time interval between samples
+    Dt = trialData[itemTime].diff()
+    meanDt = Dt.mean()
+    
+    # apply the formula mentioned above to get velocity in X and Y
+    # we can do this in one go on the complete array (no need for a for-loop)
+    vXY = (npXY[4:,:]-npXY[0:-4,:]+npXY[3:-1,:]-npXY[1:-3,:])/(6*meanDt)
+    # get the absolute speeds using Pythagoras
+    if len(itemList) == 1:
+        absSpeed = np.abs(vXY)
+    else:
+        absSpeed = np.sqrt(vXY[:,0]**2+vXY[:,1]**2)
+    # get the time samples (note we have to shorten a bit to make it equal in lenght to vXY)
+    time = np.array(trialData[itemTime])
+    time = time[2:-2]
+    
+    # put the elements together
+    rowlen = len(itemList)+2
+    vXY = np.hstack((time[:,None],vXY,absSpeed[:,None]))
+    # pad zeros for time-stamps for which velocity could not be computed
+    vXY = np.vstack((np.zeros((2,rowlen)),vXY,np.zeros((2,rowlen))))
+    
+    return vXY
+
+
+def trial_offsets(data:pd.DataFrame, trial_var:Union[str, List[str]]='trial') -> np.ndarray:
+    """Start index of every trial in a frame in which the samples of each trial are stored contiguously
+    (e.g. the output of loader.load_trials). The total number of samples is appended, such that the
+    samples of trial i are offsets[i]:offsets[i+1].
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials
+        trial_var: column (or list of columns, e.g. ['participant', 'trial']) identifying a trial
+
+    Returns:
+        np.array: offsets of length number of trials + 1
+    """
+    trial_keys = [trial_var] if isinstance(trial_var, str) else list(trial_var)
+    new_trial = np.zeros(max(len(data) - 1, 0), dtype=bool)
+    for key in trial_keys:
+        values = data[key].to_numpy()
+        new_trial |= values[1:] != values[:-1]
+    return np.concatenate(([0], np.flatnonzero(new_trial) + 1, [len(data)]))
+
+
+def _differentiate(values:np.ndarray, time:np.ndarray, offsets:np.ndarray, timestamps:bool, margin:int) -> np.ndarray:
+    """5-point differentiator (see velocity) applied to all trials at once.
+    Samples within margin of a trial border are assumed to be invalid input, the output is zero for all
+    samples for which the differentiator would need such samples or samples of a neighbouring trial."""
+    lengths = np.diff(offsets)
+    trial_idx = np.repeat(np.arange(len(lengths)), lengths)
+    pos = np.arange(len(values)) - offsets[:-1][trial_idx]
+    idx = np.flatnonzero((pos >= margin + 2) & (pos < lengths[trial_idx] - margin - 2))
+
+    if timestamps:
+        # use the actual time between the samples involved (frame timing jitters)
+        dt = time[idx+2] - time[idx-2] + time[idx+1] - time[idx-1]
+    else:
+        # use the mean time between samples of the trial (like velocity)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            meanDt = (time[offsets[1:] - 1] - time[offsets[:-1]]) / (lengths - 1)
+        dt = 6 * meanDt[trial_idx[idx]]
+
+    # samples without time between them (repeated time stamps) get zero derivative
+    dt = np.where(dt > 0, dt, np.inf)
+    derivative = np.zeros_like(values)
+    derivative[idx] = (values[idx+2] - values[idx-2] + values[idx+1] - values[idx-1]) / dt[:, None]
+    return derivative
+
+
+def batch_velocity(data:pd.DataFrame, offsets:np.ndarray, itemList:List[str]=['cursor_x', 'cursor_y'],
+                   itemTime:str='time', timestamps:bool=False, acceleration:bool=False) -> np.array:
+    """Velocity (and optionally acceleration) for all trials at once, using the same 5-point
+    differentiator as velocity but without a loop over trials. The differentiator never crosses
+    the border between two trials.
+
+    The output has the following format for the columns:
+        [velocity per item, absolute speed] and if acceleration is True additionally
+        [acceleration per item, absolute acceleration]
+    Like in velocity, the first and last 2 samples of each trial (4 for acceleration) are zero.
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials, the samples of each trial stored contiguously
+        offsets: start index of every trial plus the total number of samples (see trial_offsets)
+        itemList: list of column names that contains the data to compute speed of
+        itemTime: column name for the column containing the timestamps
+        timestamps: use the actual time stamps of the samples instead of the mean sample interval of the trial
+        acceleration: also compute the acceleration
+
+    Returns:
+        np.array: numpy array with one row per sample in data
+    """
+    offsets = np.asarray(offsets)
+    values = data[itemList].to_numpy(dtype=float)
+    time = data[itemTime].to_numpy(dtype=float)
+
+    vXY = _differentiate(values, time, offsets, timestamps, margin=0)
+    result = [vXY, np.sqrt(np.sum(vXY**2, axis=1))[:, None]]
+    if acceleration:
+        aXY = _differentiate(vXY, time, offsets, timestamps, margin=2)
+        result += [aXY, np.sqrt(np.sum(aXY**2, axis=1))[:, None]]
+    return np.hstack(result)
+
+
+def add_kinematics(data:pd.DataFrame, trial_var:Union[str, List[str]]='trial', timestamps:bool=False,
+                   acceleration:bool=False) -> pd.DataFrame:
+    """Add the columns vx, vy and vabs (and ax, ay and aabs if acceleration is True) for the cursor to a
+    frame with the trajectory data of all trials (see batch_velocity).
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials, the samples of each trial stored contiguously
+        trial_var: column (or list of columns, e.g. ['participant', 'trial']) identifying a trial
+        timestamps: use the actual time stamps of the samples instead of the mean sample interval of the trial
+        acceleration: also compute the acceleration
+
+    Returns:
+        pd.DataFrame: data with the kinematics columns added
+    """
+    kinematics = batch_velocity(data, trial_offsets(data, trial_var), timestamps=timestamps,
+                                acceleration=acceleration)
+    columns = ['vx', 'vy', 'vabs'] + (['ax', 'ay', 'aabs'] if acceleration else [])
+    data[columns] = kinematics
+    return data
+
+
+def normalize_time(data):
+    """
+    Normalize the time frame to go from 0 to 1.
+
+    input:
+    data: dataframe with trajectory data for one trial
+
+    output:
+    dataframe with normalized trajectory data after resampling to the normalized timeframe
+
+    See normalize_trials for normalizing all trials at once.
+    """
+    data.loc[:,'datetime'] = pd.date_range('1/1/2001 00:00:00', '1/1/2001 00:00:01',len(data))
+    normdata = data.set_index('datetime', drop = True).resample('10ms').mean().interpolate()
+    normdata['normtime'] = np.arange(0,1.01,0.01)
+    normdata = normdata.reset_index(drop=True)
+
+    return normdata
+
+
+class NormalizedTrajectories(NamedTuple):
+    """Time normalized trajectories of a set of trials (see normalize_trials).
+
+    values: array (trials x normalized time points x channels)
+    normtime: the normalized time grid (from 0 to 1)
+    channels: names of the channels in values
+    keys: one row per trial with the trial keys and conditions
+    """
+    values: np.ndarray
+    normtime: np.ndarray
+    channels: List[str]
+    keys: pd.DataFrame
+
+    def to_frame(self) -> pd.DataFrame:
+        """Long format frame (one row per trial and normalized time point) like the output of normalize_time"""
+        n_trials, n_points, _ = self.values.shape
+        frame = self.keys.loc[self.keys.index.repeat(n_points)].reset_index(drop=True)
+        frame['normtime'] = np.tile(self.normtime, n_trials)
+        for i, channel in enumerate(self.channels):
+            frame[channel] = self.values[:, :, i].ravel()
+        return frame
+
+
+def hand_position(data:pd.DataFrame) -> np.ndarray:
+    """Position of the hand (samples x 2): the cursor position minus the cursor shift while it is applied"""
+    position = data[['cursor_x', 'cursor_y']].to_numpy(dtype=float, copy=True)
+    if 'cursor_shift' in data.columns and 'shift_applied' in data.columns:
+        position[:, 0] -= np.where(data['shift_applied'].to_numpy() > 0, data['cursor_shift'].to_numpy(dtype=float), 0)
+    return position
+
+
+def _spatial_progress(data:pd.DataFrame, mode:str, offsets:np.ndarray, trial_idx:np.ndarray) -> np.ndarray:
+    # relative progress of every sample within its trial: the fraction of the path length of the hand
+    # ('path', 0 to 1) or of the distance from the start point to the target along that axis ('progress',
+    # clipped to 0 to 1 and never decreasing)
+    starts = offsets[:-1]
+    lasts = np.maximum(offsets[1:] - 1, starts)
+    position = hand_position(data)
+    if mode == 'path':
+        step = np.zeros(len(data))
+        step[1:] = np.sqrt(np.sum(np.diff(position, axis=0)**2, axis=1))
+        step[starts[starts < len(data)]] = 0
+        length = np.cumsum(step)
+        length -= length[starts][trial_idx]
+        total = length[lasts] if len(length) else np.zeros(len(starts))
+        return length / np.where(total > 0, total, 1)[trial_idx]
+
+    start = data[['start_X', 'start_Y']].to_numpy(dtype=float)
+    axis = data[['target_X', 'target_Y']].to_numpy(dtype=float) - start
+    distance = np.sum(axis**2, axis=1)
+    progress = np.sum((position - start) * axis, axis=1) / np.where(distance > 0, distance, np.nan)
+    # running maximum within every trial: the trials are shifted to [2k, 2k + 1] such that one
+    # accumulate over all samples never carries a value into the next trial
+    shifted = np.clip(np.nan_to_num(progress), 0, 1) + 2 * trial_idx
+    return np.maximum.accumulate(shifted) - 2 * trial_idx if len(shifted) else shifted
+
+
+def normalize_trials(data:pd.DataFrame, channels:List[str]=['cursor_x', 'cursor_y'], n_points:int=101,
+                     trial_var:Union[str, List[str]]='trial', time_var:str='time', key_columns:List[str]=None,
+                     conditions:pd.DataFrame=None, offsets:np.ndarray=None, mode:str='time') -> NormalizedTrajectories:
+    """Normalize the time of all trials to go from 0 to 1 and resample them on a grid of n_points.
+
+    All trials are interpolated at once (linear interpolation over the arrays, no resampling in pandas),
+    the result is a dense array that can directly be averaged over trials (see e.g. condition_means).
+
+    Instead of time the trials can be normalized in space (mode), with the position of the hand
+    (see hand_position):
+        'path': by the fraction of the path length, e.g. 0.5 is where the hand had covered half
+            of its path
+        'progress': by the progress from the start point (start_X, start_Y) towards the target
+            (target_X, target_Y) along the axis between them, e.g. 0.5 is where the hand first got
+            half way. Points of the grid that a trial did not reach (e.g. beyond 0.9 for a trial
+            that ended short of the target) are NaN.
+    In either mode channels can include the time, e.g. ['cursor_x', 'cursor_y', 'time'], to get the
+    time at which every point of the grid was reached.
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials, the samples of each trial stored contiguously
+        channels: columns to normalize, e.g. ['cursor_x', 'cursor_y', 'vabs', 'time']
+        n_points: number of points in the normalized time grid (101 gives steps of 0.01)
+        trial_var: column (or list of columns, e.g. ['participant', 'trial']) identifying a trial
+        time_var: column with the time stamps. If None the samples are assumed to be equidistant in time
+            (like normalize_time does).
+        key_columns (optional): columns to keep per trial, defaults to the trial columns plus the
+            condition columns present in data
+        conditions (optional): separate conditions frame with one row per trial, merged into the keys
+            on the trial columns
+        offsets (optional): start index of every trial plus the total number of samples (see trial_offsets)
+        mode: 'time', 'path' or 'progress' (see above)
+
+    Returns:
+        NormalizedTrajectories: values, normalized time (or path, or progress) grid, channel names and keys
+        per trial
+    """
+    if mode not in ('time', 'path', 'progress'):
+        raise ValueError(f"mode should be 'time', 'path' or 'progress', not {mode!r}")
+    trial_keys = [trial_var] if isinstance(trial_var, str) else list(trial_var)
+    if offsets is None:
+        offsets = trial_offsets(data, trial_keys)
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    n_trials = len(lengths)
+    trial_idx = np.repeat(np.arange(n_trials), lengths)
+    starts = offsets[:-1]
+    lasts = np.maximum(offsets[1:] - 1, starts)
+
+    # relative time of every sample within its trial (0 to 1)
+    pos = (np.arange(len(data)) - starts[trial_idx]).astype(float)
+    index_span = np.maximum(lengths - 1, 1).astype(float)
+    if mode != 'time':
+        rtime = _spatial_progress(data, mode, offsets, trial_idx)
+        if mode == 'path':
+            # trials without movement fall back to equidistant samples
+            no_span = (rtime[lasts] <= 0)[trial_idx] if len(rtime) else np.zeros(0, dtype=bool)
+            rtime = np.where(no_span, pos / index_span[trial_idx], rtime)
+    elif time_var is None:
+        rtime = pos / index_span[trial_idx]
+    else:
+        time = data[time_var].to_numpy(dtype=float)
+        span = time[lasts] - time[starts] if len(time) else np.zeros(n_trials)
+        # trials without elapsed time fall back to equidistant samples
+        no_span = span[trial_idx] <= 0
+        rtime = np.where(no_span, pos / index_span[trial_idx],
+                         (time - time[starts][trial_idx]) / np.where(span > 0, span, 1)[trial_idx])
+
+    # shift every trial to its own interval [2k, 2k+1] such that one interpolation handles all trials
+    # without ever interpolating between two trials
+    normtime = np.linspace(0, 1, n_points)
+    sample_x = rtime + 2 * trial_idx
+    grid_x = (normtime[None, :] + 2 * np.arange(n_trials)[:, None]).ravel()
+
+    samples = data[channels].to_numpy(dtype=float)
+    values = np.empty((n_trials, n_points, len(channels)))
+    for i in range(len(channels)):
+        values[:, :, i] = np.interp(grid_x, sample_x, samples[:, i]).reshape(n_trials, n_points) \
+            if len(samples) else np.nan
+    # trials with a single sample are constant, empty trials have no data
+    single = lengths == 1
+    values[single] = samples[starts[single]][:, None, :]
+    values[lengths == 0] = np.nan
+    if mode == 'progress' and len(rtime):
+        # progress is never decreasing: the reached range of every trial is from its first to its last sample
+        reached = (normtime >= rtime[starts][:, None]) & (normtime <= rtime[lasts][:, None])
+        values[~reached] = np.nan
+
+    if key_columns is None:
+        key_columns = trial_keys + [col for col in CONDITION_COLUMNS if col in data.columns and col not in trial_keys]
+    keys = data[key_columns].iloc[starts].reset_index(drop=True) if len(data) else \
+        pd.DataFrame(columns=key_columns)
+    if conditions is not None:
+        keys = keys.merge(conditions, on=trial_keys, how='left', suffixes=('', '_conditions'))
+
+    return NormalizedTrajectories(values, normtime, list(channels), keys)
+
+
+class ConditionMeans(NamedTuple):
+    """Mean trajectories per condition (see condition_means).
+
+    groups: one row per condition with the condition columns and the number of trials (n_trials)
+    mean, sd, sem: arrays (conditions x normalized time points x channels)
+    n: number of trials contributing to every value (conditions x normalized time points x channels)
+    normtime: the normalized time grid
+    channels: names of the channels
+    """
+    groups: pd.DataFrame
+    mean: np.ndarray
+    sd: np.ndarray
+    sem: np.ndarray
+    n: np.ndarray
+    normtime: np.ndarray
+    channels: List[str]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Tidy frame with one row per condition and normalized time point and columns
+        <channel>_mean, <channel>_sd and <channel>_sem for every channel"""
+        n_groups, n_points, _ = self.mean.shape
+        frame = self.groups.loc[self.groups.index.repeat(n_points)].reset_index(drop=True)
+        frame['normtime'] = np.tile(self.normtime, n_groups)
+        for i, channel in enumerate(self.channels):
+            frame[channel + '_mean'] = self.mean[:, :, i].ravel()
+            frame[channel + '_sd'] = self.sd[:, :, i].ravel()
+            frame[channel + '_sem'] = self.sem[:, :, i].ravel()
+        return frame
+
+
+def condition_means(normalized:NormalizedTrajectories, by:List[str]=['cursor_SX', 'cursor_SY', 'cursor_shift'],
+                    ddof:int=1) -> ConditionMeans:
+    """Average the normalized trajectories per condition.
+
+    The trials are grouped by the given condition columns of normalized.keys and the mean, standard deviation
+    and standard error of the mean are computed for every condition, normalized time point and channel in one
+    grouped reduction over the trajectory array (no loop over trials or conditions). Missing values (NaN) are
+    ignored.
+
+    Args:
+        normalized (NormalizedTrajectories): output of normalize_trials
+        by: condition columns defining the groups, e.g. ['participant', 'cursor_shift']
+        ddof: delta degrees of freedom for the standard deviation (1 gives the sample standard deviation)
+
+    Returns:
+        ConditionMeans: the condition table and the mean, sd and sem arrays
+    """
+    by = list(by)
+    codes = normalized.keys.groupby(by, sort=True, observed=True, dropna=False).ngroup().to_numpy()
+    first, n_trials, count, mean, m2 = grouped_moments(normalized.values, codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.sqrt(m2 / (count - ddof))
+        sem = sd / np.sqrt(count)
+
+    groups = normalized.keys[by].iloc[first].reset_index(drop=True)
+    groups['n_trials'] = n_trials
+    return ConditionMeans(groups, mean, sd, sem, count, normalized.normtime, normalized.channels)
+
+
+def grouped_moments(values:np.ndarray, codes:np.ndarray) -> tuple:
+    """Count, mean and sum of squared deviations (M2) of values per group, ignoring NaN.
+
+    Args:
+        values: array with one row (of any shape) per trial
+        codes: group number (0 to number of groups - 1) of every trial, every number occurring at least once
+
+    Returns:
+        first: index of the first trial of every group
+        n_trials: number of trials per group
+        count, mean, m2: arrays (groups x shape of a row), the number of finite values, their mean and the
+            sum of their squared deviations from the mean
+    """
+    # sort the trials by condition such that each condition is one contiguous block
+    order = np.argsort(codes, kind='stable')
+    n_trials = np.bincount(codes)
+    starts = np.concatenate(([0], np.cumsum(n_trials)[:-1]))
+
+    values = values[order]
+    finite = ~np.isnan(values)
+    count = np.add.reduceat(finite, starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.add.reduceat(np.where(finite, values, 0), starts, axis=0) / count
+        deviation = np.where(finite, values - mean[codes[order]], 0)
+        m2 = np.add.reduceat(deviation**2, starts, axis=0)
+    return order[starts], n_trials, count, mean, m2
+
+
+def movement_times(data:pd.DataFrame, trial_var:Union[str, List[str]]='trial', by:List[str]=None,
+                   time_var:str='time') -> pd.Series:
+    """Movement time (last time stamp) of every trial, computed with one grouped reduction.
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials
+        trial_var: column (or list of columns, e.g. ['participant', 'trial']) identifying a trial
+        by (optional): condition columns to keep in the index of the result, e.g. ['cursor_shift']
+        time_var: column with the time stamps
+
+    Returns:
+        pd.Series: movement time per trial, indexed by the by columns followed by the trial columns
+    """
+    trial_keys = [trial_var] if isinstance(trial_var, str) else list(trial_var)
+    by = [] if by is None else list(by)
+    keys = by + [key for key in trial_keys if key not in by]
+    return data.groupby(keys, sort=True, observed=True)[time_var].max().rename('movement_time')
+
+
+def outlier_mask(data:pd.DataFrame, trial_var:Union[str, List[str]]='trial', by:List[str]=None,
+                 criterion:str='sd', threshold:float=3, time_var:str='time') -> pd.Series:
+    """Flag trials with an outlying movement time.
+
+    The movement time of every trial is compared to the movement times of the other trials in its
+    group. Groups are given by the by columns, e.g. by=['participant'] for per participant thresholds
+    or by=['participant', 'cursor_shift'] for per participant and condition thresholds.
+
+    Args:
+        data (pd.DataFrame): trajectory data of all trials
+        trial_var: column (or list of columns, e.g. ['participant', 'trial']) identifying a trial
+        by (optional): columns defining the groups, defaults to all trials in one group
+        criterion: 'sd': distance to the group mean in standard deviations (the classic 3-SD rule),
+            'mad': distance to the group median in scaled median absolute deviations (robust to the
+            outliers themselves)
+        threshold: trials further away than this are flagged
+        time_var: column with the time stamps
+
+    Returns:
+        pd.Series: boolean per trial (True = outlier), indexed by the trial columns
+    """
+    by = [] if by is None else list(by)
+    mov_time = movement_times(data, trial_var, by, time_var)
+    # all trials form one group if no grouping columns are given
+    grouper = {'level': by} if by else {'by': np.zeros(len(mov_time))}
+
+    if criterion == 'sd':
+        centre = mov_time.groupby(**grouper, observed=True).transform('mean')
+        spread = mov_time.groupby(**grouper, observed=True).transform('std', ddof=0)
+    elif criterion == 'mad':
+        centre = mov_time.groupby(**grouper, observed=True).transform('median')
+        deviation = (mov_time - centre).abs()
+        # scale the MAD such that it estimates the standard deviation for normally distributed data
+        spread = 1.4826 * deviation.groupby(**grouper, observed=True).transform('median')
+    else:
+        raise ValueError(f"criterion should be 'sd' or 'mad', not {criterion!r}")
+
+    distance = (mov_time - centre).abs() / spread.where(spread > 0)
+    flags = (distance > threshold).rename('outlier')
+    trial_keys = [trial_var] if isinstance(trial_var, str) else list(trial_var)
+    extra_levels = [col for col in by if col not in trial_keys]
+    if extra_levels:
+        flags = flags.droplevel(extra_levels)
+    return flags.reorder_levels(trial_keys) if len(trial_keys) > 1 else flags
+
+
+def remove_outliers(data:pd.DataFrame, trial_var:str='trial', conditions=None) -> pd.DataFrame:
+    """
+    Will remove outliers based on the mean and the standard deviation of the movement time accross trials.
+    A trial will be removed if the movement time is more than 3 std away from the mean in either direction.
+    See outlier_mask for per condition or per participant thresholds and robust criteria.
+
+    Input:
+    data:   pandas DataFrame with all trajectory data. Note the algorithm assumes there is a column called 'trial' that keeps a trial index.
+            The optional parameter trial_var can be used if this column has been named differently.
+
+    trial_var (string, optional): column name in which the trial numbers for the samples are stored. Defaults to 'trial'.
+            A list of columns (e.g. ['participant', 'trial']) identifies the trials of several participants.
+    conditions (optional): dataframe that has the trial conditions in case you keep a separate dataframe for this.
+            This should also have a similar trial column called 'trial' or trial_var as the trajectory dataframe.
+
+    Deviating trials will be removed from data or both dataframes, if conditions is provided.
+    """
+
+    flags = outlier_mask(data, trial_var)
+    flag4removal = flags.index[flags.to_numpy()].to_numpy()
+
+    print('------------------\n')
+    print('The following trials will be removed from the data base on outlier analysis:\n')
+    print(flag4removal)
+    print('------------------\n')
+
+    def removed(frame):
+        if isinstance(trial_var, str):
+            return frame[trial_var].isin(flag4removal)
+        return pd.MultiIndex.from_frame(frame[list(trial_var)]).isin(flags.index[flags.to_numpy()])
+
+    new_data = data[~removed(data)]
+    if conditions is not None:
+        new_cons = conditions[~removed(conditions)]
+        return new_data, new_cons
+    
+    return new_data
\ No newline at end of file
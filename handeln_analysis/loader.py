@@ -0,0 +1,172 @@
+# Loading the trial files of the Handeln experiment
+
+"""
+Bulk loader for the per trial CSV files written by the experiment
+(data/<participant>/participant_<participant>_trial_<nr>_trajectory.csv).
+
+Each file is parsed in a single pass (conditions header, conditions row,
+trajectory header, trajectory rows) and the files are spread over a process
+pool. The result is one frame with all samples of all requested participants.
+
+Example:
+    from handeln_analysis import loader
+    data = loader.load_participants(os.path.join("02_Experiment_Code", "data"), ["max"])
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# part of the loader interface, kept in files to find the files without numpy and pandas
+from .files import TRAJECTORY_COLUMNS, TRIAL_FILE_PATTERN, find_trial_files, parse_value  # noqa: F401
+
+# below this number of files starting a process pool costs more than it saves
+MIN_FILES_PER_WORKER = 64
+
+
+def parse_trial_file(file_path: str) -> Tuple[Dict, List[str], np.ndarray]:
+    """
+    Parse the three sections of a trial file in one pass.
+
+    Returns:
+        conditions: dict with the trial conditions (including trial_score)
+        columns: names of the trajectory columns
+        values: float array (samples x columns) with the trajectory
+    """
+    with open(file_path) as f:
+        return parse_trial_text(f.read())
+
+
+def parse_trial_text(text: str) -> Tuple[Dict, List[str], np.ndarray]:
+    """parse_trial_file for the content of a trial file"""
+    con_header, con_values, columns, body = (text.split("\n", 3) + [""])[:4]
+    conditions = {name: parse_value(value) for name, value in
+                  zip(con_header.strip().split(","), con_values.strip().split(","))}
+    columns = columns.strip().split(",")
+    rows = body.split()
+    if rows:
+        values = np.array(",".join(rows).split(","), dtype=np.float64).reshape(len(rows), len(columns))
+    else:
+        values = np.zeros((0, len(columns)))
+    return conditions, columns, values
+
+
+def read_trial(file_path: str) -> Tuple[Dict, pd.DataFrame]:
+    """
+    Read a single trial file.
+
+    Returns:
+        conditions: dict with the trial conditions
+        trajectory: DataFrame with the trajectory samples
+    """
+    conditions, columns, values = parse_trial_file(file_path)
+    return conditions, trajectory_frame(columns, values)
+
+
+def trajectory_frame(columns: List[str], values: np.ndarray) -> pd.DataFrame:
+    """DataFrame with the typed trajectory columns of a parsed trial file"""
+    return pd.DataFrame({col: values[:, i].astype(TRAJECTORY_COLUMNS.get(col, "<f8"))
+                         for i, col in enumerate(columns)})
+
+
+def _parse_chunk(file_paths: List[str]) -> List[Tuple[Dict, List[str], np.ndarray]]:
+    return [parse_trial_file(file_path) for file_path in file_paths]
+
+
+def map_chunks(function: Callable, items: List, workers: int = None, *args) -> List:
+    """
+    Apply function(chunk, *args), which returns one result per item of the chunk, to all items,
+    spread over a process pool with one chunk per worker (which keeps the number of pickled
+    results small). Small sets of items are handled in the current process.
+
+    Args:
+        function: module level function (it is pickled), e.g. _parse_chunk
+        items: list of items, e.g. file paths
+        workers: number of worker processes, defaults to the number of CPUs
+        *args: further arguments of function, the same for all chunks
+
+    Returns:
+        list with the results of all items, in the order of items
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(items) // MIN_FILES_PER_WORKER)
+    if workers <= 1:
+        return function(list(items), *args)
+
+    chunks = [chunk.tolist() for chunk in np.array_split(np.array(items, dtype=object), workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = pool.map(function, chunks, *[[arg]*workers for arg in args])
+        return [result for part in parts for result in part]
+
+
+def _parse_files(file_paths: List[str], workers: int = None) -> List[Tuple[Dict, List[str], np.ndarray]]:
+    return map_chunks(_parse_chunk, file_paths, workers)
+
+
+def load_trials(files: List[Tuple[str, int, str]], workers: int = None,
+                merge_conditions: bool = True) -> Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Load a list of trial files (as returned by find_trial_files) into one frame.
+
+    Args:
+        files: list of (participant, trial number, file path)
+        workers: number of worker processes, defaults to the number of CPUs. Small sets of files are read
+            in the current process.
+        merge_conditions: if True the condition columns are added to every sample (like readTrial in the
+            analysis notebook), otherwise a separate conditions frame with one row per trial is returned.
+
+    Returns:
+        DataFrame with 'participant' and 'trial' columns followed by the conditions (if merged) and the
+        trajectory columns, or (trajectories, conditions) if merge_conditions is False.
+    """
+    parsed = _parse_files([file_path for _, _, file_path in files], workers)
+
+    participants = pd.Categorical([participant for participant, _, _ in files])
+    trials = np.array([trial for _, trial, _ in files], dtype=np.int64)
+    n_samples = np.array([len(values) for _, _, values in parsed], dtype=np.int64)
+
+    # conditions: one row per trial
+    conditions = pd.DataFrame([con for con, _, _ in parsed])
+    conditions.insert(0, "trial", trials)
+    conditions.insert(0, "participant", participants)
+
+    # trajectories: concatenate column wise, columns missing in a file are filled with NaN
+    columns = list(dict.fromkeys(col for _, cols, _ in parsed for col in cols))
+    trajectory = {}
+    for col in columns:
+        parts = [values[:, cols.index(col)] if col in cols else np.full(len(values), np.nan)
+                 for _, cols, values in parsed]
+        data = np.concatenate(parts) if parts else np.zeros(0)
+        if not np.isnan(data).any():
+            data = data.astype(TRAJECTORY_COLUMNS.get(col, "<f8"))
+        trajectory[col] = data
+
+    keys = {"participant": participants.take(np.repeat(np.arange(len(files)), n_samples)),
+            "trial": np.repeat(trials, n_samples)}
+    if not merge_conditions:
+        return pd.DataFrame({**keys, **trajectory}), conditions
+
+    repeated = {col: np.repeat(conditions[col].to_numpy(), n_samples)
+                for col in conditions.columns if col not in keys}
+    return pd.DataFrame({**keys, **repeated, **trajectory})
+
+
+def load_participants(data_root: str, participants: Union[str, List[str]] = None, workers: int = None,
+                      merge_conditions: bool = True) -> Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Load all trials of one or more participants.
+
+    Args:
+        data_root: the data folder of the experiment, containing one folder per participant
+        participants: participant alias or list of aliases. Defaults to all participants in data_root.
+        workers: number of worker processes (see load_trials)
+        merge_conditions: add the conditions to every sample or return them separately (see load_trials)
+
+    Returns:
+        see load_trials
+    """
+    return load_trials(find_trial_files(data_root, participants), workers, merge_conditions)
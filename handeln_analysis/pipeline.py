@@ -0,0 +1,253 @@
+# Batch analysis of the participants of the Handeln experiment
+
+"""
+The standard analysis for every participant: load the trials, compute the velocities, remove the
+movement time outliers, normalize the trajectories in time and average them per condition.
+
+Every participant is analysed on its own (spread over a process pool by run) and its results are
+written to <output>/<participant>/:
+    trials.csv           one row per trial: conditions, movement time and outlier flag
+    normalized.npz       the normalized trajectories of the trials that are kept (values, normtime,
+                         channels, trial)
+    condition_means.csv  mean, sd and sem per condition and normalized time point (ConditionMeans.to_frame)
+    checkpoint.json      written last: the parameters, a fingerprint of the trial files and a summary
+
+A participant whose checkpoint matches the parameters and the current trial files is not analysed
+again, so an interrupted run continues where it stopped, and adding participants (or trials) to a
+study only analyses what is new. Finally the results of all participants that are up to date with
+the same parameters are combined into <output>/trials.csv and <output>/condition_means.csv.
+
+numpy, pandas and the analysis modules are imported in the functions that need them, such that
+status (checkpoints only) is fast.
+
+Example:
+    from handeln_analysis import pipeline
+    pipeline.run(os.path.join("02_Experiment_Code", "data"), "analysis_output", workers=4)
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Union
+
+from . import files
+
+# layout of the results and the checkpoints, part of every checkpoint
+PIPELINE_VERSION = 1
+
+DEFAULT_PARAMS = {
+    "channels": ["cursor_x", "cursor_y", "vabs"],  # normalized and averaged
+    "by": ["cursor_SX", "cursor_SY", "cursor_shift"],  # condition columns of the means
+    "n_points": 101,  # points of the normalized time grid
+    "mode": "time",  # normalize by 'time', 'path' length or 'progress' towards the target (see normalize_trials)
+    "outlier_by": [],  # groups of the outlier criterion within a participant, e.g. ["cursor_shift"]
+    "criterion": "sd",  # 'sd' or 'mad', see helpers.outlier_mask
+    "threshold": 3.0,
+    "time_var": "time",
+    "timestamps": False,  # use the time stamps for the velocity (see helpers.batch_velocity)
+}
+
+TRIAL_KEYS = ["participant", "trial"]
+
+CHECKPOINT = "checkpoint.json"
+
+
+def _write_atomic(path: str, write):
+    # write(temp_path) writes the file, which is renamed into place: no partial results after a crash
+    temp_path = path + ".tmp"
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+def read_checkpoint(output_dir: str, participant: str) -> Dict:
+    """the checkpoint of a participant, None if there is none"""
+    try:
+        with open(os.path.join(output_dir, participant, CHECKPOINT)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_done(checkpoint: Dict, params: Dict, fingerprint: str) -> bool:
+    """whether a checkpoint holds the results for these parameters and trial files"""
+    return (checkpoint is not None and checkpoint.get("version") == PIPELINE_VERSION
+            and checkpoint.get("params") == params and checkpoint.get("fingerprint") == fingerprint)
+
+
+def analyze_participant(data_root: str, participant: str, output_dir: str, params: Dict) -> Dict:
+    """
+    Analyse the trials of one participant and write its results and checkpoint (see the module docstring).
+
+    Args:
+        data_root: the data folder of the experiment
+        participant: alias of the participant
+        output_dir: results folder, the results are written to output_dir/participant
+        params: complete parameters (see DEFAULT_PARAMS)
+
+    Returns:
+        the checkpoint (parameters, fingerprint and summary of the results)
+    """
+    import numpy as np
+
+    from . import helpers, loader
+
+    start = time.perf_counter()
+    trial_files = files.find_trial_files(data_root, participant)
+    fingerprint = files.fingerprint(trial_files)
+    data = loader.load_trials(trial_files, workers=1)
+
+    channels = list(params["channels"])
+    acceleration = bool({"ax", "ay", "aabs"} & set(channels))
+    if {"vx", "vy", "vabs"} & set(channels) or acceleration:
+        helpers.add_kinematics(data, TRIAL_KEYS, timestamps=params["timestamps"], acceleration=acceleration)
+
+    offsets = helpers.trial_offsets(data, TRIAL_KEYS)
+    trials = data[TRIAL_KEYS + [col for col in helpers.CONDITION_COLUMNS if col in data.columns]] \
+        .iloc[offsets[:-1]].reset_index(drop=True)
+    time_values = data[params["time_var"]].to_numpy(dtype=float)
+    trials["movement_time"] = np.maximum.reduceat(time_values, offsets[:-1]) if len(data) else np.zeros(0)
+    flags = helpers.outlier_mask(data, TRIAL_KEYS, by=params["outlier_by"], criterion=params["criterion"],
+                                 threshold=params["threshold"], time_var=params["time_var"])
+    # one participant: the flags (sorted by the outlier_by groups first) are aligned by trial number
+    trials["outlier"] = flags.droplevel("participant").reindex(trials["trial"]).to_numpy()
+
+    kept = np.repeat(~trials["outlier"].to_numpy(), np.diff(offsets))
+    data = data[kept].reset_index(drop=True)
+    normalized = helpers.normalize_trials(data, channels, params["n_points"], TRIAL_KEYS, params["time_var"],
+                                          mode=params["mode"])
+    means = helpers.condition_means(normalized, params["by"])
+    frame = means.to_frame()
+    frame.insert(0, "participant", participant)
+
+    participant_dir = os.path.join(output_dir, participant)
+    os.makedirs(participant_dir, exist_ok=True)
+    _write_atomic(os.path.join(participant_dir, "trials.csv"), lambda path: trials.to_csv(path, index=False))
+
+    def write_normalized(path):
+        # a file object: np.savez would append .npz to the temporary name
+        with open(path, "wb") as f:
+            np.savez(f, values=normalized.values, normtime=normalized.normtime,
+                     channels=np.array(normalized.channels), trial=normalized.keys["trial"].to_numpy())
+
+    _write_atomic(os.path.join(participant_dir, "normalized.npz"), write_normalized)
+    _write_atomic(os.path.join(participant_dir, "condition_means.csv"), lambda path: frame.to_csv(path, index=False))
+
+    checkpoint = {
+        "version": PIPELINE_VERSION,
+        "participant": participant,
+        "params": params,
+        "fingerprint": fingerprint,
+        "n_trials": len(trials),
+        "n_outliers": int(trials["outlier"].sum()),
+        "n_conditions": len(means.groups),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+    def write_checkpoint(path):
+        with open(path, "w") as f:
+            json.dump(checkpoint, f, indent=2)
+
+    _write_atomic(os.path.join(participant_dir, CHECKPOINT), write_checkpoint)
+    return checkpoint
+
+
+def combine(output_dir: str, participants: List[str]):
+    """concatenate trials.csv and condition_means.csv of the participants into output_dir"""
+    import pandas as pd
+
+    for name in ("trials.csv", "condition_means.csv"):
+        parts = [pd.read_csv(os.path.join(output_dir, participant, name)) for participant in participants
+                 if os.path.exists(os.path.join(output_dir, participant, name))]
+        if parts:
+            combined = pd.concat(parts, ignore_index=True)
+            _write_atomic(os.path.join(output_dir, name), lambda path: combined.to_csv(path, index=False))
+
+
+def run(data_root: str, output_dir: str, participants: Union[str, List[str]] = None, workers: int = None,
+        force: bool = False, **params) -> List[str]:
+    """
+    Analyse all (or the given) participants, one participant per worker process, skipping the
+    participants whose checkpoint is up to date, and combine the results.
+
+    Args:
+        data_root: the data folder of the experiment, containing one folder per participant
+        output_dir: results folder
+        participants (optional): participant alias or list of aliases, defaults to all participants
+        workers: number of worker processes, defaults to the number of CPUs (1 runs in this process)
+        force: analyse the participants again even if their checkpoint is up to date
+        **params: analysis parameters, see DEFAULT_PARAMS
+
+    Returns:
+        the participants that failed (their errors are printed, the other participants are analysed)
+    """
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"unknown parameters {sorted(unknown)}, use {sorted(DEFAULT_PARAMS)}")
+    # lists rather than tuples: the parameters are compared with the ones read from the checkpoints
+    params = {**DEFAULT_PARAMS, **{name: list(value) if isinstance(value, tuple) else value
+                                   for name, value in params.items()}}
+    if participants is None:
+        participants = files.list_participants(data_root)
+    elif isinstance(participants, str):
+        participants = [participants]
+    os.makedirs(output_dir, exist_ok=True)
+
+    todo = []
+    for participant in participants:
+        fingerprint = files.fingerprint(files.find_trial_files(data_root, participant))
+        if force or not is_done(read_checkpoint(output_dir, participant), params, fingerprint):
+            todo.append(participant)
+    print(f"{len(participants)} participants, {len(participants) - len(todo)} up to date, {len(todo)} to analyse",
+          flush=True)
+
+    failed = []
+    start = time.perf_counter()
+
+    def report(done, participant, checkpoint=None, error=None):
+        prefix = f"[{done}/{len(todo)} {time.perf_counter() - start:7.1f} s] {participant}:"
+        if error is not None:
+            failed.append(participant)
+            print(f"{prefix} failed: {error!r}", flush=True)
+        else:
+            print(f"{prefix} {checkpoint['n_trials']} trials, {checkpoint['n_outliers']} outliers, "
+                  f"{checkpoint['n_conditions']} conditions ({checkpoint['seconds']:.1f} s)", flush=True)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(todo))
+    if workers <= 1:
+        for done, participant in enumerate(todo, 1):
+            try:
+                report(done, participant, analyze_participant(data_root, participant, output_dir, params))
+            except Exception as error:
+                report(done, participant, error=error)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = {pool.submit(analyze_participant, data_root, participant, output_dir, params): participant
+                       for participant in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    report(done, futures[future], future.result())
+                except Exception as error:
+                    report(done, futures[future], error=error)
+        except KeyboardInterrupt:
+            # the finished participants have their checkpoints, the next run continues with the others
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+
+    # all participants with up to date results for these parameters, also the ones of earlier runs; results
+    # of earlier runs whose trial files changed since (or of an older pipeline version) are left out
+    current, stale = [], []
+    for participant in files.list_participants(data_root):
+        checkpoint = read_checkpoint(output_dir, participant)
+        if participant in failed or checkpoint is None or checkpoint.get("params") != params:
+            continue
+        fingerprint = files.fingerprint(files.find_trial_files(data_root, participant))
+        (current if is_done(checkpoint, params, fingerprint) else stale).append(participant)
+    if stale:
+        print(f"not combined, results out of date (analyse them again): {', '.join(stale)}", flush=True)
+    combine(output_dir, current)
+    return failed
@@ -0,0 +1,251 @@
+# Streaming (out of core) statistics per condition for the Handeln experiment
+
+"""
+Condition statistics over any number of trials in bounded memory.
+
+The trial files are read in batches (trials -> kinematics -> normalize_trials, all from
+handeln_analysis.helpers). Every batch is reduced to per condition counts, means and sums
+of squared deviations, which are merged into running statistics (the parallel form of
+Welford's algorithm by Chan et al.). Memory depends on the batch size and the number of
+conditions only, not on the number of trials, and the results are the same (up to
+floating point rounding) as normalize_trials followed by condition_means on all data.
+
+Example:
+    from handeln_analysis import loader, streaming
+
+    files = loader.find_trial_files(os.path.join("02_Experiment_Code", "data"))
+    means, movement_times = streaming.stream_condition_stats(files, channels=['cursor_x', 'cursor_y', 'vabs'])
+    means.to_frame()
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import helpers, loader
+
+TRIAL_KEYS = ['participant', 'trial']
+
+KINEMATICS = {'vx', 'vy', 'vabs'}
+ACCELERATION = {'ax', 'ay', 'aabs'}
+
+
+class BatchStats(NamedTuple):
+    """Statistics of one batch of trials per condition (see batch_stats).
+
+    keys: the values of the by columns of every condition
+    n_trials: number of trials per condition
+    count, mean, m2: arrays (conditions x normalized time points x channels) with the number of finite
+        values, their mean and their sum of squared deviations
+    mt_count, mt_mean, mt_m2, mt_min, mt_max: the same for the movement time (arrays with one value
+        per condition), plus its minimum and maximum
+    normtime: the normalized time grid
+    channels: names of the channels
+    categorical: the by columns that are categorical (e.g. participant from loader.load_trials)
+    """
+    keys: List[tuple]
+    n_trials: np.ndarray
+    count: np.ndarray
+    mean: np.ndarray
+    m2: np.ndarray
+    mt_count: np.ndarray
+    mt_mean: np.ndarray
+    mt_m2: np.ndarray
+    mt_min: np.ndarray
+    mt_max: np.ndarray
+    normtime: np.ndarray
+    channels: List[str]
+    categorical: List[str]
+
+
+def _key(values) -> tuple:
+    # NaN never equals itself, use None for missing condition values in the keys
+    return tuple(None if isinstance(value, float) and np.isnan(value) else value for value in values)
+
+
+def batch_stats(data: pd.DataFrame, by: List[str] = ['cursor_SX', 'cursor_SY', 'cursor_shift'],
+                channels: List[str] = ['cursor_x', 'cursor_y'], n_points: int = 101, time_var: str = 'time',
+                timestamps: bool = False, mode: str = 'time') -> BatchStats:
+    """
+    Per condition statistics of the trials in data (e.g. one batch of loader.load_trials).
+
+    Args:
+        data (pd.DataFrame): trajectory data with conditions, identified by participant and trial
+        by: condition columns defining the groups
+        channels: columns to normalize. Kinematics channels (vx, vy, vabs, ax, ay, aabs) are computed
+            first with add_kinematics if they are not in data.
+        n_points: number of points in the normalized time grid
+        time_var: column with the time stamps
+        timestamps: use the actual time stamps for the kinematics (see batch_velocity)
+        mode: normalize by 'time', 'path' length or 'progress' towards the target (see normalize_trials)
+    """
+    missing = set(channels) - set(data.columns)
+    if missing & (KINEMATICS | ACCELERATION):
+        helpers.add_kinematics(data, TRIAL_KEYS, timestamps=timestamps, acceleration=bool(missing & ACCELERATION))
+    offsets = helpers.trial_offsets(data, TRIAL_KEYS)
+    normalized = helpers.normalize_trials(data, channels, n_points, TRIAL_KEYS, time_var, offsets=offsets, mode=mode)
+
+    codes = normalized.keys.groupby(list(by), sort=True, observed=True, dropna=False).ngroup().to_numpy()
+    first, n_trials, count, mean, m2 = helpers.grouped_moments(normalized.values, codes)
+    time = data[time_var].to_numpy(dtype=float)
+    movement_time = np.maximum.reduceat(time, offsets[:-1]) if len(time) else np.zeros(0)
+    mt_count, mt_mean, mt_m2 = helpers.grouped_moments(movement_time, codes)[2:]
+    with np.errstate(invalid='ignore'):
+        order = np.argsort(codes, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(n_trials)[:-1]))
+        mt_min = np.fmin.reduceat(movement_time[order], starts) if len(order) else np.zeros(0)
+        mt_max = np.fmax.reduceat(movement_time[order], starts) if len(order) else np.zeros(0)
+
+    keys = [_key(row) for row in normalized.keys[list(by)].iloc[first].itertuples(index=False)]
+    categorical = [col for col in by if isinstance(normalized.keys[col].dtype, pd.CategoricalDtype)]
+    return BatchStats(keys, n_trials, count, mean, m2, mt_count, mt_mean, mt_m2, mt_min, mt_max,
+                      normalized.normtime, normalized.channels, categorical)
+
+
+def _merge(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    # Chan et al.: combine the counts, means and M2 of two sets of values
+    count = count_a + count_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = mean_b - mean_a
+        weight = np.where(count > 0, count_b / count, 0)
+        mean = np.where(count_b > 0, np.where(count_a > 0, mean_a + delta * weight, mean_b), mean_a)
+        m2 = m2_a + m2_b + np.where((count_a > 0) & (count_b > 0), delta**2 * count_a * weight, 0)
+    return count, mean, m2
+
+
+class RunningConditionStats:
+    def __init__(self, by: List[str] = ['cursor_SX', 'cursor_SY', 'cursor_shift'], ddof: int = 1):
+        """
+        Running statistics per condition, updated batch by batch (see batch_stats).
+
+        Args:
+            by: condition columns defining the groups
+            ddof: delta degrees of freedom for the standard deviations
+        """
+        self.by = list(by)
+        self.ddof = ddof
+        self.stats: Dict[tuple, list] = {}
+        self.normtime = None
+        self.channels = None
+        self.categorical = []
+
+    def update(self, batch: BatchStats):
+        if self.channels is None:
+            self.normtime, self.channels, self.categorical = batch.normtime, batch.channels, batch.categorical
+        for i, key in enumerate(batch.keys):
+            new = [batch.n_trials[i], batch.count[i], batch.mean[i], batch.m2[i],
+                   batch.mt_count[i], batch.mt_mean[i], batch.mt_m2[i], batch.mt_min[i], batch.mt_max[i]]
+            if key not in self.stats:
+                self.stats[key] = new
+                continue
+            old = self.stats[key]
+            self.stats[key] = [old[0] + new[0],
+                               *_merge(*old[1:4], *new[1:4]),
+                               *_merge(*old[4:7], *new[4:7]),
+                               np.fmin(old[7], new[7]), np.fmax(old[8], new[8])]
+
+    def _groups(self) -> Tuple[pd.DataFrame, List[list]]:
+        # conditions sorted like the groups of condition_means (missing values last)
+        groups = pd.DataFrame(list(self.stats), columns=self.by)
+        for col in self.categorical:
+            groups[col] = groups[col].astype('category')
+        groups = groups.sort_values(self.by, kind='stable', na_position='last')
+        keys = list(self.stats)
+        return groups.reset_index(drop=True), [self.stats[keys[i]] for i in groups.index]
+
+    def condition_means(self) -> helpers.ConditionMeans:
+        """the mean, sd and sem per condition, like helpers.condition_means"""
+        groups, stats = self._groups()
+        n_trials = np.array([stat[0] for stat in stats], dtype=np.int64)
+        count = np.array([stat[1] for stat in stats])
+        mean = np.array([stat[2] for stat in stats])
+        m2 = np.array([stat[3] for stat in stats])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, mean, np.nan)
+            sd = np.sqrt(m2 / (count - self.ddof))
+            sem = sd / np.sqrt(count)
+        groups['n_trials'] = n_trials
+        return helpers.ConditionMeans(groups, mean, sd, sem, count, self.normtime, self.channels)
+
+    def movement_times(self) -> pd.DataFrame:
+        """mean, sd, minimum and maximum movement time per condition"""
+        groups, stats = self._groups()
+        count = np.array([stat[4] for stat in stats], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            groups['n_trials'] = np.array([stat[0] for stat in stats], dtype=np.int64)
+            groups['movement_time_mean'] = np.where(count > 0, [stat[5] for stat in stats], np.nan)
+            groups['movement_time_sd'] = np.sqrt(np.array([stat[6] for stat in stats]) / (count - self.ddof))
+            groups['movement_time_min'] = [stat[7] for stat in stats]
+            groups['movement_time_max'] = [stat[8] for stat in stats]
+        return groups
+
+
+def _load_batch_stats(files: List[Tuple[str, int, str]], params: Dict) -> BatchStats:
+    return batch_stats(loader.load_trials(files, workers=1), **params)
+
+
+def iter_batch_stats(files: List[Tuple[str, int, str]], batch_size: int = 256, workers: int = None,
+                     **params) -> Iterator[BatchStats]:
+    """
+    BatchStats of the trial files, batch_size files at a time. With workers > 1 the batches are
+    read and reduced in worker processes, at most a few batches ahead of the consumer.
+
+    Args:
+        files: list of (participant, trial number, file path), see loader.find_trial_files
+            or catalog.TrialCatalog.files
+        batch_size: number of trial files per batch
+        workers: number of worker processes, defaults to the number of CPUs (1 reads in this process)
+        **params: parameters of batch_stats (by, channels, n_points, time_var, timestamps, mode)
+    """
+    batches = [files[start:start + batch_size] for start in range(0, len(files), batch_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(batches))
+    if workers <= 1:
+        for batch in batches:
+            yield _load_batch_stats(batch, params)
+        return
+
+    # bounded prefetch: submitting all batches at once would keep all results in memory
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(_load_batch_stats, batch, params))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def stream_condition_stats(files: List[Tuple[str, int, str]], by: List[str] = ['cursor_SX', 'cursor_SY', 'cursor_shift'],
+                           channels: List[str] = ['cursor_x', 'cursor_y'], n_points: int = 101,
+                           batch_size: int = 256, workers: int = None, time_var: str = 'time',
+                           timestamps: bool = False, ddof: int = 1,
+                           mode: str = 'time') -> Tuple[helpers.ConditionMeans, pd.DataFrame]:
+    """
+    Mean trajectories and movement time statistics per condition, streaming over the trial files.
+
+    Args:
+        files: list of (participant, trial number, file path)
+        by: condition columns defining the groups, e.g. ['participant', 'cursor_shift']
+        channels: columns to normalize and average, including kinematics (vx, vy, vabs, ax, ay, aabs)
+        n_points: number of points in the normalized time grid
+        batch_size: number of trial files per batch
+        workers: number of worker processes (see iter_batch_stats)
+        time_var: column with the time stamps
+        timestamps: use the actual time stamps for the kinematics (see batch_velocity)
+        ddof: delta degrees of freedom for the standard deviations
+        mode: normalize by 'time', 'path' length or 'progress' towards the target (see normalize_trials)
+
+    Returns:
+        ConditionMeans (as condition_means) and a frame with the movement time statistics per condition
+    """
+    running = RunningConditionStats(by, ddof)
+    for batch in iter_batch_stats(files, batch_size, workers, by=list(by), channels=list(channels),
+                                  n_points=n_points, time_var=time_var, timestamps=timestamps, mode=mode):
+        running.update(batch)
+    return running.condition_means(), running.movement_times()